@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query
+from typing import Annotated
+
+from profiling import profiler
+from pydantic_classes import UserNoPass
+from security import get_user_and_check_active
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+)
+
+@router.get("/profiling/slowest")
+async def read_slowest_requests(current_user: Annotated[UserNoPass, Depends(get_user_and_check_active)],
+                                limit: Annotated[int, Query(ge=1, le=100)] = 20):
+    """
+    The slowest of the recently recorded requests, slowest first, each with its SQL statements and timings
+    and the speedscope file of its stack profile when it was sampled.
+    """
+    return {
+        "profiles_written": profiler.profiles_written,
+        "profiles_skipped": profiler.profiles_skipped,
+        "requests": profiler.slowest(limit),
+    }
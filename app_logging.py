@@ -0,0 +1,174 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Optional
+
+import metrics
+from app_config import config
+
+# Request handlers only put records on a bounded queue. A listener thread formats them and writes
+# the rotating log file, so a slow or full disk delays the log, never a request. When the queue is
+# full records are dropped (and counted) rather than waited for. Repeats of the same warning or error
+# (same logger, source line and exception type) are let through burst times per window, the rest
+# are counted and reported on the next one that gets through.
+LOG_FILE = config.get("logging", "file", fallback="app.log")
+LOG_LEVEL = config.get("logging", "level", fallback="INFO").upper()
+LOG_FORMAT = config.get("logging", "format", fallback="json")
+MAX_BYTES = config.getint("logging", "max_megabytes", fallback=10) * 1024 * 1024
+BACKUP_COUNT = config.getint("logging", "backup_count", fallback=5)
+QUEUE_SIZE = config.getint("logging", "queue_size", fallback=10000)
+SAMPLE_WINDOW = config.getfloat("logging", "sample_window_seconds", fallback=60.0)
+SAMPLE_BURST = config.getint("logging", "sample_burst", fallback=10)
+CAPTURE_UVICORN = config.getboolean("logging", "capture_uvicorn", fallback=False)
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+log_records_dropped = metrics.registry.register(metrics.Counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full."))
+log_records_suppressed = metrics.registry.register(metrics.Counter(
+    "log_records_suppressed_total", "Repeated warnings and errors left out by sampling."))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        return json.dumps(entry, default=str)
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}"
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "suppressed", 0):
+            text += f" [{record.suppressed} similar records suppressed]"
+        return text
+
+
+class RepeatSampler(logging.Filter):
+    """Lets each kind of warning/error through at most burst times per window."""
+
+    def __init__(self, window: float = SAMPLE_WINDOW, burst: int = SAMPLE_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        # key -> [window start, records let through, records suppressed]
+        self._seen: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        key = (record.name, record.levelno, record.pathname, record.lineno, exc_type)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if len(self._seen) > 10000:
+                    self._seen.clear()
+                suppressed = entry[2] if entry else 0
+                self._seen[key] = [now, 1, 0]
+            elif entry[1] < self.burst:
+                entry[1] += 1
+                suppressed, entry[2] = entry[2], 0
+            else:
+                entry[2] += 1
+                log_records_suppressed.inc()
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Never waits for room on the queue, and keeps the traceback as text instead of folding it into the message."""
+
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+        # Tracebacks and args can hold anything, the listener thread only needs text
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # The queue may be full at shutdown, wait for the listener to make room
+        self.queue.put(self._sentinel)
+
+
+_listener: Optional[_Listener] = None
+_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def configure_logging(filename: str = LOG_FILE, level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Replaces the root handlers with the queue handler and starts the writer thread. Safe to call again."""
+    global _listener, _handler
+    shutdown_logging()
+
+    file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT,
+                                                        encoding="utf-8", delay=True)
+    file_handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(TEXT_FORMAT))
+    log_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+    _handler = NonBlockingQueueHandler(log_queue)
+    _handler.addFilter(RepeatSampler())
+    _listener = _Listener(log_queue, file_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(level)
+    if CAPTURE_UVICORN:
+        # uvicorn writes its own logs to the console from the event loop thread
+        for name in ("uvicorn", "uvicorn.access"):
+            uvicorn_logger = logging.getLogger(name)
+            uvicorn_logger.handlers.clear()
+            uvicorn_logger.propagate = True
+    _listener.start()
+
+
+def shutdown_logging():
+    """Writes out whatever is still queued and stops the writer thread."""
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
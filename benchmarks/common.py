@@ -0,0 +1,129 @@
+"""Shared pieces of the benchmark scripts: synthetic catalogs, percentiles and result files."""
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from app_config import config
+
+# Benchmarks never want every statement echoed
+config.set("database", "echo", "false")
+config.set("rate_limits", "enabled", "false")
+
+from data_base import database_engine  # noqa: E402
+from data_base.database_service_impl import DatabaseServiceImpl  # noqa: E402
+from pydantic_classes import Item, Stats, User  # noqa: E402
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+DATA_DIR = Path(__file__).parent / "data"
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+WORDS = ["sword", "shield", "blade", "armor", "cloak", "amulet", "ring", "boots", "tome", "crystal", "spear", "bow"]
+
+
+def catalog_size(value: str) -> int:
+    return SIZES.get(value) or int(value)
+
+
+def item_name(number: int) -> str:
+    return f"Item {number:06d}"
+
+
+def synthetic_items(count: int, seed: int = 19) -> list[Item]:
+    """The same catalog for the same (count, seed): 0-4 random stats per item, prices 100-5000."""
+    rng = random.Random(seed)
+    stats = list(Stats)
+    items = []
+    for number in range(count):
+        price = rng.randint(100, 5000)
+        items.append(Item(
+            name=item_name(number),
+            description=" ".join(rng.choices(WORDS, k=6)),
+            stats={stat: rng.randint(1, 100) for stat in rng.sample(stats, rng.randint(0, 4))},
+            price=price,
+            sell_price=rng.randint(0, price - 1),
+        ))
+    return items
+
+
+def database_url(path: Path) -> str:
+    return f"sqlite:///{path.resolve()}"
+
+
+def seed_database(path: Path, count: int, seed: int = 19, batch_size: int = 5000) -> float:
+    """
+    Creates or refills the database at path through the real write path (DatabaseServiceImpl.bulk_upsert),
+    so indexes, the search table and the catalog version are what the app would have. Returns the seconds taken.
+    """
+    from security import pwd_context
+
+    started = time.perf_counter()
+    database_engine.dispose_database()
+    database_engine.init_database(database_url(path))
+    service = DatabaseServiceImpl()
+    items = synthetic_items(count, seed)
+    for start in range(0, count, batch_size):
+        service.bulk_upsert(items[start:start + batch_size])
+    try:
+        service.get_user(BENCH_USER)
+    except Exception:
+        service.create_user(User(user_name=BENCH_USER, password=pwd_context.hash(BENCH_PASSWORD)))
+    return time.perf_counter() - started
+
+
+def default_database(items: str, seed: int = 19) -> Path:
+    return DATA_DIR / f"catalog-{items}-{seed}.db"
+
+
+def working_copy(items: str, seed: int = 19, reseed: bool = False) -> Path:
+    """
+    A scratch copy of the seeded catalog (seeded first if needed), so writes made by one run
+    never leak into the next one and every run starts from the same data.
+    """
+    source = default_database(items, seed)
+    if reseed or not source.exists():
+        source.parent.mkdir(parents=True, exist_ok=True)
+        source.unlink(missing_ok=True)
+        print(f"seeding {catalog_size(items)} items into {source}...")
+        seed_database(source, catalog_size(items), seed)
+        database_engine.dispose_database()
+    copy = Path(tempfile.mkdtemp(prefix="lolitems-bench-")) / "catalog.db"
+    shutil.copyfile(source, copy)
+    return copy
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50/p95/p99 and mean of samples given in seconds, reported in milliseconds."""
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    ordered = sorted(samples)
+
+    def at(share: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))] * 1000
+
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "mean_ms": statistics.fmean(ordered) * 1000}
+
+
+def environment() -> dict:
+    return {"python": sys.version.split()[0], "platform": platform.platform(), "machine": platform.machine()}
+
+
+def write_results(suite: str, parameters: dict, results: dict, output: Optional[Path]) -> dict:
+    document = {
+        "suite": suite,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "parameters": parameters,
+        "results": results,
+    }
+    if output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(document, indent=2))
+        print(f"results written to {output}")
+    return document
@@ -0,0 +1,91 @@
+"""
+Compares a result file of benchmarks.load or benchmarks.micro against a baseline of the same suite.
+
+    python -m benchmarks.compare results/load.json baselines/load.json [--threshold 0.15] [--update-baseline]
+
+Latencies (*_ms, *_ns) regress when they grow, throughputs (throughput_rps, ops_per_second) when
+they shrink, by more than --threshold (a share, 0.15 = 15%). Exits 1 when anything regressed, so it
+can gate a CI job. --update-baseline accepts the results as the new baseline.
+Baselines are only comparable on the same machine with the same parameters.
+"""
+import argparse
+import json
+import shutil
+import sys
+from pathlib import Path
+
+LOWER_IS_BETTER = ("_ms", "_ns")
+# The headline numbers of each case, the rest (mean, min...) only add noise to the table
+COMPARED = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "median_ns", "ops_per_second")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> tuple[list[tuple], list[str]]:
+    """Rows of (case, metric, baseline, current, change, verdict) and the warnings about the comparison itself."""
+    warnings = []
+    if results["suite"] != baseline["suite"]:
+        raise ValueError(f"cannot compare a {results['suite']} run with a {baseline['suite']} baseline")
+    if results["parameters"] != baseline["parameters"]:
+        warnings.append(f"parameters differ: {baseline['parameters']} -> {results['parameters']}")
+    if results["environment"] != baseline["environment"]:
+        warnings.append("the baseline was recorded on a different environment")
+
+    rows = []
+    for case, current in results["results"].items():
+        previous = baseline["results"].get(case)
+        if previous is None:
+            warnings.append(f"{case} is not in the baseline")
+            continue
+        if current.get("errors"):
+            rows.append((case, "errors", previous.get("errors", 0), current["errors"], None, "ERRORS"))
+        for metric in COMPARED:
+            if metric not in current or current[metric] is None or not previous.get(metric):
+                continue
+            change = current[metric] / previous[metric] - 1
+            if metric.endswith(LOWER_IS_BETTER):
+                regressed, improved = change > threshold, change < -threshold
+            else:
+                regressed, improved = change < -threshold, change > threshold
+            verdict = "REGRESSED" if regressed else "improved" if improved else ""
+            rows.append((case, metric, previous[metric], current[metric], change, verdict))
+    for case in baseline["results"].keys() - results["results"].keys():
+        warnings.append(f"{case} is missing from the results")
+    return rows, warnings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("results", type=Path)
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    if not args.baseline.exists():
+        if args.update_baseline:
+            args.baseline.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(args.results, args.baseline)
+            print(f"no baseline yet, {args.results} saved as {args.baseline}")
+            return
+        sys.exit(f"{args.baseline} does not exist, run with --update-baseline to create it")
+
+    results = json.loads(args.results.read_text())
+    baseline = json.loads(args.baseline.read_text())
+    rows, warnings = compare(results, baseline, args.threshold)
+    for warning in warnings:
+        print(f"warning: {warning}")
+    print(f"{'case':40} {'metric':16} {'baseline':>14} {'current':>14} {'change':>8}")
+    for case, metric, previous, current, change, verdict in rows:
+        change_text = f"{change:+.1%}" if change is not None else ""
+        print(f"{case:40} {metric:16} {previous:14.3f} {current:14.3f} {change_text:>8}  {verdict}")
+
+    failed = any(verdict in ("REGRESSED", "ERRORS") for *_, verdict in rows)
+    if args.update_baseline:
+        shutil.copyfile(args.results, args.baseline)
+        print(f"baseline {args.baseline} updated")
+    if failed:
+        print(f"regressions beyond {args.threshold:.0%} against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Load test of the real application: item reads, filtered lists, item writes and login,
+reported as throughput and p50/p95/p99 latency per scenario.
+
+    python -m benchmarks.load [--items 1k|10k|100k] [--mode inprocess|uvicorn|both]
+                              [--requests 2000] [--concurrency 16] [--output results/load.json]
+
+inprocess drives main.app through httpx's ASGI transport (no sockets, so it isolates the app's own cost).
+uvicorn starts `uvicorn main:app` in a subprocess against a config.ini pointing at the benchmark database.
+Every mode starts from a fresh copy of the seeded catalog, see benchmarks.common.working_copy.
+"""
+import argparse
+import asyncio
+import configparser
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import httpx
+
+from benchmarks.common import (BENCH_PASSWORD, BENCH_USER, catalog_size, database_url, item_name, percentiles,
+                               working_copy, write_results)
+from pydantic_classes import Stats
+
+ROOT = Path(__file__).resolve().parent.parent
+# bcrypt makes login two orders of magnitude slower than anything else, so it gets a share of the requests
+LOGIN_SHARE = 0.05
+
+Request = Callable[[httpx.AsyncClient, random.Random, int], Awaitable[httpx.Response]]
+
+
+async def run_scenario(client: httpx.AsyncClient, request: Request, total: int, concurrency: int,
+                       seed: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(number: int):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + number)
+        for sequence in counter:
+            started = time.perf_counter()
+            try:
+                response = await request(client, rng, sequence)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    seconds = time.perf_counter() - started
+    return {"requests": total, "errors": errors, "seconds": seconds, "throughput_rps": total / seconds,
+            **percentiles(latencies)}
+
+
+def scenarios(count: int, token: str) -> dict[str, tuple[Request, float]]:
+    """name -> (request, share of --requests)"""
+    auth = {"Authorization": f"Bearer {token}"}
+    stats = [stat.value for stat in Stats]
+
+    def body(name: str, rng: random.Random) -> dict:
+        price = rng.randint(100, 5000)
+        return {"name": name, "description": "benchmark write", "price": price, "sell_price": price // 2,
+                "stats": {stat: rng.randint(1, 100) for stat in rng.sample(stats, 2)}}
+
+    async def read_item(client, rng, sequence):
+        return await client.get(f"/items/{item_name(rng.randrange(count))}")
+
+    async def filtered_list(client, rng, sequence):
+        return await client.get("/items/", params={"stats": rng.sample(stats, 2), "price": rng.randint(100, 4000),
+                                                   "price_greater_than": "true", "limit": 100})
+
+    async def filtered_list_full(client, rng, sequence):
+        return await client.get("/items/", params={"stats": rng.sample(stats, 1), "limit": 100, "full": "true",
+                                                   "cursor": item_name(rng.randrange(count))})
+
+    async def create_item(client, rng, sequence):
+        return await client.post("/items/", json=body(f"Bench {rng.random():.12f}"[:30], rng), headers=auth)
+
+    async def update_item(client, rng, sequence):
+        name = item_name(rng.randrange(count))
+        return await client.put(f"/items/{name}", json=body(name, rng), headers=auth)
+
+    async def login(client, rng, sequence):
+        return await client.post("/token/", data={"username": BENCH_USER, "password": BENCH_PASSWORD})
+
+    return {
+        "read_item": (read_item, 1.0),
+        "filtered_list": (filtered_list, 1.0),
+        "filtered_list_full": (filtered_list_full, 0.5),
+        "create_item": (create_item, 0.5),
+        "update_item": (update_item, 0.5),
+        "login": (login, LOGIN_SHARE),
+    }
+
+
+async def run_all(client: httpx.AsyncClient, count: int, requests: int, concurrency: int, seed: int) -> dict:
+    response = await client.post("/token/", data={"username": BENCH_USER, "password": BENCH_PASSWORD})
+    response.raise_for_status()
+    results = {}
+    for name, (request, share) in scenarios(count, response.json()["access_token"]).items():
+        total = max(concurrency, int(requests * share))
+        results[name] = await run_scenario(client, request, total, concurrency, seed)
+        result = results[name]
+        print(f"  {name:20} {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:7.2f} ms  "
+              f"p95 {result['p95_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  errors {result['errors']}")
+    return results
+
+
+async def run_inprocess(database: Path, count: int, requests: int, concurrency: int, seed: int) -> dict:
+    from data_base import database_engine
+
+    database_engine.dispose_database()
+    await database_engine.dispose_async_database()
+    # The lifespan of main.app keeps engines that already exist
+    database_engine.init_database(database_url(database))
+    database_engine.init_async_database(database_engine._to_async_url(database_url(database)))
+    import main
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            return await run_all(client, count, requests, concurrency, seed)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_uvicorn(database: Path, count: int, requests: int, concurrency: int, seed: int) -> dict:
+    # app_config reads config.ini from the working directory, so the server runs from a scratch directory
+    # holding a copy of the project's config.ini pointed at the benchmark database
+    workdir = database.parent
+    server_config = configparser.ConfigParser()
+    server_config.read(ROOT / "config.ini")
+    server_config["database"]["url"] = database_url(database)
+    server_config["database"]["echo"] = "false"
+    server_config["rate_limits"]["enabled"] = "false"
+    server_config["database"].pop("async_url", None)
+    with open(workdir / "config.ini", "w") as config_file:
+        server_config.write(config_file)
+
+    port = _free_port()
+    environment = {**os.environ, "PYTHONPATH": os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")])}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=environment,
+    )
+    try:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            for _ in range(300):
+                try:
+                    await client.get("/")
+                    break
+                except httpx.HTTPError:
+                    if server.poll() is not None:
+                        raise RuntimeError("uvicorn exited during startup")
+                    await asyncio.sleep(0.1)
+            return await run_all(client, count, requests, concurrency, seed)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", default="10k")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="both")
+    parser.add_argument("--requests", type=int, default=2000, help="requests of the read scenarios, others get a share")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=19)
+    parser.add_argument("--reseed", action="store_true", help="rebuild the seeded catalog")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    count = catalog_size(args.items)
+    modes = ["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]
+    results = {}
+    for mode in modes:
+        database = working_copy(args.items, args.seed, args.reseed and mode == modes[0])
+        print(f"{mode}: {count} items, concurrency {args.concurrency}")
+        try:
+            runner = run_inprocess if mode == "inprocess" else run_uvicorn
+            for name, result in asyncio.run(runner(database, count, args.requests, args.concurrency, args.seed)).items():
+                results[f"{mode}.{name}"] = result
+        finally:
+            shutil.rmtree(database.parent, ignore_errors=True)
+
+    write_results("load", {"items": count, "requests": args.requests, "concurrency": args.concurrency,
+                           "seed": args.seed, "modes": modes}, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Micro-benchmarks of the hot paths below the HTTP layer: pydantic Item construction and
+serialization, and the DatabaseServiceImpl methods the routers call.
+
+    python -m benchmarks.micro [--items 1k|10k|100k] [--repeat 5] [--filter get_page] [--output results/micro.json]
+
+Each case is timed with timeit (autoranged to about 0.2 s a round), --repeat rounds, and reported
+as the median time per call. Writes go to a scratch copy of the seeded catalog.
+"""
+import argparse
+import random
+import shutil
+import statistics
+import timeit
+from pathlib import Path
+from typing import Callable
+
+from benchmarks.common import (catalog_size, database_url, item_name, synthetic_items, working_copy,
+                               write_results)
+from data_base import database_engine
+from data_base.database_service_impl import DatabaseServiceImpl
+from pydantic_classes import Item, Stats
+
+
+def measure(case: Callable[[], object], repeat: int) -> dict:
+    timer = timeit.Timer(case)
+    number, _ = timer.autorange()
+    rounds = [seconds / number for seconds in timer.repeat(repeat=repeat, number=number)]
+    median = statistics.median(rounds)
+    return {"median_ns": median * 1e9, "min_ns": min(rounds) * 1e9, "calls_per_round": number,
+            "ops_per_second": 1 / median}
+
+
+def model_cases(count: int) -> dict[str, Callable[[], object]]:
+    item = synthetic_items(1)[0]
+    raw = item.model_dump(mode="json")
+    stats = dict(item.stats)
+    return {
+        "item.construct": lambda: Item(name=item.name, description=item.description, stats=stats,
+                                       price=item.price, sell_price=item.sell_price),
+        "item.model_validate": lambda: Item.model_validate(raw),
+        "item.model_dump": lambda: item.model_dump(),
+        "item.model_dump_json": lambda: item.model_dump_json(),
+    }
+
+
+def service_cases(service: DatabaseServiceImpl, count: int) -> dict[str, Callable[[], object]]:
+    rng = random.Random(19)
+    stat_names = [stat.value for stat in Stats]
+    names = [item_name(number) for number in range(count)]
+    batch = rng.sample(names, min(100, count))
+    page_start = names[count // 2]
+
+    def update():
+        item = service.get(rng.choice(names))
+        item.price = rng.randint(100, 5000)
+        item.sell_price = item.price // 2
+        return service.update(item.name, item)
+
+    return {
+        "service.get": lambda: service.get(rng.choice(names)),
+        "service.get_versioned": lambda: service.get_versioned(rng.choice(names)),
+        "service.get_catalog_version": service.get_catalog_version,
+        "service.get_many_100": lambda: service.get_many(batch),
+        "service.get_page_100": lambda: service.get_page(page_start, 100),
+        "service.get_page_100_full": lambda: service.get_page(page_start, 100, full=True),
+        "service.get_page_100_filtered": lambda: service.get_page(
+            None, 100, set(rng.sample(stat_names, 1)), (rng.randint(100, 4000), True)),
+        "service.get_all_filtered": lambda: service.get_all(set(rng.sample(stat_names, 2)), (2500, True)),
+        "service.search": lambda: service.search(rng.choice(["sword", "blade", "arm", "ring boots", "tome"])),
+        "service.update": update,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", default="10k")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=19)
+    parser.add_argument("--reseed", action="store_true", help="rebuild the seeded catalog")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    count = catalog_size(args.items)
+    database = working_copy(args.items, args.seed, args.reseed)
+    try:
+        database_engine.dispose_database()
+        database_engine.init_database(database_url(database))
+        cases = {**model_cases(count), **service_cases(DatabaseServiceImpl(), count)}
+        results = {}
+        for name, case in cases.items():
+            if args.filter not in name:
+                continue
+            results[name] = measure(case, args.repeat)
+            print(f"  {name:32} {results[name]['median_ns'] / 1000:10.2f} us  "
+                  f"{results[name]['ops_per_second']:12.0f} ops/s")
+    finally:
+        database_engine.dispose_database()
+        shutil.rmtree(database.parent, ignore_errors=True)
+
+    write_results("micro", {"items": count, "repeat": args.repeat, "seed": args.seed}, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
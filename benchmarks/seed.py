@@ -0,0 +1,30 @@
+"""
+Seeds a SQLite database with a synthetic catalog and the benchmark user.
+
+    python -m benchmarks.seed [--items 1k|10k|100k|<count>] [--db benchmarks/data/catalog-10k-19.db] [--seed 19]
+
+The same --items and --seed always give the same catalog. Point --db at data_base/database.db to
+load the catalog into the app's own database (its items with the same names are replaced).
+"""
+import argparse
+from pathlib import Path
+
+from benchmarks.common import BENCH_PASSWORD, BENCH_USER, catalog_size, default_database, seed_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", default="10k")
+    parser.add_argument("--db", type=Path)
+    parser.add_argument("--seed", type=int, default=19)
+    args = parser.parse_args()
+
+    path = args.db or default_database(args.items, args.seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    seconds = seed_database(path, catalog_size(args.items), args.seed)
+    print(f"seeded {catalog_size(args.items)} items into {path} in {seconds:.1f} s "
+          f"(user {BENCH_USER!r} / {BENCH_PASSWORD!r})")
+
+
+if __name__ == "__main__":
+    main()
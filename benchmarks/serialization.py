@@ -0,0 +1,88 @@
+"""
+Per-request CPU time of the item endpoints with the default response_model path and with [responses] fast_json.
+
+    python -m benchmarks.serialization [--items 2000] [--requests 200]
+
+Runs in-process (TestClient) against a throwaway SQLite database, so the numbers include the
+whole request: routing, the database read and serialization. Both modes run the same requests,
+so the difference between them is what the fast path saves.
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+
+from app_config import config
+
+config.set("database", "echo", "false")
+config.set("rate_limits", "enabled", "false")
+
+import fast_json  # noqa: E402
+from data_base import database_engine  # noqa: E402
+from data_base.database_service_impl import DatabaseServiceImpl  # noqa: E402
+from pydantic_classes import Item, Stats  # noqa: E402
+
+
+def seed(count: int) -> list[str]:
+    rng = random.Random(15)
+    items = [
+        Item(name=f"Item {number:05d}", description="Benchmark item " * 4,
+             stats={stat: rng.randint(1, 100) for stat in rng.sample(list(Stats), 3)},
+             price=rng.randint(300, 3500), sell_price=100)
+        for number in range(count)
+    ]
+    DatabaseServiceImpl().bulk_upsert(items)
+    return [item.name for item in items]
+
+
+def cpu_per_request(client: TestClient, paths: list[str], requests: int) -> float:
+    for path in paths[:50]:
+        client.get(path)
+    started = time.process_time()
+    for number in range(requests):
+        response = client.get(paths[number % len(paths)])
+        assert response.status_code == 200, response.text
+    return (time.process_time() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        url = f"sqlite:///{directory}/benchmark.db"
+        # The lifespan of main.app keeps engines that already exist
+        database_engine.init_database(url)
+        database_engine.init_async_database(database_engine._to_async_url(url))
+        names = seed(args.items)
+
+        import main as application
+
+        cases = {
+            "GET /items/{name}": [f"/items/{name}" for name in names],
+            "GET /items/?limit=100&full=true": ["/items/?limit=100&full=true"],
+            "GET /items/?limit=1000&full=true": ["/items/?limit=1000&full=true"],
+            "GET /items/ (all names)": ["/items/"],
+        }
+        print(f"{args.items} items, {args.requests} requests per case, orjson={'yes' if fast_json.orjson else 'no'}")
+        print(f"{'endpoint':36} {'model µs':>10} {'fast µs':>10} {'saved':>8}")
+        with TestClient(application.app) as client:
+            for label, paths in cases.items():
+                timings = {}
+                for enabled in (False, True):
+                    fast_json.FAST_JSON_ENABLED = enabled
+                    timings[enabled] = cpu_per_request(client, paths, args.requests)
+                saved = 1 - timings[True] / timings[False]
+                print(f"{label:36} {timings[False] * 1e6:10.0f} {timings[True] * 1e6:10.0f} {saved:8.0%}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, without it POST /builds/optimize answers 503
+    np = None
+
+from fastapi import HTTPException
+from starlette import status
+
+from app_config import config
+from data_base.database_service import AsyncDatabaseService
+from data_base.ttl_cache import TTLCache
+from pydantic_classes import Build, BuildRequest, Item, Stats
+
+STAT_FIELDS = [stat.value for stat in Stats]
+# Share of the time limit a split search spends searching serially before it fans out
+RAMP_UP_SHARE = 0.1
+
+
+class _TimeUp(Exception):
+    pass
+
+
+# Runs inside the pool, so it only takes plain lists and must stay importable for a process pool.
+def search_builds(prices: list[float], scores: list[float], budget: float, slots: int, deadline: float,
+                  first_choices: Optional[Sequence[int]] = None,
+                  incumbent: tuple[float, tuple[int, ...]] = (0.0, ())) -> tuple[float, tuple[int, ...], bool]:
+    """
+    Branch and bound over combinations of at most slots distinct items costing at most budget,
+    maximizing the summed score. Items must come sorted by score, best first, all with a positive score.
+    A branch is cut when even the best case can't beat the incumbent: the next items' scores for every
+    free slot, or the best score per gold over the remaining budget, whichever is lower.
+    first_choices restricts the first item picked, which is how a search is split between workers.
+    Returns (score, item positions, whether the search finished before deadline).
+    """
+    count = len(scores)
+    prefix = [0.0]
+    for score in scores:
+        prefix.append(prefix[-1] + score)
+    # Best score per gold among items i.., inf when a free item is left
+    best_ratio = [0.0] * (count + 1)
+    for i in range(count - 1, -1, -1):
+        ratio = scores[i] / prices[i] if prices[i] > 0 else float("inf")
+        best_ratio[i] = max(ratio, best_ratio[i + 1])
+
+    best_score, best_items = incumbent
+    chosen: list[int] = []
+    nodes = 0
+
+    def visit(candidates, free_slots: int, budget_left: float, score: float):
+        nonlocal best_score, best_items, nodes
+        for i in candidates:
+            # Both bounds only shrink as i grows, so the first hopeless item ends the loop
+            bound = min(prefix[min(count, i + free_slots)] - prefix[i], budget_left * best_ratio[i])
+            if score + bound <= best_score:
+                return
+            if prices[i] > budget_left:
+                continue
+            nodes += 1
+            if nodes % 4096 == 0 and time.monotonic() > deadline:
+                raise _TimeUp()
+            chosen.append(i)
+            if score + scores[i] > best_score:
+                best_score, best_items = score + scores[i], tuple(chosen)
+            if free_slots > 1:
+                visit(range(i + 1, count), free_slots - 1, budget_left - prices[i], score + scores[i])
+            chosen.pop()
+
+    try:
+        visit(first_choices if first_choices is not None else range(count), slots, budget, 0.0)
+    except _TimeUp:
+        return best_score, best_items, False
+    return best_score, best_items, True
+
+
+def greedy_build(prices: list[float], scores: list[float], budget: float, slots: int) -> tuple[float, tuple[int, ...]]:
+    """A quick incumbent for search_builds: the best items that still fit, in score order."""
+    chosen, spent, total = [], 0.0, 0.0
+    for i, (price, score) in enumerate(zip(prices, scores)):
+        if len(chosen) == slots:
+            break
+        if spent + price <= budget:
+            chosen.append(i)
+            spent += price
+            total += score
+    return total, tuple(chosen)
+
+
+class Catalog:
+    """Every item of one catalog version, with prices and stats as NumPy columns for vectorized scoring."""
+
+    def __init__(self, version: int, items: list[Item]):
+        self.version = version
+        self.items = items
+        self.prices = np.array([item.price for item in items], dtype=float)
+        self.stats = np.zeros((len(items), len(STAT_FIELDS)))
+        for row, item in enumerate(items):
+            for stat, value in item.stats.items():
+                self.stats[row, STAT_FIELDS.index(Stats(stat).value)] = value
+
+
+class BuildOptimizer:
+    """
+    Answers POST /builds/optimize off the event loop. Every search runs on a thread of its own pool.
+    With use_processes, a search over more than process_threshold candidates is split by first item
+    across a process pool, so several cores work on it.
+    Catalog snapshots and finished results are cached by catalog version, so a write invalidates both.
+    """
+
+    def __init__(self, workers: int = 2, use_processes: bool = False, process_threshold: int = 2000,
+                 time_limit_ms: int = 2000, max_time_limit_ms: int = 10000, cache: Optional[TTLCache] = None):
+        self.workers = workers
+        self.process_threshold = process_threshold
+        self.time_limit_ms = time_limit_ms
+        self.max_time_limit_ms = max_time_limit_ms
+        self.cache = cache if cache is not None else TTLCache(max_entries=256, ttl_seconds=300.0)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="build-optimizer")
+        self.process_executor: Optional[Executor] = ProcessPoolExecutor(max_workers=workers) if use_processes else None
+        self._catalog: Optional[Catalog] = None
+        self._catalog_lock: Optional[asyncio.Lock] = None
+        self._catalog_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_catalog_lock(self) -> asyncio.Lock:
+        # An asyncio.Lock belongs to the first loop that waits on it, and the optimizer outlives loops
+        # (an app restarted in the same process, one test client after another), so each loop gets its own
+        loop = asyncio.get_running_loop()
+        if self._catalog_lock_loop is not loop:
+            self._catalog_lock, self._catalog_lock_loop = asyncio.Lock(), loop
+        return self._catalog_lock
+
+    async def _get_catalog(self, database_service: AsyncDatabaseService, version: int) -> Catalog:
+        async with self._get_catalog_lock():
+            if self._catalog is None or self._catalog.version != version:
+                items = [item async for item in database_service.iter_items()]
+                self._catalog = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, Catalog, version, items)
+            return self._catalog
+
+    def _solve(self, catalog: Catalog, request: BuildRequest, time_limit_ms: int) -> Build:
+        deadline = time.monotonic() + time_limit_ms / 1000
+        weights = np.zeros(len(STAT_FIELDS))
+        for stat, weight in request.weights.items():
+            weights[STAT_FIELDS.index(Stats(stat).value)] = weight
+        scores = catalog.stats @ weights
+        # An item that scores nothing or costs more than the budget can't be in the best build
+        candidates = np.flatnonzero((scores > 0) & (catalog.prices <= request.budget))
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        prices, candidate_scores = catalog.prices[candidates].tolist(), scores[candidates].tolist()
+
+        incumbent = greedy_build(prices, candidate_scores, request.budget, request.slots)
+        split = self.process_executor is not None and len(candidates) > self.process_threshold
+        # Split workers can't see each other's incumbents, so a short serial pass finds a strong one first.
+        # Without it most workers spend their time proving branches that a shared incumbent would have cut.
+        serial_deadline = time.monotonic() + time_limit_ms / 1000 * RAMP_UP_SHARE if split else deadline
+        score, positions, complete = search_builds(prices, candidate_scores, request.budget, request.slots,
+                                                   serial_deadline, None, incumbent)
+        if not complete and split:
+            futures = [
+                self.process_executor.submit(search_builds, prices, candidate_scores, request.budget, request.slots,
+                                             deadline, range(worker, len(candidates), self.workers),
+                                             (score, positions))
+                for worker in range(self.workers)
+            ]
+            results = [future.result() for future in futures]
+            score, positions, _ = max(results, key=lambda result: result[0])
+            complete = all(result[2] for result in results)
+
+        chosen = [catalog.items[candidates[position]] for position in positions]
+        totals: dict[Stats, int] = {}
+        for item in chosen:
+            for stat, value in item.stats.items():
+                totals[Stats(stat)] = totals.get(Stats(stat), 0) + value
+        return Build(items=chosen, cost=sum(item.price for item in chosen), score=score, stats=totals,
+                     optimal=complete, catalog_version=catalog.version)
+
+    async def optimize(self, database_service: AsyncDatabaseService, request: BuildRequest) -> Build:
+        if np is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="The build optimizer needs numpy")
+        version = (await database_service.get_catalog_version()).version
+        key = (version, tuple(sorted((Stats(stat).value, weight) for stat, weight in request.weights.items())),
+               request.budget, request.slots)
+        build = self.cache.get(key)
+        if build is not None:
+            return build
+        generation = self.cache.generation
+        catalog = await self._get_catalog(database_service, version)
+        time_limit_ms = min(request.time_limit_ms or self.time_limit_ms, self.max_time_limit_ms)
+        build = await asyncio.get_running_loop().run_in_executor(self.executor, self._solve, catalog, request,
+                                                                  time_limit_ms)
+        # A search cut short by its time limit might do better with more time, so only complete ones are kept
+        if build.optimal:
+            self.cache.set(key, build, generation)
+        return build
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.process_executor is not None:
+            self.process_executor.shutdown(wait=False, cancel_futures=True)
+
+
+_optimizer: Optional[BuildOptimizer] = None
+_optimizer_lock = threading.Lock()
+
+
+def get_build_optimizer() -> BuildOptimizer:
+    """Process-wide optimizer sized by the [builds] section of config.ini."""
+    global _optimizer
+    with _optimizer_lock:
+        if _optimizer is None:
+            _optimizer = BuildOptimizer(
+                workers=config.getint("builds", "workers", fallback=2),
+                use_processes=config.get("builds", "executor", fallback="thread") == "process",
+                process_threshold=config.getint("builds", "process_threshold", fallback=2000),
+                time_limit_ms=config.getint("builds", "time_limit_ms", fallback=2000),
+                max_time_limit_ms=config.getint("builds", "max_time_limit_ms", fallback=10000),
+                cache=TTLCache(
+                    max_entries=config.getint("builds", "cache_max_entries", fallback=256),
+                    ttl_seconds=config.getfloat("builds", "cache_ttl_seconds", fallback=300.0),
+                ),
+            )
+        return _optimizer
+
+
+def shutdown_build_optimizer():
+    global _optimizer
+    with _optimizer_lock:
+        if _optimizer is not None:
+            _optimizer.shutdown()
+        _optimizer = None
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+from typing import Annotated
+
+from build_optimizer import BuildOptimizer, get_build_optimizer
+from data_base.database_provider import async_database_provider
+from data_base.database_service import AsyncDatabaseService
+from pydantic_classes import Build, BuildRequest
+
+router = APIRouter(
+    prefix="/builds",
+    tags=["builds"],
+)
+
+@router.post("/optimize", response_model=Build)
+async def optimize_build(request: BuildRequest,
+                         database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                         optimizer: Annotated[BuildOptimizer, Depends(get_build_optimizer)]):
+    """
+    Best build for a gold budget: at most slots distinct items maximizing the weighted sum of their stats.
+    The search runs off the event loop and stops at time_limit_ms, returning the best build found with optimal=false.
+    """
+    return await optimizer.optimize(database_service, request)
@@ -0,0 +1,100 @@
+import asyncio
+from typing import Optional
+
+import compression
+import fast_json
+from app_config import config
+from data_base.database_service import AsyncDatabaseService
+
+SNAPSHOT_GZIP_LEVEL = config.getint("compression", "snapshot_gzip_level", fallback=9)
+SNAPSHOT_BROTLI_QUALITY = config.getint("compression", "snapshot_brotli_quality", fallback=9)
+# Items encoded and compressed at a time while a snapshot is built
+CHUNK_ITEMS = 500
+
+
+class CatalogSnapshot:
+    """
+    The whole catalog as NDJSON, gzip and (when available) brotli encoded, for one catalog version.
+    Only the compressed bodies are kept, clients that take neither get the streamed NDJSON instead.
+    """
+
+    def __init__(self, version: int, bodies: dict[str, bytes]):
+        self.version = version
+        self.bodies = bodies
+
+    def body(self, encoding: str) -> bytes:
+        return self.bodies[encoding]
+
+
+class _SnapshotWriter:
+    """Compresses the NDJSON chunk by chunk, so the uncompressed catalog is never held whole."""
+
+    def __init__(self):
+        self.compressors = {"gzip": compression.StreamCompressor("gzip", SNAPSHOT_GZIP_LEVEL, flush_chunks=False)}
+        if compression.BROTLI_ENABLED:
+            self.compressors["br"] = compression.StreamCompressor("br", SNAPSHOT_BROTLI_QUALITY, flush_chunks=False)
+        self.parts: dict[str, list[bytes]] = {encoding: [] for encoding in self.compressors}
+
+    def write(self, lines: list[bytes]):
+        data = b"".join(lines)
+        for encoding, compressor in self.compressors.items():
+            self.parts[encoding].append(compressor.chunk(data))
+
+    def finish(self, version: int) -> CatalogSnapshot:
+        for encoding, compressor in self.compressors.items():
+            self.parts[encoding].append(compressor.finish())
+        return CatalogSnapshot(version, {encoding: b"".join(parts) for encoding, parts in self.parts.items()})
+
+
+class SnapshotStore:
+    """
+    Keeps the latest snapshot and rebuilds it at most once per catalog change, on the first request that
+    needs the new version. Compression runs on a worker thread, concurrent requests wait for the same build.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.builds = 0
+
+    def _get_lock(self) -> asyncio.Lock:
+        # The store lives as long as the process, an asyncio.Lock only works on the first loop that waits on it
+        loop = asyncio.get_running_loop()
+        if self._lock_loop is not loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        return self._lock
+
+    async def get(self, database_service: AsyncDatabaseService, version: int) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        async with self._get_lock():
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = await self._build(database_service, version)
+                self.builds += 1
+            return self._snapshot
+
+    @staticmethod
+    async def _build(database_service: AsyncDatabaseService, version: int) -> CatalogSnapshot:
+        writer = _SnapshotWriter()
+        lines: list[bytes] = []
+        async for item in database_service.iter_items(CHUNK_ITEMS):
+            lines.append(fast_json.encode_item(item) + b"\n")
+            if len(lines) == CHUNK_ITEMS:
+                await asyncio.to_thread(writer.write, lines)
+                lines = []
+        if lines:
+            await asyncio.to_thread(writer.write, lines)
+        return await asyncio.to_thread(writer.finish, version)
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "builds": self.builds,
+            "version": snapshot.version if snapshot else None,
+            "sizes": {encoding: len(body) for encoding, body in snapshot.bodies.items()} if snapshot else {},
+        }
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload, sessionmaker
+from starlette import status
+
+import metrics
+from app_config import config
+from data_base import database_engine, invalidation_bus, item_changes, session_operations
+from data_base.item_changes import ItemChange
+from data_base.sqlalchemy_db_classes import BDItem
+from pydantic_classes import Item, ResourceVersion
+
+# Every committed item write becomes an event with a sequence number: the item's name, its new version and
+# what changed in price, sell_price and stats. The last replay_size events are kept, so a client reconnecting
+# with the last sequence number it saw gets exactly what it missed. Each subscriber gets a buffer of
+# subscriber_buffer events; one that falls further behind is dropped and has to reconnect, the hub never
+# holds on to events for it. Sequence numbers restart with the process, like everything else in memory.
+# Writes of other worker processes arrive through invalidation_bus and are numbered in this process's sequence.
+CHANGE_FEED_ENABLED = config.getboolean("change_feed", "enabled", fallback=True)
+REPLAY_SIZE = config.getint("change_feed", "replay_size", fallback=1000)
+SUBSCRIBER_BUFFER = config.getint("change_feed", "subscriber_buffer", fallback=256)
+MAX_SUBSCRIBERS = config.getint("change_feed", "max_subscribers", fallback=1000)
+HEARTBEAT_SECONDS = config.getfloat("change_feed", "heartbeat_seconds", fallback=15.0)
+
+change_feed_events = metrics.registry.register(metrics.Counter(
+    "change_feed_events_total", "Item change events published to the change feed."))
+change_feed_subscribers = metrics.registry.register(metrics.Gauge(
+    "change_feed_subscribers", "Open change feed connections."))
+change_feed_dropped = metrics.registry.register(metrics.Counter(
+    "change_feed_subscribers_dropped_total", "Change feed subscribers dropped for falling too far behind."))
+
+
+def _stat_name(stat) -> str:
+    return getattr(stat, "value", stat)
+
+
+class _Entry:
+    """What the feed remembers of an item to diff the next write against."""
+    __slots__ = ("version", "price", "sell_price", "stats")
+
+    def __init__(self, version: int, price: float, sell_price: float, stats: dict[str, int]):
+        self.version = version
+        self.price = price
+        self.sell_price = sell_price
+        self.stats = stats
+
+    @classmethod
+    def of(cls, item: Item, version: int) -> "_Entry":
+        return cls(version, item.price, item.sell_price, {_stat_name(stat): value for stat, value in item.stats.items()})
+
+
+def _diff(before: Optional[_Entry], after: Optional[_Entry]) -> dict:
+    """{field: [old, new]} for price and sell_price, {"stats": {stat: [old, new]}}, None for a side without it."""
+    changes = {}
+    for field in ("price", "sell_price"):
+        old = getattr(before, field) if before is not None else None
+        new = getattr(after, field) if after is not None else None
+        if old != new:
+            changes[field] = [old, new]
+    old_stats = before.stats if before is not None else {}
+    new_stats = after.stats if after is not None else {}
+    stats = {stat: [old_stats.get(stat), new_stats.get(stat)]
+             for stat in old_stats.keys() | new_stats.keys() if old_stats.get(stat) != new_stats.get(stat)}
+    if stats:
+        changes["stats"] = dict(sorted(stats.items()))
+    return changes
+
+
+class ChangeEvent:
+    """
+    type is created, updated or deleted, or one of the control events: reset (events were missed, reload
+    the catalog and follow on from seq) and dropped (the subscriber fell behind, reconnect from the last
+    seq seen). data is the JSON every subscriber is sent.
+    """
+    __slots__ = ("seq", "type", "data")
+
+    def __init__(self, seq: int, type: str, body: dict):
+        self.seq = seq
+        self.type = type
+        self.data = json.dumps({"seq": seq, "type": type, **body})
+
+
+class Subscription:
+    """One connection's buffer. Filled from whatever thread committed the write, read on the connection's loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, buffer: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer)
+        self.dropped = False
+        # What the subscriber missed when it joined, and the last seq it had by then
+        self.backlog: list[ChangeEvent] = []
+        self.last_seq = 0
+
+    def send(self, events: list[ChangeEvent]):
+        try:
+            self.loop.call_soon_threadsafe(self._put, events)
+        except RuntimeError:
+            # The loop is closed, the connection is gone with it
+            pass
+
+    def close(self):
+        self.send([None])
+
+    def _put(self, events: list[Optional[ChangeEvent]]):
+        if self.dropped:
+            return
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too slow: forget what is buffered and tell the reader to reconnect and replay instead
+                self.dropped = True
+                change_feed_dropped.inc()
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait(None)
+                return
+
+
+class ChangeFeed:
+    def __init__(self, replay_size: int = REPLAY_SIZE, subscriber_buffer: int = SUBSCRIBER_BUFFER,
+                 max_subscribers: int = MAX_SUBSCRIBERS):
+        self.subscriber_buffer = subscriber_buffer
+        self.max_subscribers = max_subscribers
+        self.seq = 0
+        self._entries: dict[str, _Entry] = {}
+        self._replay: deque[ChangeEvent] = deque(maxlen=replay_size)
+        self._subscribers: set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def load(self, session: Session):
+        with self._lock:
+            self._entries = {db_item.name: _Entry(db_item.version, db_item.price, db_item.sell_price,
+                                                  {db_stat.name: db_stat.value for db_stat in db_item.stats})
+                             for db_item in session.scalars(select(BDItem).options(selectinload(BDItem.stats)))}
+
+    def apply(self, changes: list[ItemChange], catalog_version: Optional[ResourceVersion]):
+        """item_changes listener."""
+        with self._lock:
+            events = []
+            for name, item, version in changes:
+                previous = self._entries.pop(name, None)
+                if item is None:
+                    if previous is not None:
+                        events.append(self._event("deleted", name, None, _diff(previous, None)))
+                    continue
+                entry = self._entries[name] = _Entry.of(item, version.version)
+                events.append(self._event("updated" if previous is not None else "created", name, version.version,
+                                          _diff(previous, entry)))
+            self._publish(events)
+
+    def refresh(self, session: Session, names: Optional[list[str]]):
+        """
+        Turns writes made by another process (see invalidation_bus) into events, with versions read from the
+        database. For None every item is re-read and subscribers get a reset event.
+        """
+        if names is None:
+            self.load(session)
+            with self._lock:
+                self.seq += 1
+                self._publish([ChangeEvent(self.seq, "reset", {})])
+            return
+        found = session_operations.get_versioned_items(session, names)
+        with self._lock:
+            events = []
+            for name in names:
+                previous = self._entries.pop(name, None)
+                if name not in found:
+                    if previous is not None:
+                        events.append(self._event("deleted", name, None, _diff(previous, None)))
+                    continue
+                item, version = found[name]
+                entry = self._entries[name] = _Entry.of(item, version.version)
+                if previous is None or previous.version != version.version:
+                    events.append(self._event("updated" if previous is not None else "created", name,
+                                              version.version, _diff(previous, entry)))
+            self._publish(events)
+
+    def _publish(self, events: list[ChangeEvent]):
+        # Called under the lock, so every subscriber gets the events in sequence order
+        if not events:
+            return
+        self._replay.extend(events)
+        change_feed_events.inc(amount=len(events))
+        for subscription in list(self._subscribers):
+            if subscription.dropped:
+                # Also frees the place of a stream that was never read, e.g. a client gone before it started
+                self._subscribers.discard(subscription)
+                change_feed_subscribers.dec()
+                continue
+            subscription.send(events)
+
+    def _event(self, type: str, name: str, version: Optional[int], changes: dict) -> ChangeEvent:
+        self.seq += 1
+        return ChangeEvent(self.seq, type, {"name": name, "version": version, "changes": changes})
+
+    def subscribe(self, after: Optional[int] = None) -> Subscription:
+        """
+        Registers a subscriber, or refuses it with 503 while max_subscribers are connected. Routes call it
+        before their response starts, so a client never misses a write it makes once it is connected.
+        The backlog after seq `after` is taken under the same lock: nothing is missed or sent twice.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Too many change feed subscribers, try again later",
+                                    headers={"Retry-After": str(max(1, int(HEARTBEAT_SECONDS)))})
+            subscription = Subscription(asyncio.get_running_loop(), self.subscriber_buffer)
+            if after is None or after == self.seq:
+                backlog = []
+            elif 0 <= after < self.seq and (not self._replay or self._replay[0].seq <= after + 1):
+                backlog = [event for event in self._replay if event.seq > after]
+            else:
+                # Older than the replay buffer, or a sequence number of an earlier process
+                backlog = [ChangeEvent(self.seq, "reset", {})]
+            subscription.backlog, subscription.last_seq = backlog, self.seq
+            self._subscribers.add(subscription)
+        change_feed_subscribers.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Safe to call more than once."""
+        with self._lock:
+            if subscription not in self._subscribers:
+                return
+            self._subscribers.discard(subscription)
+        change_feed_subscribers.dec()
+
+    def close(self):
+        """Ends every open stream."""
+        with self._lock:
+            for subscription in self._subscribers:
+                subscription.close()
+
+    async def events(self, subscription: Subscription,
+                     heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[Optional[ChangeEvent]]:
+        """
+        The subscription's backlog (a single reset event when the missed events are no longer all in the
+        replay buffer), then live events, with None every heartbeat seconds without one. Ends after a dropped
+        event when the subscriber fell behind, or when the feed shuts down, and then unsubscribes.
+        """
+        last_seq = subscription.last_seq
+        try:
+            for event in subscription.backlog:
+                yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    if subscription.dropped:
+                        yield ChangeEvent(last_seq, "dropped", {})
+                    return
+                last_seq = event.seq
+                yield event
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "seq": self.seq,
+                "replay": len(self._replay),
+                "oldest_replayable": self._replay[0].seq if self._replay else None,
+                "subscribers": len(self._subscribers),
+            }
+
+
+change_feed: Optional[ChangeFeed] = None
+
+
+def init_change_feed(session_factory: Optional[sessionmaker[Session]] = None) -> Optional[ChangeFeed]:
+    global change_feed
+    if not CHANGE_FEED_ENABLED:
+        return None
+    feed = ChangeFeed()
+    # Listening before loading: a write committed meanwhile waits on the feed lock and is applied on top
+    item_changes.add_listener(feed.apply)
+    invalidation_bus.subscribe(invalidation_bus.ITEMS, _reload_items)
+    with (session_factory or database_engine.get_session_factory())() as session:
+        feed.load(session)
+    change_feed = feed
+    return feed
+
+
+def _reload_items(names: Optional[list[str]]):
+    feed = change_feed
+    if feed is not None:
+        with database_engine.get_session_factory()() as session:
+            feed.refresh(session, names)
+
+
+def shutdown_change_feed():
+    global change_feed
+    if change_feed is not None:
+        item_changes.remove_listener(change_feed.apply)
+        invalidation_bus.unsubscribe(invalidation_bus.ITEMS, _reload_items)
+        change_feed.close()
+        change_feed = None
+
+
+def get_change_feed() -> ChangeFeed:
+    if change_feed is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="The change feed is disabled ([change_feed] enabled = false)")
+    return change_feed
@@ -0,0 +1,137 @@
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app_config import config
+
+COMPRESSION_ENABLED = config.getboolean("compression", "enabled", fallback=True)
+MINIMUM_SIZE = config.getint("compression", "minimum_size", fallback=1024)
+GZIP_LEVEL = config.getint("compression", "gzip_level", fallback=6)
+BROTLI_ENABLED = config.getboolean("compression", "brotli", fallback=True) and brotli is not None
+BROTLI_QUALITY = config.getint("compression", "brotli_quality", fallback=4)
+
+# Streams that must reach the client chunk by chunk, untouched
+_UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Picks br or gzip from an Accept-Encoding header, br first when both are equally acceptable."""
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.strip().partition(";")
+        quality = 1.0
+        parameter = parameters.strip()
+        if parameter.startswith("q="):
+            try:
+                quality = float(parameter[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            weights[coding.strip().lower()] = quality
+    offered = ["br", "gzip"] if BROTLI_ENABLED else ["gzip"]
+    candidates = [(weights.get(coding, weights.get("*", 0.0)), -rank, coding) for rank, coding in enumerate(offered)]
+    quality, _, coding = max(candidates)
+    return coding if quality > 0 else None
+
+
+class StreamCompressor:
+    """
+    Compresses a body handed over in chunks. With flush_chunks the output of each chunk decodes everything
+    handed over so far, so a streamed line reaches the client as soon as it is produced. Without it the
+    compressor buffers freely, which compresses as well as the whole body would in one go.
+    """
+
+    def __init__(self, encoding: str, level: Optional[int] = None, flush_chunks: bool = True):
+        self.flush_chunks = flush_chunks
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY if level is None else level)
+        else:
+            self._brotli = None
+            self._gzip = zlib.compressobj(GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self._brotli is not None:
+            output = self._brotli.process(data)
+            return output + self._brotli.flush() if self.flush_chunks else output
+        output = self._gzip.compress(data)
+        return output + self._gzip.flush(zlib.Z_SYNC_FLUSH) if self.flush_chunks else output
+
+    def finish(self) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.finish()
+        return self._gzip.flush()
+
+
+class CompressionMiddleware:
+    """
+    gzip/brotli for responses of at least minimum_size bytes, streamed ones included.
+    Responses that already carry a Content-Encoding (the precompressed catalog snapshot) pass through.
+    A strong ETag becomes weak on a compressed response, since the bytes are no longer the ones it names.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[StreamCompressor] = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                headers = Headers(raw=message["headers"])
+                passthrough = ("content-encoding" in headers
+                               or headers.get("content-type", "").startswith(_UNCOMPRESSED_TYPES))
+                if passthrough:
+                    await send(message)
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = StreamCompressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag is not None and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                if not more_body:
+                    body = compressor.chunk(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                await send(start)
+            body = compressor.chunk(body)
+            if not more_body:
+                body += compressor.finish()
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
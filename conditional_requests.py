@@ -0,0 +1,48 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+from starlette import status
+
+from pydantic_classes import ResourceVersion
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag derived from whatever identifies the representation (name, version, query...)."""
+    return '"' + hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()[:20] + '"'
+
+
+def http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def validator_headers(etag: str, version: ResourceVersion) -> dict[str, str]:
+    return {"ETag": etag, "Last-Modified": http_date(version.updated_at)}
+
+
+def is_not_modified(request: Request, etag: str, version: ResourceVersion) -> bool:
+    """RFC 9110 evaluation: If-None-Match wins, If-Modified-Since is only looked at without it."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+        return etag in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        updated_at = version.updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+        return updated_at <= since
+    return False
+
+
+def not_modified(etag: str, version: ResourceVersion) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers(etag, version))
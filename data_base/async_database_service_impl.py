@@ -0,0 +1,89 @@
+from typing import Optional, Set, Type
+
+from data_base import database_engine, invalidation_bus, session_operations
+from data_base.database_service import AsyncDatabaseService
+from data_base.sqlalchemy_db_classes import BDUser
+from data_base.write_queue import WriteQueue
+from pydantic_classes import Item, ItemPage, ResourceVersion, User, UserNoPass
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase
+
+
+class AsyncDatabaseServiceImpl(AsyncDatabaseService):
+    """
+    Non-blocking counterpart of DatabaseServiceImpl on top of SQLAlchemy's asyncio extension.
+    The queries themselves are the ones in session_operations, run through AsyncSession.run_sync,
+    so the driver I/O (aiosqlite) happens off the event loop.
+    """
+
+    def __init__(self, session_factory: Optional[async_sessionmaker[AsyncSession]] = None,
+                 write_queue: Optional[WriteQueue] = None):
+        self.session_factory = session_factory or database_engine.get_async_session_factory()
+        self.write_queue = write_queue
+
+    async def _write(self, operation, *args):
+        """Runs a session_operations write in its own transaction, or as part of a group commit of the write queue."""
+        if self.write_queue is not None and self.write_queue.running:
+            return await self.write_queue.submit(operation, *args)
+        async with self.session_factory() as session:
+            return await session.run_sync(operation, *args)
+
+    async def create(self, item: Item) -> str:
+        return await self._write(session_operations.create_item, item)
+
+    async def get(self, item_id: str) -> Item:
+        async with self.session_factory() as session:
+            return await session.run_sync(session_operations.get_item, item_id)
+
+    async def get_versioned(self, item_id: str) -> tuple[Item, ResourceVersion]:
+        async with self.session_factory() as session:
+            return await session.run_sync(session_operations.get_versioned_item, item_id)
+
+    async def get_catalog_version(self) -> ResourceVersion:
+        async with self.session_factory() as session:
+            return await session.run_sync(session_operations.get_catalog_version)
+
+    async def get_many(self, names: list[str]) -> dict[str, Item]:
+        async with self.session_factory() as session:
+            return await session.run_sync(session_operations.get_items, names)
+
+    async def update(self, item_id: str, item: Item) -> Item:
+        return await self._write(session_operations.update_item, item_id, item)
+
+    async def bulk_upsert(self, items: list[Item]) -> int:
+        return await self._write(session_operations.bulk_upsert_items, items)
+
+    async def delete(self, item_id: str, cls: Type[DeclarativeBase]) -> bool:
+        deleted = await self._write(session_operations.delete_row, item_id, cls)
+        if cls is BDUser:
+            invalidation_bus.publish(invalidation_bus.USERS, [item_id])
+        return deleted
+
+    async def get_all(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> set:
+        async with self.session_factory() as session:
+            return await session.run_sync(session_operations.get_all_names, stats, price)
+
+    async def get_page(self, after: Optional[str] = None, limit: int = 100, stats: Optional[Set[str]] = None,
+                       price: Optional[tuple[int, bool]] = None, full: bool = False) -> ItemPage:
+        async with self.session_factory() as session:
+            return await session.run_sync(session_operations.get_item_page, after, limit, stats, price, full)
+
+    async def search(self, query: str, prefix: bool = True, limit: int = 20, stats: Optional[Set[str]] = None,
+                     price: Optional[tuple[int, bool]] = None, full: bool = False) -> list[Item] | list[str]:
+        async with self.session_factory() as session:
+            return await session.run_sync(session_operations.search_items, query, prefix, limit, stats, price, full)
+
+    async def get_user(self, username: str) -> User:
+        async with self.session_factory() as session:
+            return await session.run_sync(session_operations.get_user, username)
+
+    async def create_user(self, user: User) -> str:
+        name = await self._write(session_operations.create_user, user)
+        invalidation_bus.publish(invalidation_bus.USERS, [name])
+        return name
+
+    async def update_user(self, username: str, user: User | UserNoPass) -> User:
+        updated = await self._write(session_operations.update_user, username, user)
+        # Item writes are published by the bus itself once committed, user writes from here
+        invalidation_bus.publish(invalidation_bus.USERS, [username, updated.user_name])
+        return updated
@@ -0,0 +1,187 @@
+from typing import Optional, Set, Type
+
+from sqlalchemy.orm import DeclarativeBase
+
+from app_config import config
+from data_base import invalidation_bus
+from data_base.database_service import AsyncDatabaseService, DatabaseService
+from data_base.sqlalchemy_db_classes import BDItem
+from data_base.ttl_cache import TTLCache
+from pydantic_classes import Item, ItemPage, ResourceVersion, User, UserNoPass
+
+# Shared by every request, the wrappers below are created per request around it
+item_cache = TTLCache(
+    max_entries=config.getint("item_cache", "max_entries", fallback=1024),
+    ttl_seconds=config.getfloat("item_cache", "ttl_seconds", fallback=60.0),
+)
+
+
+def _invalidate_items(names: Optional[list[str]]):
+    # Items written by another worker
+    if names is None:
+        item_cache.clear()
+    else:
+        item_cache.invalidate(*names)
+
+
+invalidation_bus.subscribe(invalidation_bus.ITEMS, _invalidate_items)
+
+
+class CachedDatabaseService(DatabaseService):
+    """
+    Read-through cache for get()/get_versioned(), holding (Item, ResourceVersion) per name.
+    Invalidated by create/update/delete/bulk_upsert, everything else is passed through.
+    """
+
+    def __init__(self, database_service: DatabaseService, cache: TTLCache = item_cache):
+        self.database_service = database_service
+        self.cache = cache
+
+    def create(self, item: Item) -> str:
+        try:
+            return self.database_service.create(item)
+        finally:
+            self.cache.invalidate(item.name)
+
+    def get(self, name: str) -> Item:
+        return self.get_versioned(name)[0]
+
+    def get_versioned(self, name: str) -> tuple[Item, ResourceVersion]:
+        entry = self.cache.get(name)
+        if entry is None:
+            generation = self.cache.generation
+            entry = self.database_service.get_versioned(name)
+            self.cache.set(name, entry, generation)
+        return entry
+
+    def get_many(self, names: list[str]) -> dict[str, Item]:
+        # Hits come from the cache, misses are fetched together but not cached since get_many carries no versions
+        found = {}
+        for name in names:
+            entry = self.cache.get(name)
+            if entry is not None:
+                found[name] = entry[0]
+        misses = [name for name in names if name not in found]
+        if misses:
+            found.update(self.database_service.get_many(misses))
+        return found
+
+    def get_catalog_version(self) -> ResourceVersion:
+        return self.database_service.get_catalog_version()
+
+    def update(self, name: str, item: Item) -> Item:
+        try:
+            return self.database_service.update(name, item)
+        finally:
+            self.cache.invalidate(name, item.name)
+
+    def bulk_upsert(self, items: list[Item]) -> int:
+        try:
+            return self.database_service.bulk_upsert(items)
+        finally:
+            self.cache.invalidate(*[item.name for item in items])
+
+    def delete(self, name: str, cls: Type[DeclarativeBase]) -> bool:
+        try:
+            return self.database_service.delete(name, cls)
+        finally:
+            if cls is BDItem:
+                self.cache.invalidate(name)
+
+    def get_all(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> set:
+        return self.database_service.get_all(stats, price)
+
+    def get_page(self, after: Optional[str] = None, limit: int = 100, stats: Optional[Set[str]] = None,
+                 price: Optional[tuple[int, bool]] = None, full: bool = False) -> ItemPage:
+        return self.database_service.get_page(after, limit, stats, price, full)
+
+    def search(self, query: str, prefix: bool = True, limit: int = 20, stats: Optional[Set[str]] = None,
+               price: Optional[tuple[int, bool]] = None, full: bool = False) -> list[Item] | list[str]:
+        return self.database_service.search(query, prefix, limit, stats, price, full)
+
+    def get_user(self, username: str) -> User:
+        return self.database_service.get_user(username)
+
+    def create_user(self, user: User) -> str:
+        return self.database_service.create_user(user)
+
+    def update_user(self, username: str, user: User | UserNoPass) -> User:
+        return self.database_service.update_user(username, user)
+
+
+class CachedAsyncDatabaseService(AsyncDatabaseService):
+    """Async counterpart of CachedDatabaseService, sharing the same cache."""
+
+    def __init__(self, database_service: AsyncDatabaseService, cache: TTLCache = item_cache):
+        self.database_service = database_service
+        self.cache = cache
+
+    async def create(self, item: Item) -> str:
+        try:
+            return await self.database_service.create(item)
+        finally:
+            self.cache.invalidate(item.name)
+
+    async def get(self, name: str) -> Item:
+        return (await self.get_versioned(name))[0]
+
+    async def get_versioned(self, name: str) -> tuple[Item, ResourceVersion]:
+        entry = self.cache.get(name)
+        if entry is None:
+            generation = self.cache.generation
+            entry = await self.database_service.get_versioned(name)
+            self.cache.set(name, entry, generation)
+        return entry
+
+    async def get_many(self, names: list[str]) -> dict[str, Item]:
+        found = {}
+        for name in names:
+            entry = self.cache.get(name)
+            if entry is not None:
+                found[name] = entry[0]
+        misses = [name for name in names if name not in found]
+        if misses:
+            found.update(await self.database_service.get_many(misses))
+        return found
+
+    async def get_catalog_version(self) -> ResourceVersion:
+        return await self.database_service.get_catalog_version()
+
+    async def update(self, name: str, item: Item) -> Item:
+        try:
+            return await self.database_service.update(name, item)
+        finally:
+            self.cache.invalidate(name, item.name)
+
+    async def bulk_upsert(self, items: list[Item]) -> int:
+        try:
+            return await self.database_service.bulk_upsert(items)
+        finally:
+            self.cache.invalidate(*[item.name for item in items])
+
+    async def delete(self, name: str, cls: Type[DeclarativeBase]) -> bool:
+        try:
+            return await self.database_service.delete(name, cls)
+        finally:
+            if cls is BDItem:
+                self.cache.invalidate(name)
+
+    async def get_all(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> set:
+        return await self.database_service.get_all(stats, price)
+
+    async def get_page(self, after: Optional[str] = None, limit: int = 100, stats: Optional[Set[str]] = None,
+                       price: Optional[tuple[int, bool]] = None, full: bool = False) -> ItemPage:
+        return await self.database_service.get_page(after, limit, stats, price, full)
+
+    async def search(self, query: str, prefix: bool = True, limit: int = 20, stats: Optional[Set[str]] = None,
+                     price: Optional[tuple[int, bool]] = None, full: bool = False) -> list[Item] | list[str]:
+        return await self.database_service.search(query, prefix, limit, stats, price, full)
+
+    async def get_user(self, username: str) -> User:
+        return await self.database_service.get_user(username)
+
+    async def create_user(self, user: User) -> str:
+        return await self.database_service.create_user(user)
+
+    async def update_user(self, username: str, user: User | UserNoPass) -> User:
+        return await self.database_service.update_user(username, user)
@@ -0,0 +1,199 @@
+import logging
+import threading
+from typing import Optional
+
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import metrics
+import profiling
+from app_config import config
+from data_base import migrations
+from data_base.sqlalchemy_db_classes import Base
+
+def _is_sqlite_memory(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or "mode=memory" in url or url.rstrip("/").endswith(":"))
+
+
+def _shared_memory_url(url: str) -> str:
+    """
+    Every connection to a plain SQLite :memory: database gets a separate, empty database, so the sync and
+    async engines would never see each other's schema or rows. A named shared-cache in-memory database is
+    one database for every connection of the process, kept as long as one of them is open.
+    """
+    if not _is_sqlite_memory(url) or "mode=memory" in url:
+        return url
+    return url.split(":", 1)[0] + ":///file:lolitems?mode=memory&cache=shared&uri=true"
+
+
+DATABASE_URL = _shared_memory_url(config.get("database", "url", fallback="sqlite:///data_base/database.db"))
+
+
+def _to_async_url(url: str) -> str:
+    if url.startswith("sqlite+pysqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite+pysqlite:"):]
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    return url
+
+
+ASYNC_DATABASE_URL = _shared_memory_url(config.get("database", "async_url", fallback=_to_async_url(DATABASE_URL)))
+
+# echo logs every statement through the sqlalchemy.engine logger, and so through the queued log
+# handler set up by app_logging, instead of SQLAlchemy's own synchronous stdout handler
+if config.getboolean("database", "echo", fallback=False):
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+
+# Applied to every SQLite connection. WAL lets reads go on while a write commits, synchronous = normal
+# only fsyncs at WAL checkpoints (a power loss can drop the last commits, a crash of the app cannot),
+# and busy_timeout waits for the write lock instead of failing with "database is locked".
+JOURNAL_MODE = config.get("database", "journal_mode", fallback="wal")
+SYNCHRONOUS = config.get("database", "synchronous", fallback="normal")
+BUSY_TIMEOUT_MS = config.getint("database", "busy_timeout_ms", fallback=5000)
+
+_engine: Optional[Engine] = None
+_session_factory: Optional[sessionmaker[Session]] = None
+_async_engine: Optional[AsyncEngine] = None
+_async_session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+_lock = threading.Lock()
+
+
+def _engine_options(url: str) -> dict:
+    options = {
+        "pool_pre_ping": config.getboolean("database", "pool_pre_ping", fallback=True),
+    }
+    if _is_sqlite_memory(url):
+        # Every connection to :memory: is a separate database, so share a single one
+        options["poolclass"] = StaticPool
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options["pool_size"] = config.getint("database", "pool_size", fallback=5)
+        options["max_overflow"] = config.getint("database", "max_overflow", fallback=10)
+        options["pool_timeout"] = config.getint("database", "pool_timeout", fallback=30)
+        options["pool_recycle"] = config.getint("database", "pool_recycle", fallback=3600)
+        if url.startswith("sqlite"):
+            # Pooled connections are handed out to whichever thread serves the request
+            options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+def _apply_sqlite_pragmas(engine: Engine, url: str, explicit_begin: bool = False):
+    if not url.startswith("sqlite"):
+        return
+    # :memory: databases have no journal file to switch to WAL
+    journal_mode = None if _is_sqlite_memory(url) else JOURNAL_MODE
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        if explicit_begin:
+            # The sqlite3 driver only sends BEGIN before the first INSERT/UPDATE/DELETE, so a SAVEPOINT
+            # opened before that runs outside any transaction and its RELEASE commits on the spot
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        if journal_mode:
+            cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+    if explicit_begin:
+        @event.listens_for(engine, "begin")
+        def _begin(connection):
+            connection.exec_driver_sql("BEGIN")
+
+
+def build_engine(url: str = DATABASE_URL) -> Engine:
+    """Creates an engine with the pool settings from the [database] section of config.ini."""
+    engine = create_engine(url, **_engine_options(url))
+    _apply_sqlite_pragmas(engine, url)
+    return engine
+
+
+def build_async_engine(url: str = ASYNC_DATABASE_URL, explicit_begin: bool = False) -> AsyncEngine:
+    """
+    Async (aiosqlite) engine with the same pool settings and pragmas as build_engine.
+    explicit_begin starts every transaction with BEGIN, which savepoints (Session.begin_nested) need on SQLite.
+    """
+    engine = create_async_engine(url, **_engine_options(url))
+    _apply_sqlite_pragmas(engine.sync_engine, url, explicit_begin)
+    return engine
+
+
+def create_schema(engine: Engine):
+    """Startup-only schema step, kept out of the request path."""
+    Base.metadata.create_all(engine)
+    migrations.migrate(engine)
+
+
+def init_database(url: str = DATABASE_URL) -> Engine:
+    """Creates the application-wide engine and session factory. Called once from the lifespan hook."""
+    global _engine, _session_factory
+    with _lock:
+        if _engine is None:
+            engine = build_engine(url)
+            create_schema(engine)
+            metrics.instrument_engine(engine, "sync")
+            profiling.instrument_engine(engine)
+            _session_factory = sessionmaker(engine)
+            _engine = engine
+        return _engine
+
+
+def dispose_database():
+    global _engine, _session_factory
+    with _lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _session_factory = None
+
+
+def init_async_database(url: str = ASYNC_DATABASE_URL) -> AsyncEngine:
+    """
+    Creates the application-wide async engine and session factory.
+    The schema step is left to init_database, which the lifespan hook runs first.
+    """
+    global _async_engine, _async_session_factory
+    with _lock:
+        if _async_engine is None:
+            engine = build_async_engine(url)
+            metrics.instrument_engine(engine.sync_engine, "async")
+            profiling.instrument_engine(engine.sync_engine)
+            _async_session_factory = async_sessionmaker(engine, expire_on_commit=False)
+            _async_engine = engine
+        return _async_engine
+
+
+async def dispose_async_database():
+    global _async_engine, _async_session_factory
+    engine = _async_engine
+    _async_engine = None
+    _async_session_factory = None
+    if engine is not None:
+        await engine.dispose()
+
+
+def get_engine() -> Engine:
+    if _engine is None:
+        # Scripts and tests that don't run the lifespan still get the shared engine
+        return init_database()
+    return _engine
+
+
+def get_session_factory() -> sessionmaker[Session]:
+    get_engine()
+    return _session_factory
+
+
+def get_async_engine() -> AsyncEngine:
+    get_async_session_factory()
+    return _async_engine
+
+
+def get_async_session_factory() -> async_sessionmaker[AsyncSession]:
+    if _async_engine is None:
+        get_engine()
+        init_async_database()
+    return _async_session_factory
@@ -1,16 +1,46 @@
-from data_base.database_service import DatabaseService
+from app_config import config
+from data_base import database_engine
+from data_base.async_database_service_impl import AsyncDatabaseServiceImpl
+from data_base.cached_database_service import CachedAsyncDatabaseService, CachedDatabaseService
+from data_base.database_service import AsyncDatabaseService, DatabaseService
 from data_base.database_service_impl import DatabaseServiceImpl
-from data_base.database_service_impl_as_dict import DatabaseServiceImplAsDict, shared_data
+from data_base.database_service_impl_as_dict import AsyncDatabaseServiceImplAsDict, DatabaseServiceImplAsDict
+from data_base.write_queue import get_write_queue
 from typing import Callable
 
 # Define a type for the database provider function
 DatabaseProvider = Callable[[], DatabaseService]
+AsyncDatabaseProvider = Callable[[], AsyncDatabaseService]
 
 def get_dict_db_service() -> DatabaseServiceImplAsDict:
-    return DatabaseServiceImplAsDict(shared_data)
+    return DatabaseServiceImplAsDict()
+
+def get_async_dict_db_service() -> AsyncDatabaseServiceImplAsDict:
+    return AsyncDatabaseServiceImplAsDict(database_service=get_async_sql_db_service())
 
 def get_sql_db_service() -> DatabaseServiceImpl:
-    return DatabaseServiceImpl()
+    return DatabaseServiceImpl(database_engine.get_session_factory())
+
+def get_async_sql_db_service() -> AsyncDatabaseServiceImpl:
+    return AsyncDatabaseServiceImpl(database_engine.get_async_session_factory(), get_write_queue())
+
+def get_cached_sql_db_service() -> CachedDatabaseService:
+    return CachedDatabaseService(get_sql_db_service())
+
+def get_cached_async_sql_db_service() -> CachedAsyncDatabaseService:
+    return CachedAsyncDatabaseService(get_async_sql_db_service())
+
 
+# [database] backend = memory answers reads from the in-memory catalog loaded at startup (writes still go to SQLite).
+# Otherwise [item_cache] enabled = true puts the read-through item cache in front of the SQL backend.
+MEMORY_BACKEND = config.get("database", "backend", fallback="sql") == "memory"
+ITEM_CACHE_ENABLED = config.getboolean("item_cache", "enabled", fallback=False)
 
-database_provider: DatabaseProvider = get_sql_db_service
\ No newline at end of file
+if MEMORY_BACKEND:
+    database_provider: DatabaseProvider = get_dict_db_service
+    async_database_provider: AsyncDatabaseProvider = get_async_dict_db_service
+else:
+    database_provider: DatabaseProvider = get_cached_sql_db_service if ITEM_CACHE_ENABLED else get_sql_db_service
+    async_database_provider: AsyncDatabaseProvider = (
+        get_cached_async_sql_db_service if ITEM_CACHE_ENABLED else get_async_sql_db_service
+    )
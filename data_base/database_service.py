@@ -1,9 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Set, Type
+from typing import AsyncIterator, Iterator, Optional, Set, Type
 
 from sqlalchemy.orm import DeclarativeBase
 
-from pydantic_classes import Item, User, UserNoPass
+from pydantic_classes import Item, ItemPage, ResourceVersion, User, UserNoPass
 
 
 class DatabaseService(ABC):
@@ -14,15 +14,46 @@ class DatabaseService(ABC):
     @abstractmethod
     def get(self, name: str) -> Item: pass
 
+    @abstractmethod
+    def get_versioned(self, name: str) -> tuple[Item, ResourceVersion]: pass
+
+    @abstractmethod
+    def get_catalog_version(self) -> ResourceVersion: pass
+
+    @abstractmethod
+    def get_many(self, names: list[str]) -> dict[str, Item]: pass
+
     @abstractmethod
     def update(self, name: str, item: Item) -> Item: pass
 
+    @abstractmethod
+    def bulk_upsert(self, items: list[Item]) -> int: pass
+
     @abstractmethod
     def delete(self, name: str, cls: Type[DeclarativeBase]) -> bool: pass
 
     @abstractmethod
     def get_all(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> set: pass
 
+    @abstractmethod
+    def get_page(self, after: Optional[str] = None, limit: int = 100, stats: Optional[Set[str]] = None,
+                 price: Optional[tuple[int, bool]] = None, full: bool = False) -> ItemPage: pass
+
+    def iter_items(self, batch_size: int = 500, stats: Optional[Set[str]] = None,
+                   price: Optional[tuple[int, bool]] = None) -> Iterator[Item]:
+        """Walks the whole catalog page by page, so memory stays bounded by batch_size."""
+        after = None
+        while True:
+            page = self.get_page(after, batch_size, stats, price, full=True)
+            yield from page.items
+            if page.next_cursor is None:
+                return
+            after = page.next_cursor
+
+    @abstractmethod
+    def search(self, query: str, prefix: bool = True, limit: int = 20, stats: Optional[Set[str]] = None,
+               price: Optional[tuple[int, bool]] = None, full: bool = False) -> list[Item] | list[str]: pass
+
     @abstractmethod
     def get_user(self, username: str) -> User: pass
 
@@ -30,4 +61,63 @@ class DatabaseService(ABC):
     def create_user(self, user: User) -> str: pass
 
     @abstractmethod
-    def update_user(self, username: str, user: User | UserNoPass) -> User: pass
\ No newline at end of file
+    def update_user(self, username: str, user: User | UserNoPass) -> User: pass
+
+class AsyncDatabaseService(ABC):
+    """Same operations as DatabaseService, awaited by the routers so database I/O doesn't block the event loop."""
+
+    @abstractmethod
+    async def create(self, item: Item) -> str: pass
+
+    @abstractmethod
+    async def get(self, name: str) -> Item: pass
+
+    @abstractmethod
+    async def get_versioned(self, name: str) -> tuple[Item, ResourceVersion]: pass
+
+    @abstractmethod
+    async def get_catalog_version(self) -> ResourceVersion: pass
+
+    @abstractmethod
+    async def get_many(self, names: list[str]) -> dict[str, Item]: pass
+
+    @abstractmethod
+    async def update(self, name: str, item: Item) -> Item: pass
+
+    @abstractmethod
+    async def bulk_upsert(self, items: list[Item]) -> int: pass
+
+    @abstractmethod
+    async def delete(self, name: str, cls: Type[DeclarativeBase]) -> bool: pass
+
+    @abstractmethod
+    async def get_all(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> set: pass
+
+    @abstractmethod
+    async def get_page(self, after: Optional[str] = None, limit: int = 100, stats: Optional[Set[str]] = None,
+                       price: Optional[tuple[int, bool]] = None, full: bool = False) -> ItemPage: pass
+
+    async def iter_items(self, batch_size: int = 500, stats: Optional[Set[str]] = None,
+                         price: Optional[tuple[int, bool]] = None) -> AsyncIterator[Item]:
+        """Walks the whole catalog page by page, so memory stays bounded by batch_size."""
+        after = None
+        while True:
+            page = await self.get_page(after, batch_size, stats, price, full=True)
+            for item in page.items:
+                yield item
+            if page.next_cursor is None:
+                return
+            after = page.next_cursor
+
+    @abstractmethod
+    async def search(self, query: str, prefix: bool = True, limit: int = 20, stats: Optional[Set[str]] = None,
+                     price: Optional[tuple[int, bool]] = None, full: bool = False) -> list[Item] | list[str]: pass
+
+    @abstractmethod
+    async def get_user(self, username: str) -> User: pass
+
+    @abstractmethod
+    async def create_user(self, user: User) -> str: pass
+
+    @abstractmethod
+    async def update_user(self, username: str, user: User | UserNoPass) -> User: pass
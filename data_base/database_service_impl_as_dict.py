@@ -1,39 +1,414 @@
-from data_base.database_service import DatabaseService
-from pydantic_classes import Item
+import bisect
+import heapq
+import logging
+import threading
+from typing import Iterable, Optional, Set, Type
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import DeclarativeBase, Session, selectinload, sessionmaker
+from starlette import status
+
+from data_base import database_engine, invalidation_bus, item_changes, session_operations
+from data_base.async_database_service_impl import AsyncDatabaseServiceImpl
+from data_base.database_service import AsyncDatabaseService, DatabaseService
+from data_base.database_service_impl import DatabaseServiceImpl
+from data_base.item_changes import ItemChange
+from data_base.sqlalchemy_db_classes import BDItem, BDUser
+from pydantic_classes import Item, ItemPage, ResourceVersion, User, UserNoPass
+
+# Batches touching more than this share of the catalog rebuild the indexes instead of patching copies of them
+REBUILD_SHARE = 0.25
+
+
+def _stat_name(stat) -> str:
+    return getattr(stat, "value", stat)
+
+
+def _price_key(entry: tuple[float, str]) -> float:
+    return entry[0]
+
+
+class CatalogState:
+    """
+    One immutable version of the catalog and its secondary indexes. Writers build a new one and swap it in,
+    readers keep using the one they started with, so a read never takes a lock or sees half a write.
+    Items are shared with the readers and must not be mutated.
+    """
+    __slots__ = ("items", "names", "prices", "by_price", "by_stat", "version")
+
+    def __init__(self, items: dict[str, tuple[Item, ResourceVersion]], names: list[str], prices: dict[str, float],
+                 by_price: list[tuple[float, str]], by_stat: dict[str, frozenset[str]], version: ResourceVersion):
+        self.items = items
+        self.names = names
+        # Plain floats, filtering thousands of candidates by price is several times faster than through the models
+        self.prices = prices
+        self.by_price = by_price
+        self.by_stat = by_stat
+        self.version = version
+
+    @classmethod
+    def build(cls, items: dict[str, tuple[Item, ResourceVersion]], version: ResourceVersion) -> "CatalogState":
+        by_stat: dict[str, set[str]] = {}
+        for name, (item, _) in items.items():
+            for stat in item.stats:
+                by_stat.setdefault(_stat_name(stat), set()).add(name)
+        prices = {name: item.price for name, (item, _) in items.items()}
+        return cls(items, sorted(items), prices, sorted((price, name) for name, price in prices.items()),
+                   {stat: frozenset(names) for stat, names in by_stat.items()}, version)
+
+    def matching(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> Optional[set]:
+        """Names passing the GET /items/ filters (every stat in stats, price >= or < price[0]), None without filters."""
+        candidates = None
+        if stats:
+            # Smallest stat set first, the intersection can only shrink from there
+            sets = sorted((self.by_stat.get(_stat_name(stat), frozenset()) for stat in stats), key=len)
+            candidates = set(sets[0]).intersection(*sets[1:])
+        if price is not None and price[0] is not None:
+            if candidates is not None:
+                prices, limit = self.prices, price[0]
+                if price[1]:
+                    candidates = {name for name in candidates if prices[name] >= limit}
+                else:
+                    candidates = {name for name in candidates if prices[name] < limit}
+            else:
+                index = bisect.bisect_left(self.by_price, price[0], key=_price_key)
+                candidates = {name for _, name in (self.by_price[index:] if price[1] else self.by_price[:index])}
+        return candidates
+
+
+class MemoryCatalog:
+    """
+    The whole catalog and the users, loaded from SQLite at startup and then kept current from item_changes
+    (items) and by the memory services (users). Writes still go to SQLite, only reads are answered from memory.
+    Only writes made by this process are seen.
+    """
+
+    def __init__(self):
+        self.state: Optional[CatalogState] = None
+        self.users: dict[str, User] = {}
+        self._lock = threading.Lock()
+
+    def load(self, session: Session):
+        with self._lock:
+            items = {}
+            for db_item in session.scalars(select(BDItem).options(selectinload(BDItem.stats))):
+                try:
+                    item = session_operations.to_item(db_item)
+                except ValidationError as e:
+                    logging.warning(f"Item {db_item.name!r} is not valid and was left out of the memory catalog: {e}")
+                    continue
+                items[db_item.name] = (item, ResourceVersion(version=db_item.version, updated_at=db_item.updated_at))
+            self.state = CatalogState.build(items, session_operations.get_catalog_version(session))
+            self.users = {db_user.user_name: User(user_name=db_user.user_name, password=db_user.password,
+                                                  active=db_user.active)
+                          for db_user in session.scalars(select(BDUser))}
+
+    def apply(self, changes: list[ItemChange], catalog_version: Optional[ResourceVersion]):
+        """item_changes listener. Versions are the ones the write committed, so ETags match the database's."""
+        with self._lock:
+            state = self.state
+            if state is None:
+                return
+            items = dict(state.items)
+            for name, item, version in changes:
+                items.pop(name, None)
+                if item is not None:
+                    items[name] = (item, version)
+            self._swap(state, items, {name for name, _, _ in changes}, catalog_version or state.version)
+
+    def refresh(self, session: Session, names: Optional[list[str]]):
+        """
+        Re-reads the named items (all of them for None) and the catalog version, for writes made by
+        another process (see invalidation_bus). Versions come from the database, not counted.
+        """
+        if names is None:
+            self.load(session)
+            return
+        with self._lock:
+            state = self.state
+            if state is None:
+                return
+            found = session_operations.get_versioned_items(session, names)
+            items = dict(state.items)
+            for name in names:
+                items.pop(name, None)
+                if name in found:
+                    items[name] = found[name]
+            self._swap(state, items, set(names), session_operations.get_catalog_version(session))
+
+    def _swap(self, state: CatalogState, items: dict[str, tuple[Item, ResourceVersion]], touched: set[str],
+              catalog_version: ResourceVersion):
+        """Swaps in a state holding items, patching the indexes of state for the touched names. Under the lock."""
+        # A group commit can change the same item several times, the indexes only need the end result
+        removed = [(name, state.items[name][0]) for name in touched if name in state.items]
+        added = [(name, items[name][0]) for name in touched if name in items]
+
+        if len(touched) > 64 and len(touched) > len(state.items) * REBUILD_SHARE:
+            self.state = CatalogState.build(items, catalog_version)
+            return
+        names = list(state.names)
+        prices = dict(state.prices)
+        by_price = list(state.by_price)
+        by_stat: dict[str, Iterable[str]] = dict(state.by_stat)
+        copied: dict[str, set[str]] = {}
+
+        def stat_names(stat) -> set[str]:
+            stat = _stat_name(stat)
+            if stat not in copied:
+                copied[stat] = set(by_stat.get(stat, ()))
+            return copied[stat]
+
+        for name, item in removed:
+            del names[bisect.bisect_left(names, name)]
+            del prices[name]
+            del by_price[bisect.bisect_left(by_price, (item.price, name))]
+            for stat in item.stats:
+                stat_names(stat).discard(name)
+        for name, item in added:
+            bisect.insort(names, name)
+            prices[name] = item.price
+            bisect.insort(by_price, (item.price, name))
+            for stat in item.stats:
+                stat_names(stat).add(name)
+        for stat, stat_set in copied.items():
+            by_stat[stat] = frozenset(stat_set)
+        self.state = CatalogState(items, names, prices, by_price, by_stat, catalog_version)
+
+    def refresh_users(self, session: Session, usernames: Optional[list[str]]):
+        """Re-reads the named users (all of them for None), for writes made by another process."""
+        rows = session.scalars(select(BDUser) if usernames is None else
+                               select(BDUser).where(BDUser.user_name.in_(usernames))).all()
+        found = {db_user.user_name: User(user_name=db_user.user_name, password=db_user.password,
+                                         active=db_user.active) for db_user in rows}
+        with self._lock:
+            users = {} if usernames is None else dict(self.users)
+            for username in usernames or ():
+                users.pop(username, None)
+            users.update(found)
+            self.users = users
+
+    def set_user(self, user: User, previous_name: Optional[str] = None):
+        with self._lock:
+            users = dict(self.users)
+            if previous_name is not None:
+                users.pop(previous_name, None)
+            users[user.user_name] = user
+            self.users = users
+
+    def drop_user(self, username: str):
+        with self._lock:
+            users = dict(self.users)
+            users.pop(username, None)
+            self.users = users
+
+    def snapshot(self) -> CatalogState:
+        state = self.state
+        if state is None:
+            raise RuntimeError("The memory catalog is not loaded, call init_memory_catalog() first")
+        return state
+
+    # Reads shared by both services below
+
+    def get_versioned(self, name: str) -> tuple[Item, ResourceVersion]:
+        entry = self.snapshot().items.get(name)
+        if entry is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+        return entry
+
+    def get_many(self, names: list[str]) -> dict[str, Item]:
+        items = self.snapshot().items
+        return {name: items[name][0] for name in names if name in items}
+
+    def get_all(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> set:
+        state = self.snapshot()
+        names = state.matching(stats, price)
+        if names is None:
+            names = set(state.items)
+        if not names:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+        return names
+
+    def get_page(self, after: Optional[str] = None, limit: int = 100, stats: Optional[Set[str]] = None,
+                 price: Optional[tuple[int, bool]] = None, full: bool = False) -> ItemPage:
+        """Same pages and cursors as session_operations.get_item_page."""
+        state = self.snapshot()
+        start = bisect.bisect_right(state.names, after) if after is not None else 0
+        matching = state.matching(stats, price)
+        if matching is None:
+            names = state.names[start:start + limit + 1]
+        elif len(matching) * 8 < len(state.names) - start:
+            # Few matches: pick the first ones among them rather than walking the sorted names
+            names = heapq.nsmallest(limit + 1, (name for name in matching if after is None or name > after))
+        else:
+            names = []
+            for index in range(start, len(state.names)):
+                if state.names[index] in matching:
+                    names.append(state.names[index])
+                    if len(names) > limit:
+                        break
+        rows = [state.items[name][0] for name in names] if full else names
+        if len(rows) > limit:
+            return ItemPage(items=rows[:limit], next_cursor=names[limit - 1])
+        return ItemPage(items=rows, next_cursor=None)
+
+    def get_user(self, username: str) -> User:
+        user = self.users.get(username)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with name - {username} not found")
+        # Callers change the user they get (deactivate_user), the catalog's copy only changes once the write commits
+        return user.model_copy()
+
+
+memory_catalog = MemoryCatalog()
 
-class NotFoundException(Exception):
-    pass
 
 class DatabaseServiceImplAsDict(DatabaseService):
-    def __init__(self, data):
-        self.data = data
+    """
+    Answers every read from the shared MemoryCatalog. Writes go through to the SQL service, and the
+    catalog picks them up once they commit. search() is passed through too, it needs the FTS5 table.
+    """
+
+    def __init__(self, catalog: MemoryCatalog = memory_catalog, database_service: Optional[DatabaseService] = None):
+        self.catalog = catalog
+        self.database_service = database_service or DatabaseServiceImpl()
 
     def create(self, item: Item) -> str:
-        self.data[item.name] = item
-        return item.name
+        return self.database_service.create(item)
 
     def get(self, name: str) -> Item:
-        return self.data[name]
+        return self.catalog.get_versioned(name)[0]
+
+    def get_versioned(self, name: str) -> tuple[Item, ResourceVersion]:
+        return self.catalog.get_versioned(name)
+
+    def get_catalog_version(self) -> ResourceVersion:
+        return self.catalog.snapshot().version
+
+    def get_many(self, names: list[str]) -> dict[str, Item]:
+        return self.catalog.get_many(names)
+
+    def update(self, name: str, item: Item) -> Item:
+        return self.database_service.update(name, item)
+
+    def bulk_upsert(self, items: list[Item]) -> int:
+        return self.database_service.bulk_upsert(items)
+
+    def delete(self, name: str, cls: Type[DeclarativeBase]) -> bool:
+        deleted = self.database_service.delete(name, cls)
+        if cls is BDUser:
+            self.catalog.drop_user(name)
+        return deleted
+
+    def get_all(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> set:
+        return self.catalog.get_all(stats, price)
+
+    def get_page(self, after: Optional[str] = None, limit: int = 100, stats: Optional[Set[str]] = None,
+                 price: Optional[tuple[int, bool]] = None, full: bool = False) -> ItemPage:
+        return self.catalog.get_page(after, limit, stats, price, full)
+
+    def search(self, query: str, prefix: bool = True, limit: int = 20, stats: Optional[Set[str]] = None,
+               price: Optional[tuple[int, bool]] = None, full: bool = False) -> list[Item] | list[str]:
+        return self.database_service.search(query, prefix, limit, stats, price, full)
+
+    def get_user(self, username: str) -> User:
+        return self.catalog.get_user(username)
+
+    def create_user(self, user: User) -> str:
+        name = self.database_service.create_user(user)
+        self.catalog.set_user(User(user_name=user.user_name, password=user.password, active=True))
+        return name
+
+    def update_user(self, username: str, user: User | UserNoPass) -> User:
+        updated = self.database_service.update_user(username, user)
+        self.catalog.set_user(updated, username)
+        return updated
+
+
+class AsyncDatabaseServiceImplAsDict(AsyncDatabaseService):
+    """Async counterpart of DatabaseServiceImplAsDict. Reads never await anything, writes await the async SQL service."""
+
+    def __init__(self, catalog: MemoryCatalog = memory_catalog,
+                 database_service: Optional[AsyncDatabaseService] = None):
+        self.catalog = catalog
+        self.database_service = database_service or AsyncDatabaseServiceImpl()
+
+    async def create(self, item: Item) -> str:
+        return await self.database_service.create(item)
+
+    async def get(self, name: str) -> Item:
+        return self.catalog.get_versioned(name)[0]
+
+    async def get_versioned(self, name: str) -> tuple[Item, ResourceVersion]:
+        return self.catalog.get_versioned(name)
+
+    async def get_catalog_version(self) -> ResourceVersion:
+        return self.catalog.snapshot().version
+
+    async def get_many(self, names: list[str]) -> dict[str, Item]:
+        return self.catalog.get_many(names)
+
+    async def update(self, name: str, item: Item) -> Item:
+        return await self.database_service.update(name, item)
+
+    async def bulk_upsert(self, items: list[Item]) -> int:
+        return await self.database_service.bulk_upsert(items)
+
+    async def delete(self, name: str, cls: Type[DeclarativeBase]) -> bool:
+        deleted = await self.database_service.delete(name, cls)
+        if cls is BDUser:
+            self.catalog.drop_user(name)
+        return deleted
+
+    async def get_all(self, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None) -> set:
+        return self.catalog.get_all(stats, price)
+
+    async def get_page(self, after: Optional[str] = None, limit: int = 100, stats: Optional[Set[str]] = None,
+                       price: Optional[tuple[int, bool]] = None, full: bool = False) -> ItemPage:
+        return self.catalog.get_page(after, limit, stats, price, full)
+
+    async def search(self, query: str, prefix: bool = True, limit: int = 20, stats: Optional[Set[str]] = None,
+                     price: Optional[tuple[int, bool]] = None, full: bool = False) -> list[Item] | list[str]:
+        return await self.database_service.search(query, prefix, limit, stats, price, full)
+
+    async def get_user(self, username: str) -> User:
+        return self.catalog.get_user(username)
+
+    async def create_user(self, user: User) -> str:
+        name = await self.database_service.create_user(user)
+        self.catalog.set_user(User(user_name=user.user_name, password=user.password, active=True))
+        return name
+
+    async def update_user(self, username: str, user: User | UserNoPass) -> User:
+        updated = await self.database_service.update_user(username, user)
+        self.catalog.set_user(updated, username)
+        return updated
+
+
+def init_memory_catalog(session_factory: Optional[sessionmaker[Session]] = None) -> MemoryCatalog:
+    # Listening before loading, so a write committed meanwhile is not missed
+    item_changes.add_listener(memory_catalog.apply)
+    invalidation_bus.subscribe(invalidation_bus.ITEMS, _reload_items)
+    invalidation_bus.subscribe(invalidation_bus.USERS, _reload_users)
+    with (session_factory or database_engine.get_session_factory())() as session:
+        memory_catalog.load(session)
+    return memory_catalog
 
-    def update(self, id: str, item: Item) -> bool:
-        try:
-            self.data[id] = item
-        except KeyError:
-            return False
-        return True
 
-    def delete(self, name: str) -> bool:
-        try:
-            del self.data[name]
-        except KeyError:
-            return False
-        return True
+def _reload_items(names: Optional[list[str]]):
+    with database_engine.get_session_factory()() as session:
+        memory_catalog.refresh(session, names)
 
-    def get_all(self) -> set:
-        return set(self.data.keys())
 
+def _reload_users(usernames: Optional[list[str]]):
+    with database_engine.get_session_factory()() as session:
+        memory_catalog.refresh_users(session, usernames)
 
-shared_data = {}
 
-def get_db_service() -> DatabaseServiceImplAsDict:
-    return DatabaseServiceImplAsDict(shared_data)
\ No newline at end of file
+def shutdown_memory_catalog():
+    item_changes.remove_listener(memory_catalog.apply)
+    invalidation_bus.unsubscribe(invalidation_bus.ITEMS, _reload_items)
+    invalidation_bus.unsubscribe(invalidation_bus.USERS, _reload_users)
+    memory_catalog.state = None
+    memory_catalog.users = {}
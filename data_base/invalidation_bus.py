@@ -0,0 +1,404 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+try:
+    import redis
+except ImportError:  # redis is optional, only [invalidation_bus] transport = redis needs it
+    redis = None
+
+import metrics
+from app_config import config
+from data_base import item_changes
+from data_base.item_changes import ItemChange
+from pydantic_classes import ResourceVersion
+
+# Every worker process has its own caches (item_cache, the auth cache, the memory catalog, the stat index,
+# the change feed), and a write only updates those of the worker that made it. The bus tells the other
+# workers which keys changed: the names of the items of every committed write, and the users written.
+# Each worker then drops or re-reads those keys. Messages carry a sequence number per process. A worker
+# that sees a gap (a message lost to a full socket buffer, or during a broker outage) flushes whole topics
+# instead, so nothing stays stale past the next message that gets through. With transport = local,
+# the default, nothing leaves the process, which is all a single worker needs.
+TRANSPORT = config.get("invalidation_bus", "transport", fallback="local")
+SOCKET_DIR = config.get("invalidation_bus", "socket_dir", fallback="/tmp/lolitems-bus")
+BROKER_URL = config.get("invalidation_bus", "url", fallback="redis://localhost:6379/0")
+CHANNEL = config.get("invalidation_bus", "channel", fallback="lolitems:invalidations")
+# More keys than this in one write invalidate the whole topic instead
+MAX_KEYS = config.getint("invalidation_bus", "max_keys", fallback=500)
+RECEIVE_TIMEOUT = 0.5
+
+ITEMS = "item"
+USERS = "user"
+
+invalidations_published = metrics.registry.register(metrics.Counter(
+    "invalidation_bus_published_total", "Invalidation messages published to the other workers.", ["topic"]))
+invalidations_received = metrics.registry.register(metrics.Counter(
+    "invalidation_bus_received_total", "Invalidation messages received from other workers.", ["topic"]))
+invalidation_failures = metrics.registry.register(metrics.Counter(
+    "invalidation_bus_failures_total", "Invalidation messages that could not be sent or received.", ["stage"]))
+invalidation_gaps = metrics.registry.register(metrics.Counter(
+    "invalidation_bus_gaps_total", "Missed invalidation messages, each answered by flushing every topic."))
+invalidation_delay = metrics.registry.register(metrics.Histogram(
+    "invalidation_bus_propagation_seconds", "Time from publishing an invalidation to another worker applying it.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+
+# Called with the changed keys of the topic, or None when every key has to be considered changed
+Handler = Callable[[Optional[list[str]]], None]
+
+_handlers: dict[str, list[Handler]] = {}
+
+
+def subscribe(topic: str, handler: Handler):
+    """Handlers run on the bus's receiver thread, for messages of other processes only."""
+    _handlers.setdefault(topic, []).append(handler)
+
+
+def unsubscribe(topic: str, handler: Handler):
+    if handler in _handlers.get(topic, ()):
+        _handlers[topic].remove(handler)
+
+
+def _deliver(topic: str, keys: Optional[list[str]]):
+    for handler in list(_handlers.get(topic, ())):
+        try:
+            handler(keys)
+        except Exception:
+            logging.exception(f"Invalidation handler for {topic} failed")
+
+
+class InvalidationBus(ABC):
+    """
+    publish() only queues the message. A sender thread hands messages to the transport (_send) and a receiver
+    thread takes them from it (_receive) and runs the handlers. Transports implement _send and _receive,
+    and _open and _close when they hold resources.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.seq = 0
+        self._outbox: queue.SimpleQueue = queue.SimpleQueue()
+        self._seq_lock = threading.Lock()
+        # origin -> last sequence number seen from it
+        self._last_seen: dict[str, int] = {}
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        self._open()
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._send_loop, name="invalidation-bus-sender", daemon=True),
+                         threading.Thread(target=self._receive_loop, name="invalidation-bus-receiver", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        item_changes.add_listener(self._publish_item_changes)
+
+    def stop(self):
+        """Sends what is already queued, then stops both threads."""
+        item_changes.remove_listener(self._publish_item_changes)
+        if not self._threads:
+            return
+        self._outbox.put(None)
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._close()
+
+    def publish(self, topic: str, keys: Optional[Iterable[str]]):
+        keys = sorted(set(keys)) if keys is not None else None
+        if keys is not None and len(keys) > MAX_KEYS:
+            keys = None
+        with self._seq_lock:
+            self.seq += 1
+            # Queued under the lock, so messages leave in sequence order
+            self._outbox.put(json.dumps({"origin": self.origin, "started": self.started_at, "seq": self.seq,
+                                         "sent": time.time(), "topic": topic, "keys": keys}).encode())
+        invalidations_published.inc(topic)
+
+    def _publish_item_changes(self, changes: list[ItemChange], catalog_version: Optional[ResourceVersion]):
+        self.publish(ITEMS, [name for name, _, _ in changes])
+
+    def dispatch(self, payload: bytes):
+        message = json.loads(payload)
+        origin = message["origin"]
+        if origin == self.origin:
+            return
+        previous = self._last_seen.get(origin)
+        self._last_seen[origin] = message["seq"]
+        # A process started after this one must be seen from its first message on
+        expected = previous + 1 if previous is not None else (1 if message["started"] > self.started_at else None)
+        if expected is not None and message["seq"] != expected:
+            invalidation_gaps.inc()
+            for topic in list(_handlers):
+                _deliver(topic, None)
+        invalidations_received.inc(message["topic"])
+        invalidation_delay.observe(max(0.0, time.time() - message["sent"]))
+        _deliver(message["topic"], message["keys"])
+
+    def _send_loop(self):
+        while True:
+            payload = self._outbox.get()
+            if payload is None:
+                return
+            try:
+                self._send(payload)
+            except Exception as e:
+                invalidation_failures.inc("send")
+                logging.warning(f"Invalidation message could not be sent: {e}")
+
+    def _receive_loop(self):
+        while not self._stopping.is_set():
+            try:
+                payload = self._receive(RECEIVE_TIMEOUT)
+            except Exception as e:
+                invalidation_failures.inc("receive")
+                logging.warning(f"Invalidation messages could not be received: {e}")
+                self._stopping.wait(1)
+                continue
+            if payload is None:
+                continue
+            try:
+                self.dispatch(payload)
+            except Exception as e:
+                # A malformed message is lost like any other, the gap it leaves flushes on the next good one
+                invalidation_failures.inc("decode")
+                logging.warning(f"Invalidation message could not be read: {e}")
+
+    def stats(self) -> dict:
+        return {"transport": type(self).__name__, "origin": self.origin, "published": self.seq,
+                "peers_seen": len(self._last_seen)}
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    @abstractmethod
+    def _send(self, payload: bytes):
+        pass
+
+    @abstractmethod
+    def _receive(self, timeout: float) -> Optional[bytes]:
+        """The next message, None when none came within timeout."""
+        pass
+
+
+class LocalBus(InvalidationBus):
+    """transport = local: one process, its caches are already kept current by its own writes."""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def publish(self, topic: str, keys: Optional[Iterable[str]]):
+        pass
+
+    def _send(self, payload: bytes):
+        pass
+
+    def _receive(self, timeout: float) -> Optional[bytes]:
+        return None
+
+
+class UnixSocketBus(InvalidationBus):
+    """
+    transport = unix, for the workers of one host: every process binds a datagram socket in socket_dir and
+    sends each message to every other socket found there. No broker process is involved. A socket left
+    behind by a dead process refuses the message and is removed.
+    """
+
+    def __init__(self, directory: str = SOCKET_DIR):
+        super().__init__()
+        self.directory = Path(directory)
+        self.path: Optional[Path] = None
+        self._socket: Optional[socket.socket] = None
+        self._sender: Optional[socket.socket] = None
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f"{os.getpid()}-{self.origin[:8]}.sock"
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(str(self.path))
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # A peer whose buffer is full misses the message and flushes on the gap, the sender never waits
+        self._sender.setblocking(False)
+
+    def _close(self):
+        self._socket.close()
+        self._sender.close()
+        self.path.unlink(missing_ok=True)
+
+    def _send(self, payload: bytes):
+        for peer in self.directory.glob("*.sock"):
+            if peer == self.path:
+                continue
+            try:
+                self._sender.sendto(payload, str(peer))
+            except (ConnectionRefusedError, FileNotFoundError):
+                peer.unlink(missing_ok=True)
+            except BlockingIOError:
+                invalidation_failures.inc("send")
+
+    def _receive(self, timeout: float) -> Optional[bytes]:
+        self._socket.settimeout(timeout)
+        try:
+            return self._socket.recv(1 << 18)
+        except socket.timeout:
+            return None
+
+
+class BrokerSubscription(ABC):
+    @abstractmethod
+    def get(self, timeout: float) -> Optional[bytes]:
+        """The next message, None when none came within timeout."""
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class Broker(ABC):
+    """A publish/subscribe broker (Redis and the like). Every subscriber of a channel gets every message."""
+
+    @abstractmethod
+    def publish(self, channel: str, payload: bytes):
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> BrokerSubscription:
+        pass
+
+
+class _InMemorySubscription(BrokerSubscription):
+    def __init__(self, broker: "InMemoryBroker", channel: str):
+        self.broker = broker
+        self.channel = channel
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    def get(self, timeout: float) -> Optional[bytes]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker(Broker):
+    """transport = memory: a broker inside the process, standing in for a real one in tests and benchmarks."""
+
+    def __init__(self):
+        self._subscriptions: dict[str, list[_InMemorySubscription]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel: str, payload: bytes):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.queue.put(payload)
+
+    def subscribe(self, channel: str) -> BrokerSubscription:
+        subscription = _InMemorySubscription(self, channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: _InMemorySubscription):
+        with self._lock:
+            if subscription in self._subscriptions.get(subscription.channel, ()):
+                self._subscriptions[subscription.channel].remove(subscription)
+
+
+class _RedisSubscription(BrokerSubscription):
+    def __init__(self, client, channel: str):
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(channel)
+
+    def get(self, timeout: float) -> Optional[bytes]:
+        message = self.pubsub.get_message(timeout=timeout)
+        return message["data"] if message is not None else None
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBroker(Broker):
+    """transport = redis: Redis PUBLISH/SUBSCRIBE at url, needs the redis package."""
+
+    def __init__(self, url: str = BROKER_URL):
+        if redis is None:
+            raise RuntimeError("[invalidation_bus] transport = redis needs the redis package")
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel: str, payload: bytes):
+        self.client.publish(channel, payload)
+
+    def subscribe(self, channel: str) -> BrokerSubscription:
+        return _RedisSubscription(self.client, channel)
+
+
+class BrokerBus(InvalidationBus):
+    """Publishes to and listens on one channel of a Broker, for workers spread over several hosts."""
+
+    def __init__(self, broker: Broker, channel: str = CHANNEL):
+        super().__init__()
+        self.broker = broker
+        self.channel = channel
+        self._subscription: Optional[BrokerSubscription] = None
+
+    def _open(self):
+        self._subscription = self.broker.subscribe(self.channel)
+
+    def _close(self):
+        self._subscription.close()
+
+    def _send(self, payload: bytes):
+        self.broker.publish(self.channel, payload)
+
+    def _receive(self, timeout: float) -> Optional[bytes]:
+        return self._subscription.get(timeout)
+
+
+def create_bus(transport: str = TRANSPORT) -> InvalidationBus:
+    if transport == "local":
+        return LocalBus()
+    if transport == "unix":
+        return UnixSocketBus()
+    if transport == "memory":
+        return BrokerBus(InMemoryBroker())
+    if transport == "redis":
+        return BrokerBus(RedisBroker())
+    raise ValueError(f"Unknown [invalidation_bus] transport: {transport}. Must be local, unix, memory or redis")
+
+
+invalidation_bus: InvalidationBus = LocalBus()
+
+
+def start_invalidation_bus() -> InvalidationBus:
+    global invalidation_bus
+    invalidation_bus = create_bus()
+    invalidation_bus.start()
+    return invalidation_bus
+
+
+def stop_invalidation_bus():
+    invalidation_bus.stop()
+
+
+def publish(topic: str, keys: Optional[Iterable[str]]):
+    invalidation_bus.publish(topic, keys)
@@ -0,0 +1,73 @@
+import logging
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from pydantic_classes import Item, ResourceVersion
+
+# The item writes in session_operations record what they changed on the session,
+# and listeners get the list once the transaction has committed (never for a rollback).
+# AsyncSession runs on top of a sync Session, so this covers both database services.
+# Changes made inside a savepoint are kept when it is released and dropped when it is rolled back.
+
+# (name, new body, the row's version), or (name, None, None) once the item is gone.
+# A rename is (old name, None, None) then (new name, body, version).
+ItemChange = tuple[str, Optional[Item], Optional[ResourceVersion]]
+# Listeners also get the catalog version the transaction committed
+ItemChangeListener = Callable[[list[ItemChange], Optional[ResourceVersion]], None]
+
+_listeners: list[ItemChangeListener] = []
+
+
+def add_listener(listener: ItemChangeListener):
+    _listeners.append(listener)
+
+
+def remove_listener(listener: ItemChangeListener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def record(session: Session, name: str, item: Optional[Item], version: Optional[ResourceVersion]):
+    session.info.setdefault("item_changes", []).append((name, item, version))
+
+
+def record_catalog_version(session: Session, version: ResourceVersion):
+    session.info["catalog_version"] = version
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _mark(session: Session, transaction):
+    # A savepoint remembers how many changes came before it, to drop only its own if it is rolled back
+    if transaction.nested:
+        session.info.setdefault("item_change_marks", []).append(len(session.info.get("item_changes", ())))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session: Session):
+    if session.in_nested_transaction():
+        # A released savepoint: its changes wait for the enclosing transaction to commit
+        session.info["item_change_marks"].pop()
+        return
+    changes = session.info.pop("item_changes", None)
+    catalog_version = session.info.pop("catalog_version", None)
+    if not changes:
+        return
+    for listener in list(_listeners):
+        try:
+            listener(changes, catalog_version)
+        except Exception:
+            # The write is committed already, a broken listener must not turn it into an error response
+            logging.exception("Item change listener failed")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    if session.in_nested_transaction():
+        mark = session.info["item_change_marks"].pop()
+        del session.info.get("item_changes", [])[mark:]
+        return
+    session.info.pop("item_changes", None)
+    session.info.pop("item_change_marks", None)
+    session.info.pop("catalog_version", None)
@@ -0,0 +1,67 @@
+from typing import Callable
+
+from sqlalchemy import Connection, Engine, inspect
+
+from data_base.sqlalchemy_db_classes import Base
+
+# create_all only creates missing tables, so anything added to an existing table
+# (indexes, columns, virtual tables) needs a step here to reach database.db files created before it.
+# Steps run in order, once each: PRAGMA user_version records how many have been applied.
+# They are written to be idempotent, because a fresh database already gets everything from create_all.
+
+
+def _create_missing_indexes(connection: Connection):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    # Refresh the planner statistics so the new indexes are actually picked up
+    connection.exec_driver_sql("ANALYZE")
+
+
+def _add_item_versions(connection: Connection):
+    columns = {column["name"] for column in inspect(connection).get_columns("items")}
+    if "version" not in columns:
+        connection.exec_driver_sql("ALTER TABLE items ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    if "updated_at" not in columns:
+        # SQLite only allows constant defaults in ADD COLUMN, so existing rows are stamped afterwards
+        connection.exec_driver_sql("ALTER TABLE items ADD COLUMN updated_at DATETIME")
+        connection.exec_driver_sql("UPDATE items SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL")
+    connection.exec_driver_sql(
+        "INSERT OR IGNORE INTO catalog_state (id, version, updated_at) VALUES (1, 1, CURRENT_TIMESTAMP)"
+    )
+
+
+def rebuild_search_index(connection: Connection):
+    """Refills items_fts from items. Also needed after a VACUUM, which may renumber the items rowids."""
+    connection.exec_driver_sql("DELETE FROM items_fts")
+    connection.exec_driver_sql(
+        "INSERT INTO items_fts (rowid, name, description) SELECT rowid, name, coalesce(description, '') FROM items"
+    )
+
+
+def _add_search_index(connection: Connection):
+    # prefix='2 3' keeps extra index entries so autocompletion prefixes don't scan the whole vocabulary
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+        "name, description, prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+    )
+    rebuild_search_index(connection)
+
+
+MIGRATIONS: list[Callable[[Connection], None]] = [
+    _create_missing_indexes,
+    _add_item_versions,
+    _add_search_index,
+]
+
+
+def migrate(engine: Engine):
+    with engine.begin() as connection:
+        if connection.dialect.name != "sqlite":
+            for step in MIGRATIONS:
+                step(connection)
+            return
+        applied = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        for number, step in enumerate(MIGRATIONS[applied:], start=applied + 1):
+            step(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
@@ -0,0 +1,348 @@
+import re
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Set, Type
+
+from fastapi import HTTPException
+from starlette import status
+
+from pydantic_classes import Item, ItemPage, ResourceVersion, User, UserNoPass
+from data_base import item_changes
+from data_base.sqlalchemy_db_classes import BDCatalogState, BDItem, BDStat, BDUser, items_fts
+from sqlalchemy.orm import Session, DeclarativeBase, joinedload, selectinload
+from sqlalchemy import Select, bindparam, delete, func, insert, intersect, literal_column, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# Query bodies shared by DatabaseServiceImpl and AsyncDatabaseServiceImpl.
+# Each function works on an open sync Session, so the async service can run it through AsyncSession.run_sync.
+
+
+def to_item(db_item: BDItem) -> Item:
+    return Item(name=db_item.name, description=db_item.description,
+                price=db_item.price, sell_price=db_item.sell_price,
+                stats={db_stat.name: db_stat.value for db_stat in db_item.stats})
+
+
+def filter_items(stmt: Select, stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None,
+                 correlated: bool = False) -> Select:
+    """
+    Adds the price and stat filters of GET /items/ to stmt, as a single statement either way.
+    Both stat forms are answered from the (name, item_name) index without touching the stats rows:
+    - correlated (keyset pages, search): a correlated COUNT per candidate item, so a scan
+      under a LIMIT stops as soon as enough rows matched.
+    - otherwise: INTERSECT of one index range per stat, which beats per-item lookups when
+      every matching name has to be produced.
+    """
+    if price is not None and price[0] is not None:
+        if price[1]:
+            stmt = stmt.where(BDItem.price >= price[0])
+        else:
+            stmt = stmt.where(BDItem.price < price[0])
+
+    if stats is not None and len(stats) > 0:
+        if correlated:
+            matching_stats = (
+                select(func.count())
+                .where(BDStat.item_name == BDItem.name, BDStat.name.in_(stats))
+                .scalar_subquery()
+            )
+            stmt = stmt.where(matching_stats == len(stats))
+        else:
+            per_stat = [select(BDStat.item_name).where(BDStat.name == stat) for stat in stats]
+            stmt = stmt.where(BDItem.name.in_(per_stat[0] if len(per_stat) == 1 else intersect(*per_stat)))
+    return stmt
+
+
+def utcnow() -> datetime:
+    # Naive UTC, the way SQLite stores DateTime columns
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+GROUP_COMMIT = "group_commit"
+
+
+def commit(session: Session):
+    """
+    Ends every write below. In a write_queue group session it only flushes: the queue runs many writes
+    in one transaction (one savepoint each) and commits them together.
+    """
+    if session.info.get(GROUP_COMMIT):
+        session.flush()
+    else:
+        session.commit()
+
+
+def bump_catalog_version(session: Session, now: datetime):
+    """
+    Called in the same transaction as every item write, so the catalog version never lags the data.
+    A group commit bumps it once for the whole group, like any other transaction.
+    """
+    if session.info.get(GROUP_COMMIT):
+        return
+    version = session.execute(
+        update(BDCatalogState)
+        .where(BDCatalogState.id == 1)
+        .values(version=BDCatalogState.version + 1, updated_at=now)
+        .returning(BDCatalogState.version)
+    ).scalar_one_or_none()
+    if version is None:
+        version = 1
+        session.add(BDCatalogState(id=1, version=1, updated_at=now))
+    item_changes.record_catalog_version(session, ResourceVersion(version=version, updated_at=now))
+
+
+def get_catalog_version(session: Session) -> ResourceVersion:
+    state = session.get(BDCatalogState, 1)
+    if state is None:
+        return ResourceVersion(version=0, updated_at=datetime(1970, 1, 1))
+    return ResourceVersion(version=state.version, updated_at=state.updated_at)
+
+
+def refresh_search_index(session: Session, names: list[str]):
+    """Re-reads the named items into items_fts. Call it once the item rows are flushed."""
+    params = {"names": names}
+    session.execute(text(
+        "DELETE FROM items_fts WHERE rowid IN (SELECT rowid FROM items WHERE name IN :names)"
+    ).bindparams(bindparam("names", expanding=True)), params)
+    session.execute(text(
+        "INSERT INTO items_fts (rowid, name, description) "
+        "SELECT rowid, name, coalesce(description, '') FROM items WHERE name IN :names"
+    ).bindparams(bindparam("names", expanding=True)), params)
+
+
+def drop_from_search_index(session: Session, names: list[str]):
+    """Call it before the item rows are deleted, their rowids locate the index entries."""
+    session.execute(text(
+        "DELETE FROM items_fts WHERE rowid IN (SELECT rowid FROM items WHERE name IN :names)"
+    ).bindparams(bindparam("names", expanding=True)), {"names": names})
+
+
+def to_match_query(query: str, prefix: bool) -> Optional[str]:
+    """
+    Turns user input into an FTS5 query: every word must match, quoted so FTS5 operators in the input are
+    taken literally, and with prefix the last word also matches as a prefix (autocompletion).
+    """
+    words = [word for word in re.split(r"\W+", query) if word]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_items(session: Session, query: str, prefix: bool = True, limit: int = 20,
+                 stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None,
+                 full: bool = False) -> list[Item] | list[str]:
+    """Best matches first by bm25, a hit in the name weighs ten times a hit in the description."""
+    match = to_match_query(query, prefix)
+    if match is None:
+        return []
+    columns = select(BDItem).options(selectinload(BDItem.stats)) if full else select(BDItem.name)
+    stmt = (
+        filter_items(columns.join(items_fts, items_fts.c.rowid == literal_column("items.rowid")),
+                     stats, price, correlated=True)
+        .where(text("items_fts MATCH :match").bindparams(match=match))
+        .order_by(func.bm25(literal_column("items_fts"), 10.0, 1.0))
+        .limit(limit)
+    )
+    if full:
+        return [to_item(db_item) for db_item in session.scalars(stmt)]
+    return list(session.scalars(stmt))
+
+
+def create_item(session: Session, item: Item) -> str:
+    now = utcnow()
+    db_item = BDItem(
+        name=item.name,
+        description=item.description,
+        price=item.price,
+        sell_price=item.sell_price,
+        version=1,
+        updated_at=now
+    )
+    for stat_name, stat_value in item.stats.items():
+        db_item.stats.append(BDStat(name=stat_name, value=stat_value))
+    session.add(db_item)
+    session.flush()
+    refresh_search_index(session, [item.name])
+    bump_catalog_version(session, now)
+    item_changes.record(session, item.name, item, ResourceVersion(version=1, updated_at=now))
+    commit(session)
+    return item.name
+
+
+def select_items_with_stats(names: Iterable[str]) -> Select:
+    """Items and all of their stats in one round trip: a LEFT OUTER JOIN, so items without stats are kept."""
+    return select(BDItem).options(joinedload(BDItem.stats)).where(BDItem.name.in_(names))
+
+
+def get_item(session: Session, item_id: str) -> Item:
+    db_item = session.scalars(select_items_with_stats([item_id])).unique().first()
+    if not db_item:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    return to_item(db_item)
+
+
+def get_versioned_item(session: Session, item_id: str) -> tuple[Item, ResourceVersion]:
+    db_item = session.scalars(select_items_with_stats([item_id])).unique().first()
+    if not db_item:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    return to_item(db_item), ResourceVersion(version=db_item.version, updated_at=db_item.updated_at)
+
+
+def get_items(session: Session, names: Iterable[str]) -> dict[str, Item]:
+    """Every existing item among names, keyed by name, fetched with a single IN query."""
+    return {db_item.name: to_item(db_item) for db_item in session.scalars(select_items_with_stats(names)).unique()}
+
+
+def get_versioned_items(session: Session, names: Iterable[str]) -> dict[str, tuple[Item, ResourceVersion]]:
+    """Like get_items, with each item's version. What the in-memory copies reload a name from."""
+    return {db_item.name: (to_item(db_item), ResourceVersion(version=db_item.version, updated_at=db_item.updated_at))
+            for db_item in session.scalars(select_items_with_stats(names)).unique()}
+
+
+def update_item(session: Session, item_id: str, item: Item) -> Item:
+    db_item = session.scalars(select_items_with_stats([item_id])).unique().first()
+    if not db_item:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    for attr in ['name', 'description', 'price', 'sell_price']:
+        setattr(db_item, attr, getattr(item, attr))
+    db_item.stats = [BDStat(name=stat_name, value=stat_value) for stat_name, stat_value in item.stats.items()]
+    now = utcnow()
+    db_item.version += 1
+    db_item.updated_at = now
+    updated_item = to_item(db_item)
+    session.flush()
+    # A rename keeps the rowid, so the old index entry is replaced as well
+    refresh_search_index(session, [item.name])
+    bump_catalog_version(session, now)
+    if item_id != item.name:
+        item_changes.record(session, item_id, None, None)
+    item_changes.record(session, item.name, updated_item, ResourceVersion(version=db_item.version, updated_at=now))
+    commit(session)
+    return updated_item
+
+
+def bulk_upsert_items(session: Session, items: list[Item], batch_size: int = 1000) -> int:
+    """
+    Inserts or replaces items and their stats in one transaction, batch_size rows per executemany.
+    A name repeated in items keeps its last occurrence.
+    """
+    items_by_name = {item.name: item for item in items}
+    names = list(items_by_name)
+    now = utcnow()
+    upsert = sqlite_insert(BDItem.__table__)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[BDItem.__table__.c.name],
+        set_={
+            **{column: upsert.excluded[column] for column in ['description', 'price', 'sell_price', 'updated_at']},
+            "version": BDItem.__table__.c.version + 1,
+        },
+    ).returning(BDItem.__table__.c.name, BDItem.__table__.c.version)
+    versions: dict[str, int] = {}
+    for start in range(0, len(names), batch_size):
+        batch = [items_by_name[name] for name in names[start:start + batch_size]]
+        versions.update(session.execute(upsert, [
+            {"name": item.name, "description": item.description, "price": item.price, "sell_price": item.sell_price,
+             "version": 1, "updated_at": now}
+            for item in batch
+        ]).all())
+        session.execute(delete(BDStat).where(BDStat.item_name.in_([item.name for item in batch])))
+        refresh_search_index(session, [item.name for item in batch])
+        stat_rows = [{"name": stat_name, "value": stat_value, "item_name": item.name}
+                     for item in batch for stat_name, stat_value in item.stats.items()]
+        if stat_rows:
+            session.execute(insert(BDStat), stat_rows)
+    if names:
+        bump_catalog_version(session, now)
+    for name, item in items_by_name.items():
+        item_changes.record(session, name, item, ResourceVersion(version=versions[name], updated_at=now))
+    commit(session)
+    return len(names)
+
+
+def delete_row(session: Session, item_id: str, cls: Type[DeclarativeBase]) -> bool:
+    db_item = session.get(cls, item_id)
+    if not db_item:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    if cls is BDItem:
+        drop_from_search_index(session, [item_id])
+        bump_catalog_version(session, utcnow())
+        item_changes.record(session, item_id, None, None)
+    session.delete(db_item)
+    commit(session)
+    return True
+
+
+def get_all_names(session: Session, stats: Optional[Set[str]] = None,
+                  price: Optional[tuple[int, bool]] = None) -> set:
+    stmt = filter_items(select(BDItem.name), stats, price)
+    bd_items = session.execute(stmt).all()
+    if not bd_items:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    items_set = set()
+    for item in bd_items:
+        items_set.add(item.name)
+    return items_set
+
+
+def get_item_page(session: Session, after: Optional[str] = None, limit: int = 100,
+                  stats: Optional[Set[str]] = None, price: Optional[tuple[int, bool]] = None,
+                  full: bool = False) -> ItemPage:
+    """
+    Keyset pagination on the item name: the page starts right after the `after` cursor,
+    so every page costs an index range scan no matter how deep the client has paged.
+    """
+    columns = select(BDItem).options(joinedload(BDItem.stats)) if full else select(BDItem.name)
+    stmt = filter_items(columns, stats, price, correlated=True)
+    if after is not None:
+        stmt = stmt.where(BDItem.name > after)
+    # One extra row tells whether there is a next page without a COUNT query
+    stmt = stmt.order_by(BDItem.name).limit(limit + 1)
+    if full:
+        rows = [to_item(db_item) for db_item in session.scalars(stmt).unique()]
+        names = [item.name for item in rows]
+    else:
+        rows = names = list(session.scalars(stmt))
+    if len(rows) > limit:
+        return ItemPage(items=rows[:limit], next_cursor=names[limit - 1])
+    return ItemPage(items=rows, next_cursor=None)
+
+
+def get_user(session: Session, username: str) -> User:
+    stmt = (
+        select(BDUser)
+        .where(BDUser.user_name == username)
+    )
+    db_item = session.scalars(stmt).first()
+    if not db_item:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with name - {username} not found")
+    return User(user_name=db_item.user_name, password=db_item.password, active=db_item.active)
+
+
+def create_user(session: Session, user: User) -> str:
+    session.expire_on_commit = False
+    bd_user = BDUser(
+        user_name=user.user_name,
+        password=user.password,
+        active=True
+    )
+    session.add(bd_user)
+    commit(session)
+    return bd_user.user_name
+
+
+def update_user(session: Session, username: str, user: User | UserNoPass) -> User:
+    stmt = (
+        select(BDUser)
+        .where(BDUser.user_name == username)
+    )
+    db_item = session.scalars(stmt).first()
+    if not db_item:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    if user.password:
+        db_item.password = user.password
+    for attr in ['user_name', 'active']:
+        setattr(db_item, attr, getattr(user, attr))
+    commit(session)
+    return User(user_name=db_item.user_name, password=db_item.password, active=db_item.active)
@@ -1,6 +1,7 @@
+from datetime import datetime
 from typing import List
 from typing import Optional
-from sqlalchemy import ForeignKey, Boolean
+from sqlalchemy import ForeignKey, Boolean, Index, func, table, column
 from sqlalchemy import String
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
@@ -14,8 +15,11 @@ class BDItem(Base):
     __tablename__ = "items"
     name: Mapped[str] = mapped_column(String(30),primary_key=True)
     description: Mapped[Optional[str]] = mapped_column(String(1000),nullable=True)
-    price: Mapped[Optional[float]]
+    price: Mapped[Optional[float]] = mapped_column(index=True)
     sell_price: Mapped[Optional[float]]
+    # Bumped by every write, together with CatalogState.version
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.current_timestamp())
     stats: Mapped[List["BDStat"]] = relationship(
         back_populates="item", cascade="all, delete-orphan"
     )
@@ -24,14 +28,29 @@ class BDItem(Base):
 
 class BDStat(Base):
     __tablename__ = "stats"
+    # (name, item_name) answers the stat filter from the index alone
+    __table_args__ = (Index("ix_stats_name_item_name", "name", "item_name"),)
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(100))
     value: Mapped[int]
-    item_name: Mapped[str] = mapped_column(ForeignKey("items.name"))
+    item_name: Mapped[str] = mapped_column(ForeignKey("items.name"), index=True)
     item: Mapped["BDItem"] = relationship(back_populates="stats")
     def __repr__(self) -> str:
         return f"Stat(id={self.id!r}, Name={self.name!r}, Value={self.value!r}, Item name={self.item_name!r})"
 
+# FTS5 virtual table over item names and descriptions, rowid = items.rowid.
+# Not part of Base.metadata (create_all can't create virtual tables), migrations.py creates it.
+items_fts = table("items_fts", column("rowid"), column("name"), column("description"))
+
+class BDCatalogState(Base):
+    """Single row (id = 1) whose version changes on any item create, update or delete."""
+    __tablename__ = "catalog_state"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int]
+    updated_at: Mapped[datetime]
+    def __repr__(self) -> str:
+        return f"CatalogState(Version={self.version!r}, Updated at={self.updated_at!r})"
+
 class BDUser(Base):
     __tablename__ = "users"
     user_name: Mapped[str] = mapped_column(primary_key=True)
@@ -0,0 +1,238 @@
+import heapq
+import operator
+import re
+import threading
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, without it GET /items/query answers 503
+    np = None
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+from starlette import status
+
+from app_config import config
+from data_base import database_engine, invalidation_bus, item_changes, session_operations
+from data_base.item_changes import ItemChange
+from data_base.sqlalchemy_db_classes import BDItem, BDStat
+from pydantic_classes import Item, ResourceVersion, Stats
+
+STAT_FIELDS = [stat.value for stat in Stats]
+FIELDS = STAT_FIELDS + ["price", "sell_price"]
+_COLUMNS = {field: column for column, field in enumerate(FIELDS)}
+
+_OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+              "=": operator.eq, "==": operator.eq, "!=": operator.ne}
+_CONDITION = re.compile(r"^(?P<field>[^<>=!]+?)\s*(?P<op><=|>=|==|!=|<|>|=)\s*(?P<value>-?\d+(?:\.\d+)?)$")
+
+Condition = tuple[str, str, float]
+# (fields summed into the numerator, fields summed into the denominator, empty for a plain sum)
+SortKey = tuple[list[str], list[str]]
+
+
+def _field(name: str) -> str:
+    name = name.strip()
+    if name not in _COLUMNS:
+        raise ValueError(f"Unknown field: {name}. Must be one of: {', '.join(FIELDS)}")
+    return name
+
+
+def parse_condition(expression: str) -> Condition:
+    """'Armor>=10', 'price < 3000'... a field of FIELDS, a comparison and a number."""
+    match = _CONDITION.match(expression.strip())
+    if match is None:
+        raise ValueError(f"Invalid condition: {expression}. Expected <field><op><number>, e.g. price<3000")
+    return _field(match["field"]), match["op"], float(match["value"])
+
+
+def parse_sort_key(expression: str) -> SortKey:
+    """'Armor', 'Armor/price' or 'Armor+Magic Resist/price': a sum of fields, optionally divided by another sum."""
+    parts = expression.split("/")
+    if len(parts) > 2:
+        raise ValueError(f"Invalid sort: {expression}. At most one '/' is allowed")
+    sums = [[_field(name) for name in part.split("+")] for part in parts]
+    return sums[0], sums[1] if len(sums) == 2 else []
+
+
+class StatIndex:
+    """
+    The items and stats tables held in memory as NumPy columns, one row per item:
+    a float column per Stats member plus price and sell_price, and a mask of the stats each item has.
+    Filters, sorting and top-k by stat/price ratios are evaluated vectorized over the whole catalog.
+    It is loaded once and then kept current from item_changes, so it never re-reads the database.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._lock = threading.Lock()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        self._names: list[Optional[str]] = [None] * capacity
+        self._rows: dict[str, int] = {}
+        self._free: list[int] = []
+        self._size = 0
+        self._values = np.zeros((capacity, len(FIELDS)))
+        self._has_stat = np.zeros((capacity, len(STAT_FIELDS)), dtype=bool)
+        self._alive = np.zeros(capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def load(self, session: Session):
+        """Replaces the content with the current tables, two plain SELECTs run under the index lock."""
+        with self._lock:
+            items = session.execute(select(BDItem.name, BDItem.price, BDItem.sell_price)).all()
+            stats = session.execute(select(BDStat.item_name, BDStat.name, BDStat.value)).all()
+            self._allocate(max(1024, len(items) * 2))
+            for row, (name, price, sell_price) in enumerate(items):
+                self._names[row] = name
+                self._rows[name] = row
+                self._values[row, _COLUMNS["price"]] = price
+                self._values[row, _COLUMNS["sell_price"]] = sell_price
+            self._size = len(items)
+            self._alive[:self._size] = True
+            known = [(self._rows[item_name], _COLUMNS[name], value) for item_name, name, value in stats
+                     if item_name in self._rows and name in _COLUMNS]
+            if known:
+                rows, columns, values = (np.array(part) for part in zip(*known))
+                self._values[rows, columns] = values
+                self._has_stat[rows, columns] = True
+
+    def _row_for(self, name: str) -> int:
+        row = self._rows.get(name)
+        if row is not None:
+            return row
+        if self._free:
+            row = self._free.pop()
+        else:
+            if self._size == len(self._names):
+                self._grow()
+            row = self._size
+            self._size += 1
+        self._rows[name] = row
+        self._names[row] = name
+        return row
+
+    def _grow(self):
+        capacity = len(self._names) * 2
+        self._names.extend([None] * (capacity - len(self._names)))
+        self._values = np.concatenate([self._values, np.zeros_like(self._values)])
+        self._has_stat = np.concatenate([self._has_stat, np.zeros_like(self._has_stat)])
+        self._alive = np.concatenate([self._alive, np.zeros_like(self._alive)])
+
+    def _upsert(self, item: Item):
+        row = self._row_for(item.name)
+        self._values[row] = 0
+        self._has_stat[row] = False
+        self._values[row, _COLUMNS["price"]] = item.price
+        self._values[row, _COLUMNS["sell_price"]] = item.sell_price
+        for stat, value in item.stats.items():
+            self._values[row, _COLUMNS[Stats(stat).value]] = value
+            self._has_stat[row, _COLUMNS[Stats(stat).value]] = True
+        self._alive[row] = True
+
+    def _remove(self, name: str):
+        row = self._rows.pop(name, None)
+        if row is None:
+            return
+        self._alive[row] = False
+        self._names[row] = None
+        self._free.append(row)
+
+    def apply(self, changes: list[ItemChange], catalog_version: Optional[ResourceVersion]):
+        """item_changes listener. Upserts are whole rows, so replaying a change is harmless."""
+        with self._lock:
+            for name, item, _ in changes:
+                if item is None:
+                    self._remove(name)
+                else:
+                    self._upsert(item)
+
+    def refresh(self, session: Session, names: Optional[list[str]]):
+        """Re-reads the named items (all of them for None), for writes made by another process."""
+        if names is None:
+            self.load(session)
+            return
+        found = session_operations.get_items(session, names)
+        self.apply([(name, found.get(name), None) for name in names], None)
+
+    def query(self, conditions: Optional[list[Condition]] = None, stats: Optional[set[str]] = None,
+              sort: Optional[SortKey] = None, descending: bool = True,
+              limit: int = 100) -> tuple[int, list[tuple[str, Optional[float]]]]:
+        """
+        Items having every stat in stats and meeting every condition, as (total, [(name, score)]).
+        With sort, the limit best scores come first (ties by name), and items whose score is undefined
+        (a zero denominator) are left out. Without it, names come in alphabetical order with no score.
+        A missing stat counts as 0 in conditions and scores.
+        """
+        with self._lock:
+            values = self._values[:self._size]
+            mask = self._alive[:self._size].copy()
+            for stat in stats or ():
+                mask &= self._has_stat[:self._size, _COLUMNS[Stats(stat).value]]
+            for field, op, value in conditions or ():
+                mask &= _OPERATORS[op](values[:, _COLUMNS[field]], value)
+            rows = np.flatnonzero(mask)
+
+            if sort is None:
+                names = heapq.nsmallest(limit, (self._names[row] for row in rows))
+                return len(rows), [(name, None) for name in names]
+
+            numerator, denominator = sort
+            candidates = values[rows]
+            scores = candidates[:, [_COLUMNS[field] for field in numerator]].sum(axis=1)
+            if denominator:
+                divisor = candidates[:, [_COLUMNS[field] for field in denominator]].sum(axis=1)
+                scores = np.divide(scores, divisor, out=np.full_like(scores, np.nan), where=divisor != 0)
+            defined = np.isfinite(scores)
+            rows, scores = rows[defined], scores[defined]
+            keys = -scores if descending else scores
+            # argpartition finds the top limit in O(n), only those get fully sorted
+            top = np.argpartition(keys, limit - 1)[:limit] if limit < len(rows) else np.arange(len(rows))
+            top = sorted(top, key=lambda i: (keys[i], self._names[rows[i]]))
+            return len(rows), [(self._names[rows[i]], float(scores[i])) for i in top]
+
+
+# [stat_index] enabled = false skips building it, so does a missing numpy
+STAT_INDEX_ENABLED = config.getboolean("stat_index", "enabled", fallback=True) and np is not None
+
+stat_index: Optional[StatIndex] = None
+
+
+def init_stat_index(session_factory: Optional[sessionmaker[Session]] = None) -> Optional[StatIndex]:
+    global stat_index
+    if not STAT_INDEX_ENABLED:
+        return None
+    index = StatIndex()
+    # Listening before loading: a write committed meanwhile waits on the index lock and is applied on top
+    item_changes.add_listener(index.apply)
+    invalidation_bus.subscribe(invalidation_bus.ITEMS, _reload_items)
+    with (session_factory or database_engine.get_session_factory())() as session:
+        index.load(session)
+    stat_index = index
+    return index
+
+
+def _reload_items(names: Optional[list[str]]):
+    index = stat_index
+    if index is not None:
+        with database_engine.get_session_factory()() as session:
+            index.refresh(session, names)
+
+
+def shutdown_stat_index():
+    global stat_index
+    if stat_index is not None:
+        item_changes.remove_listener(stat_index.apply)
+        invalidation_bus.unsubscribe(invalidation_bus.ITEMS, _reload_items)
+        stat_index = None
+
+
+def get_stat_index() -> StatIndex:
+    if stat_index is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="The stat index is disabled (needs numpy and [stat_index] enabled = true)")
+    return stat_index
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ttl_seconds.
+
+    Writers call invalidate(), which bumps a generation counter. A reader that started
+    before the invalidation passes the generation it saw to set(), and its value is dropped,
+    so a slow read can't put a stale entry back after a write.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys: Hashable):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]):
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, (_, value) in self._entries.items() if predicate(key, value)]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
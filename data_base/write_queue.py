@@ -0,0 +1,191 @@
+import asyncio
+import time
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from starlette import status
+
+import metrics
+from app_config import config
+from data_base import database_engine, session_operations
+
+# [write_queue] enabled = true sends the item and user writes of the async SQL service through a single
+# writer task. It takes whatever is queued (up to max_batch operations, waiting at most max_delay_ms for
+# more), runs it in one transaction with a savepoint per operation, and commits the group at once, so a
+# burst of writes costs one SQLite commit instead of one each and never contends for the write lock with
+# itself. A failing operation only rolls back its own savepoint. Callers get their result or exception
+# once the group commit has returned, i.e. once their write is durable.
+WRITE_QUEUE_ENABLED = config.getboolean("write_queue", "enabled", fallback=False)
+MAX_BATCH = config.getint("write_queue", "max_batch", fallback=64)
+MAX_DELAY = config.getfloat("write_queue", "max_delay_ms", fallback=2.0) / 1000
+MAX_QUEUE = config.getint("write_queue", "max_queue", fallback=10000)
+RETRY_AFTER = config.getint("write_queue", "retry_after_seconds", fallback=1)
+
+write_queue_group_size = metrics.registry.register(metrics.Histogram(
+    "write_queue_group_size", "Operations committed together by the write queue.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)))
+write_queue_wait = metrics.registry.register(metrics.Histogram(
+    "write_queue_wait_seconds", "Time from queueing a write to its group being committed."))
+
+Operation = Callable[..., Any]
+
+
+class _Write:
+    __slots__ = ("operation", "args", "future", "queued_at")
+
+    def __init__(self, operation: Operation, args: tuple, future: asyncio.Future):
+        self.operation = operation
+        self.args = args
+        self.future = future
+        self.queued_at = time.perf_counter()
+
+
+class WriteQueue:
+    def __init__(self, session_factory: Optional[async_sessionmaker[AsyncSession]] = None,
+                 max_batch: int = MAX_BATCH, max_delay: float = MAX_DELAY, max_queue: int = MAX_QUEUE):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.commits = 0
+        self.operations = 0
+        self.rejected = 0
+        self._engine: Optional[AsyncEngine] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Starts the writer task on the running event loop, with an engine of its own on the application's database."""
+        if self.session_factory is None:
+            url = database_engine.get_async_engine().url.render_as_string(hide_password=False)
+            if database_engine._is_sqlite_memory(url):
+                # In-memory databases share one cache, whose table locks fail writers at once instead of waiting
+                # on busy_timeout, so the writer stays on the application's engine
+                self.session_factory = database_engine.get_async_session_factory()
+            else:
+                self._engine = database_engine.build_async_engine(url, explicit_begin=True)
+                metrics.instrument_engine(self._engine.sync_engine, "writer")
+                self.session_factory = async_sessionmaker(self._engine, expire_on_commit=False)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="write-queue")
+
+    async def stop(self):
+        """Commits everything already queued, then stops the writer task."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+            self.session_factory = None
+
+    async def submit(self, operation: Operation, *args) -> Any:
+        """Queues operation(session, *args), a session_operations write, and waits for its group to commit."""
+        if self._queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many writes in progress, try again later",
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Write(operation, args, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            group = [first]
+            deadline = loop.time() + self.max_delay
+            while len(group) < self.max_batch:
+                try:
+                    write = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        write = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if write is None:
+                    stopping = True
+                    break
+                group.append(write)
+            await self._commit(group)
+
+    async def _commit(self, group: list[_Write]):
+        done: list[tuple[_Write, Any]] = []
+        try:
+            async with self.session_factory() as session:
+                session.info[session_operations.GROUP_COMMIT] = True
+                for write in group:
+                    # The caller went away before its turn, nobody waits for this write
+                    if write.future.cancelled():
+                        continue
+                    try:
+                        async with session.begin_nested():
+                            result = await session.run_sync(write.operation, *write.args)
+                    except Exception as e:
+                        if not write.future.done():
+                            write.future.set_exception(e)
+                        continue
+                    done.append((write, result))
+                if not done:
+                    return
+                session.info[session_operations.GROUP_COMMIT] = False
+                if session.info.get("item_changes"):
+                    # One catalog version per transaction, as for any single write
+                    await session.run_sync(session_operations.bump_catalog_version, session_operations.utcnow())
+                await session.commit()
+        except Exception as e:
+            for write, _ in done:
+                if not write.future.done():
+                    write.future.set_exception(e)
+            return
+        self.commits += 1
+        self.operations += len(done)
+        write_queue_group_size.observe(len(done))
+        committed = time.perf_counter()
+        for write, result in done:
+            write_queue_wait.observe(committed - write.queued_at)
+            if not write.future.done():
+                write.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "commits": self.commits,
+            "operations": self.operations,
+            "operations_per_commit": self.operations / self.commits if self.commits else 0.0,
+            "rejected": self.rejected,
+        }
+
+
+write_queue = WriteQueue()
+
+
+def get_write_queue() -> Optional[WriteQueue]:
+    """The queue the async SQL service writes through, None when [write_queue] is disabled."""
+    return write_queue if WRITE_QUEUE_ENABLED else None
+
+
+def start_write_queue():
+    if WRITE_QUEUE_ENABLED:
+        write_queue.start()
+
+
+async def stop_write_queue():
+    await write_queue.stop()
@@ -22,6 +22,7 @@ def register_exception_handlers(app: FastAPI):
         return JSONResponse(
             status_code=exc.status_code,
             content={"detail": exc.detail},
+            headers=exc.headers,
         )
     @app.exception_handler(ValidationError)
     async def validation_exception_handler(request: Request, exc: ValidationError):
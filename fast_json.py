@@ -0,0 +1,66 @@
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # optional, pydantic-core's own serializer is used without it
+    orjson = None
+
+from fastapi import Response
+
+from app_config import config
+from data_base.ttl_cache import TTLCache
+from pydantic_classes import Item, ItemPage, ResourceVersion, Stats
+
+# [responses] fast_json = true makes the item endpoints return ready bytes instead of models.
+# FastAPI then skips response_model validation and jsonable_encoder, which would re-check Items
+# the service layer has just validated. Read per request, so it can be flipped at runtime.
+FAST_JSON_ENABLED = config.getboolean("responses", "fast_json", fallback=False)
+
+# Encoded item bodies. The key holds the item version, so a write never has to invalidate anything.
+encoded_items = TTLCache(
+    max_entries=config.getint("responses", "encoded_cache_max_entries", fallback=4096),
+    ttl_seconds=config.getfloat("responses", "encoded_cache_ttl_seconds", fallback=3600.0),
+)
+
+
+class JSONBytesResponse(Response):
+    media_type = "application/json"
+
+
+def item_dict(item: Item) -> dict:
+    """Same fields, order and values as Item's own JSON output."""
+    return {
+        "name": item.name,
+        "stats": {Stats(stat).value: value for stat, value in item.stats.items()},
+        "description": item.description,
+        "price": item.price,
+        "sell_price": item.sell_price,
+    }
+
+
+def encode_item(item: Item) -> bytes:
+    if orjson is None:
+        return item.model_dump_json().encode()
+    return orjson.dumps(item_dict(item))
+
+
+def encode_versioned_item(item: Item, version: ResourceVersion) -> bytes:
+    key = (item.name, version.version, version.updated_at)
+    body = encoded_items.get(key)
+    if body is None:
+        body = encode_item(item)
+        encoded_items.set(key, body)
+    return body
+
+
+def encode(content: Any) -> bytes:
+    """An ItemPage, or plain JSON data such as the {name: name} listing."""
+    if isinstance(content, ItemPage):
+        if orjson is None:
+            return content.model_dump_json().encode()
+        items = [item_dict(item) if isinstance(item, Item) else item for item in content.items]
+        return orjson.dumps({"items": items, "next_cursor": content.next_cursor})
+    if orjson is None:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+    return orjson.dumps(content)
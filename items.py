@@ -1,15 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from typing import Annotated, Optional, Set, List
 
+from pydantic import ValidationError
 from sqlalchemy import exc
 from starlette import status
+from starlette.background import BackgroundTask
 
+import compression
+import fast_json
 import security
-from data_base.database_provider import database_provider
-from data_base.database_service import DatabaseService
+from rate_limiting import RouteLimit
+from catalog_snapshot import snapshot_store
+from change_feed import ChangeEvent, ChangeFeed, Subscription, get_change_feed
+from conditional_requests import is_not_modified, make_etag, not_modified, validator_headers
+from data_base.database_provider import async_database_provider
+from data_base.database_service import AsyncDatabaseService
+from data_base.stat_index import StatIndex, get_stat_index, parse_condition, parse_sort_key
 from pydantic_classes import SellPriceValidationError
 from data_base.sqlalchemy_db_classes import BDItem
-from pydantic_classes import Item, Stats, UserNoPass
+from pydantic_classes import (BatchGetRequest, BatchGetResponse, BulkRowError, BulkUpsertResult, Item, RankedItem,
+                              SearchResults, StatQueryResult, Stats, UserNoPass)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+def _is_catalog_scan(request: Request) -> bool:
+    """Unpaged and unfiltered, so the whole catalog is read (or, for the NDJSON snapshot, sent)."""
+    return not any(key in request.query_params for key in ("limit", "cursor", "stats", "price"))
+
+
+scan_limit = RouteLimit("item_scan", rate=2, burst=20, concurrency=16, applies=_is_catalog_scan)
+bulk_write_limit = RouteLimit("bulk_write", rate=0.5, burst=5, concurrency=2)
 
 router = APIRouter(
     prefix="/items",
@@ -17,10 +44,134 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+@router.get("/search", response_model=SearchResults)
+async def search_items(database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                       q: Annotated[str, Query(min_length=1, max_length=200)],
+                       prefix: bool = True,
+                       limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = 20,
+                       full: bool = False,
+                       stats: Annotated[Optional[List[str]], Query()] = None,
+                       price: Optional[int] = None,
+                       price_greater_than: Optional[bool] = None):
+    """
+    Ranked full-text search over item names and descriptions. Every word of q must match,
+    with prefix=true the last one may be incomplete (autocompletion). stats/price filter like GET /items/.
+    Declared before /{item_name}, so an item literally named "search" is only reachable through the other endpoints.
+    """
+    if price and not price_greater_than:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Upon providing price, you need to also provide price_greater_than")
+    found = await database_service.search(q, prefix, limit, _validate_stats(stats), (price, price_greater_than), full)
+    return SearchResults(query=q, items=found)
+
+@router.get("/query", response_model=StatQueryResult, response_model_exclude_none=True)
+async def query_items(database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                      stat_index: Annotated[StatIndex, Depends(get_stat_index)],
+                      where: Annotated[Optional[List[str]], Query()] = None,
+                      stats: Annotated[Optional[List[str]], Query()] = None,
+                      sort: Optional[str] = None,
+                      order: Annotated[str, Query(pattern="^(asc|desc)$")] = "desc",
+                      limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+                      full: bool = False):
+    """
+    Answered from the in-memory stat index, without a database query unless full=true.
+    where: conditions on a stat, price or sell_price, e.g. where=Armor>=20&where=price<3000.
+    stats: stats the items must have. sort: a field, a sum of fields or a ratio, e.g. sort=Armor+Health/price.
+    """
+    try:
+        conditions = [parse_condition(expression) for expression in where or []]
+        sort_key = parse_sort_key(sort) if sort else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+    total, ranked = stat_index.query(conditions, _validate_stats(stats), sort_key, order == "desc", limit)
+    if not full:
+        return StatQueryResult(total=total, items=[RankedItem(name=name, score=score) for name, score in ranked])
+    found = await database_service.get_many([name for name, _ in ranked])
+    # An item deleted since the index answered is just left out
+    return StatQueryResult(total=total, items=[RankedItem(name=name, score=score, item=found[name])
+                                               for name, score in ranked if name in found])
+
+def _sse(event: Optional[ChangeEvent]) -> bytes:
+    if event is None:
+        return b": keep-alive\n\n"
+    # dropped keeps no id, so the client's Last-Event-ID stays on the last event it really got
+    event_id = f"id: {event.seq}\n" if event.type != "dropped" else ""
+    return f"{event_id}event: {event.type}\ndata: {event.data}\n\n".encode()
+
+async def _sse_stream(feed: ChangeFeed, subscription: Subscription):
+    async for event in feed.events(subscription):
+        yield _sse(event)
+
+@router.get("/changes")
+async def item_changes_stream(request: Request, feed: Annotated[ChangeFeed, Depends(get_change_feed)],
+                              after: Annotated[Optional[int], Query(ge=0)] = None):
+    """
+    Server-Sent Events, one per committed item write: event created/updated/deleted, id the sequence number,
+    data {seq, type, name, version, changes} where changes holds [old, new] for price, sell_price and each changed stat.
+    Resumes after the Last-Event-ID header (browsers send it when reconnecting) or ?after=.
+    A reset event means the missed events are gone: reload GET /items/ and follow on from its id.
+    A dropped event means this client fell too far behind: reconnect.
+    """
+    if after is None and request.headers.get("last-event-id"):
+        try:
+            after = int(request.headers["last-event-id"])
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Last-Event-ID must be a sequence number")
+    # Subscribed before the headers go out, so the client gets every write committed once it sees them.
+    # The background task unsubscribes a stream that ended before it was ever read.
+    subscription = feed.subscribe(after)
+    return StreamingResponse(_sse_stream(feed, subscription), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(feed.unsubscribe, subscription))
+
+async def _wait_until_closed(websocket: WebSocket):
+    # Nothing is expected from the client, reading is how a disconnect is noticed
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+@router.websocket("/changes/ws")
+async def item_changes_socket(websocket: WebSocket, after: Optional[int] = None):
+    """The same events as GET /items/changes, one JSON text message each. Resumes after ?after=."""
+    try:
+        feed = get_change_feed()
+        subscription = feed.subscribe(after)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason=e.detail)
+        return
+    events = feed.events(subscription)
+    closed = None
+    try:
+        await websocket.accept()
+        closed = asyncio.ensure_future(_wait_until_closed(websocket))
+        async for event in events:
+            # Heartbeats only wake the loop up to notice a client that went away
+            if closed.done():
+                return
+            if event is not None:
+                await websocket.send_text(event.data)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if closed is not None:
+            closed.cancel()
+        await events.aclose()
+        # events only unsubscribes once it has started
+        feed.unsubscribe(subscription)
+
 @router.get("/{item_name}", response_model=Item)
-async def read_item(item_name: str, database_service: Annotated[DatabaseService, Depends(database_provider)]):
+async def read_item(item_name: str, request: Request, response: Response,
+                    database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)]):
     try:
-        return database_service.get(item_name)
+        item, version = await database_service.get_versioned(item_name)
+        etag = make_etag("item", item_name, version.version, version.updated_at.isoformat())
+        if is_not_modified(request, etag, version):
+            return not_modified(etag, version)
+        if fast_json.FAST_JSON_ENABLED:
+            return fast_json.JSONBytesResponse(fast_json.encode_versioned_item(item, version),
+                                               headers=validator_headers(etag, version))
+        response.headers.update(validator_headers(etag, version))
+        return item
     except exc.SQLAlchemyError as e:
         print(f"Database error: {e}")
         raise HTTPException(
@@ -30,15 +181,15 @@ async def read_item(item_name: str, database_service: Annotated[DatabaseService,
     except HTTPException:
         raise
 
-async def _process_item(cur_item: Item, database_service: DatabaseService, item_name: str = None):
+async def _process_item(cur_item: Item, database_service: AsyncDatabaseService, item_name: str = None):
     """
     Helper function to create or update an item.
     """
     try:
         if item_name:
-            return database_service.update(item_name, cur_item)
+            return await database_service.update(item_name, cur_item)
         else:
-            return database_service.create(cur_item)
+            return await database_service.create(cur_item)
     except exc.SQLAlchemyError as e:
         print(f"Database error: {e}")
         raise HTTPException(
@@ -51,26 +202,82 @@ async def _process_item(cur_item: Item, database_service: DatabaseService, item_
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_item(cur_item: Item,
-                      database_service: Annotated[DatabaseService, Depends(database_provider)],
+                      database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
                       current_user: Annotated[UserNoPass, Depends(security.get_user_and_check_active)]):
     if current_user:
-        return _process_item(cur_item, database_service, cur_item.name)
+        return await _process_item(cur_item, database_service)
 
 @router.put("/{item_name}", status_code=status.HTTP_200_OK)
 async def update_item(item_name: str, cur_item: Item,
-                      database_service: Annotated[DatabaseService, Depends(database_provider)],
+                      database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
                       current_user: Annotated[UserNoPass, Depends(security.get_user_and_check_active)]):
     if current_user:
-        return _process_item(cur_item, database_service, item_name)
-@router.get("/")
-async def read_all_items(database_service: Annotated[DatabaseService, Depends(database_provider)],
-                         stats: Annotated[Optional[List[str]], Query()] = None,
-                         price: Optional[int] = None,
-                         price_greater_than: Optional[bool] = None):
-    if price and not price_greater_than:
+        return await _process_item(cur_item, database_service, item_name)
+def _validation_detail(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" if error['loc'] else error['msg']
+                     for error in e.errors())
+
+async def _read_bulk_rows(request: Request) -> list:
+    """
+    NDJSON bodies are split line by line while they stream in and come back as raw bytes per line,
+    anything else must be a JSON array and comes back already decoded.
+    """
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        lines, buffer = [], b""
+        async for chunk in request.stream():
+            *complete, buffer = (buffer + chunk).split(b"\n")
+            lines.extend(line for line in complete if line.strip())
+        if buffer.strip():
+            lines.append(buffer)
+        return lines
+    try:
+        rows = json.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Body is not valid JSON: {e}")
+    if not isinstance(rows, list):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="Upon providing price, you need to also provide price_greater_than")
+                            detail="Body must be a JSON array of items or an application/x-ndjson stream")
+    return rows
+
+@router.post("/batch-get", response_model=BatchGetResponse)
+async def read_many_items(request: BatchGetRequest,
+                          database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)]):
+    """Fetches up to 1000 items and their stats with one query. Repeated names are returned once."""
+    names = list(dict.fromkeys(request.names))
+    found = await database_service.get_many(names)
+    return BatchGetResponse(items=[found[name] for name in names if name in found],
+                            missing=[name for name in names if name not in found])
+
+@router.post("/bulk", response_model=BulkUpsertResult,
+             dependencies=[Depends(bulk_write_limit.per_user(security.get_user))])
+async def bulk_upsert_items(request: Request,
+                            database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                            current_user: Annotated[UserNoPass, Depends(security.get_user_and_check_active)]):
+    """
+    Creates or replaces many items at once. Each row is validated on its own, invalid rows are
+    reported in errors (row = 0-based position of the record) and the valid ones are written in one transaction.
+    """
+    if not current_user:
+        return
+    valid_items: list[Item] = []
+    errors: list[BulkRowError] = []
+    for row, raw_item in enumerate(await _read_bulk_rows(request)):
+        try:
+            if isinstance(raw_item, bytes):
+                valid_items.append(Item.model_validate_json(raw_item))
+            else:
+                valid_items.append(Item.model_validate(raw_item))
+        except ValidationError as e:
+            name = raw_item.get("name") if isinstance(raw_item, dict) else None
+            errors.append(BulkRowError(row=row, name=name if isinstance(name, str) else None,
+                                       detail=_validation_detail(e)))
+    upserted = 0
+    if valid_items:
+        # A database error goes to the app's SQLAlchemyError handler, which logs it and answers a generic 500
+        upserted = await database_service.bulk_upsert(valid_items)
+    return BulkUpsertResult(upserted=upserted, errors=errors)
 
+def _validate_stats(stats: Optional[List[str]]) -> Optional[Set[Stats]]:
     validated_stats: Optional[Set[Stats]] = None
 
     if stats:
@@ -85,19 +292,80 @@ async def read_all_items(database_service: Annotated[DatabaseService, Depends(da
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Invalid stat: {stat_str}. Must be one of: {', '.join([s for s in Stats])}"
                 )
-    items = database_service.get_all(validated_stats,(price, price_greater_than))
+    return validated_stats
+
+async def _stream_ndjson(database_service: AsyncDatabaseService, batch_size: int,
+                         stats: Optional[Set[Stats]], price: tuple[Optional[int], Optional[bool]]):
+    async for cur_item in database_service.iter_items(batch_size, stats, price):
+        yield fast_json.encode_item(cur_item) + b"\n"
+
+@router.get("/", dependencies=[Depends(scan_limit.per_client)])
+async def read_all_items(request: Request, response: Response,
+                         database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                         stats: Annotated[Optional[List[str]], Query()] = None,
+                         price: Optional[int] = None,
+                         price_greater_than: Optional[bool] = None,
+                         limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+                         cursor: Optional[str] = None,
+                         full: bool = False,
+                         format: Annotated[Optional[str], Query(pattern="^(json|ndjson)$")] = None):
+    """
+    Without limit/cursor this keeps the original {name: name} answer.
+    With limit or cursor it returns one keyset page (full=true adds item bodies with their stats),
+    and format=ndjson streams every matching item as one JSON object per line.
+    Every answer is tagged with the catalog version, so a matching If-None-Match/If-Modified-Since
+    gets 304 after a single-row read, without touching the items or stats tables.
+    """
+    if price and not price_greater_than:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Upon providing price, you need to also provide price_greater_than")
+
+    validated_stats = _validate_stats(stats)
+    # The unfiltered NDJSON dump goes to clients taking gzip or br as precompressed bytes, built once per
+    # catalog version. Other clients get it streamed, like a filtered dump.
+    encoding = None
+    if format == "ndjson" and not validated_stats and price is None and compression.COMPRESSION_ENABLED:
+        encoding = compression.negotiate(request.headers.get("accept-encoding", ""))
+    serve_snapshot = encoding is not None
+
+    catalog_version = await database_service.get_catalog_version()
+    etag = make_etag("items", catalog_version.version, catalog_version.updated_at.isoformat(), request.url.query,
+                     *([encoding] if encoding else []))
+    if is_not_modified(request, etag, catalog_version):
+        return not_modified(etag, catalog_version)
+    response.headers.update(validator_headers(etag, catalog_version))
+
+    if serve_snapshot:
+        snapshot = await snapshot_store.get(database_service, catalog_version.version)
+        headers = {**validator_headers(etag, catalog_version), "Vary": "Accept-Encoding", "Content-Encoding": encoding}
+        return Response(snapshot.body(encoding), media_type="application/x-ndjson", headers=headers)
+    if format == "ndjson":
+        return StreamingResponse(_stream_ndjson(database_service, limit or STREAM_BATCH_SIZE,
+                                                validated_stats, (price, price_greater_than)),
+                                 media_type="application/x-ndjson",
+                                 headers=validator_headers(etag, catalog_version))
+    if limit is not None or cursor is not None:
+        page = await database_service.get_page(cursor, limit or DEFAULT_PAGE_SIZE, validated_stats,
+                                               (price, price_greater_than), full)
+        if fast_json.FAST_JSON_ENABLED:
+            return fast_json.JSONBytesResponse(fast_json.encode(page), headers=validator_headers(etag, catalog_version))
+        return page
+
+    items = await database_service.get_all(validated_stats,(price, price_greater_than))
     json = {}
     for cur_item in items:
         json[cur_item] = cur_item
+    if fast_json.FAST_JSON_ENABLED:
+        return fast_json.JSONBytesResponse(fast_json.encode(json), headers=validator_headers(etag, catalog_version))
     return json
 
 @router.delete("/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_item(item_id: str,
-                      database_service: Annotated[DatabaseService, Depends(database_provider)],
+                      database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
                       current_user: Annotated[UserNoPass, Depends(security.get_user_and_check_active)]):
     try:
         if current_user:
-            return database_service.delete(item_id,BDItem)
+            return await database_service.delete(item_id,BDItem)
     except exc.SQLAlchemyError as e:
         print(f"Database error: {e}")
         raise HTTPException(
@@ -1,23 +1,77 @@
-import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
+import app_logging
+import build_optimizer
+import change_feed
+import compression
 import exception_handlers
+import fast_json
+import metrics
+import profiling
+import password_hashing
+from data_base import (database_engine, database_provider, database_service_impl_as_dict, invalidation_bus, stat_index,
+                       write_queue)
+from catalog_snapshot import snapshot_store
+from data_base.cached_database_service import item_cache
 # from JustForLearning import response_model_examples, learning
 import security
 import items
+import builds
 import users
+import admin
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app_logging.configure_logging()
+    # One engine and session factory for the whole process, shared by all routers
+    database_engine.init_database()
+    database_engine.init_async_database()
+    # Listening to the other workers before the in-memory copies load, so no write falls in between
+    invalidation_bus.start_invalidation_bus()
+    stat_index.init_stat_index()
+    change_feed.init_change_feed()
+    if database_provider.MEMORY_BACKEND:
+        database_service_impl_as_dict.init_memory_catalog()
+    metrics.watch_cache("builds", build_optimizer.get_build_optimizer().cache)
+    write_queue.start_write_queue()
+    yield
+    # Commits whatever writes are still queued while the engines are up
+    await write_queue.stop_write_queue()
+    invalidation_bus.stop_invalidation_bus()
+    change_feed.shutdown_change_feed()
+    stat_index.shutdown_stat_index()
+    database_service_impl_as_dict.shutdown_memory_catalog()
+    build_optimizer.shutdown_build_optimizer()
+    password_hashing.shutdown_password_hasher()
+    await database_engine.dispose_async_database()
+    database_engine.dispose_database()
+    app_logging.shutdown_logging()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+if compression.COMPRESSION_ENABLED:
+    app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
+# Added last so it is the outermost layer and its timings include the other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.watch_cache("items", item_cache)
+metrics.watch_cache("auth", security.user_cache)
+metrics.watch_cache("encoded_items", fast_json.encoded_items)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, filename="app.log", format="%(asctime)s - %(levelname)s - %(message)s")
 # Register exception handlers (Call the registration function)
 exception_handlers.register_exception_handlers(app)
 
 app.include_router(items.router)
+app.include_router(builds.router)
 # app.include_router(response_model_examples.router)
 app.include_router(security.router)
 app.include_router(users.router)
+app.include_router(admin.router)
 # app.include_router(learning.router)
 
 
@@ -28,3 +82,14 @@ async def root():
 @app.get("/hello/{name}")
 async def say_hello(name: str):
     return {"message": f"Hello {name}"}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"items": item_cache.stats(), "auth": security.user_cache.stats(),
+            "builds": build_optimizer.get_build_optimizer().cache.stats(), "catalog_snapshot": snapshot_store.stats(),
+            "invalidation_bus": invalidation_bus.invalidation_bus.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """Prometheus text exposition format."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,229 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import Engine, event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# A small Prometheus-style registry, rendered in the text exposition format by GET /metrics.
+# Recording is a lock and a few additions, so the middleware and engine hooks stay cheap.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def set(self, *labels: str, value: float):
+        """For a counter kept elsewhere and copied in at scrape time."""
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: a count per bucket (not cumulative, the last one is +Inf), the sum and the count
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            entry[0][index] += 1
+            entry[1][0] += value
+            entry[1][1] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts), list(totals)) for key, (counts, totals) in self._values.items()]
+        lines = self.header()
+        for key, counts, (total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {int(count)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        # Called at scrape time, for values that live elsewhere (cache counters...). Keyed by name,
+        # so registering again (a recreated cache) replaces the old one.
+        self._collectors: dict[str, Callable[[], None]] = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, collector: Callable[[], None]):
+        self._collectors[name] = collector
+
+    def render(self) -> str:
+        for collector in list(self._collectors.values()):
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template, method and status.", ("method", "route", "status")))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time from receiving a request to the end of its response body.",
+    ("method", "route")))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Requests currently being served."))
+db_queries = registry.register(Counter(
+    "db_queries_total", "SQL statements executed, by engine and statement type.", ("engine", "statement")))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement execution time, by engine and statement type.",
+    ("engine", "statement"), DB_BUCKETS))
+password_hash_duration = registry.register(Histogram(
+    "password_hash_duration_seconds", "bcrypt time inside the worker pool.", ("operation",), DEFAULT_BUCKETS))
+password_hash_wait = registry.register(Histogram(
+    "password_hash_wait_seconds", "Time password operations spent queued for a worker.", ("operation",)))
+cache_hit_ratio = registry.register(Gauge(
+    "cache_hit_ratio", "Hits over lookups since startup.", ("cache",)))
+cache_entries = registry.register(Gauge(
+    "cache_entries", "Entries currently held.", ("cache",)))
+cache_events = registry.register(Counter(
+    "cache_events_total", "Cache hits, misses, evictions and expirations since startup.", ("cache", "event")))
+
+
+def watch_cache(name: str, cache):
+    """Exports the hit ratio and counters of a TTLCache, read at scrape time."""
+    def collect():
+        stats = cache.stats()
+        cache_hit_ratio.set(name, value=stats["hit_ratio"])
+        cache_entries.set(name, value=stats["entries"])
+        for cache_event in ("hits", "misses", "evictions", "expirations"):
+            cache_events.set(name, cache_event, value=stats[cache_event])
+    registry.add_collector(f"cache:{name}", collect)
+
+
+def _statement_type(statement: str) -> str:
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return keyword if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+
+def instrument_engine(engine: Engine, name: str):
+    """Times every statement through the engine's cursor events. For an AsyncEngine pass its sync_engine."""
+    if getattr(engine, "_metrics_instrumented", False):
+        return
+    engine._metrics_instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        statement_type = _statement_type(statement)
+        db_queries.inc(name, statement_type)
+        db_query_duration.observe(time.perf_counter() - started, name, statement_type)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+
+class MetricsMiddleware:
+    """
+    Request counts, latency and in-flight requests. Requests are labelled by route template
+    (/items/{item_name}), never by raw path, so the number of series stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code: Optional[int] = None
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "<unmatched>"
+            http_requests.inc(scope["method"], template, str(status_code or 500))
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], template)
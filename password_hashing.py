@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from starlette import status
+
+import metrics
+from app_config import config
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# Jobs run inside the pool. They time themselves so the caller can split wait time from hash time,
+# which also works for a process pool where the caller's clock can't see into the worker.
+def _hash_job(password: str) -> tuple[str, float]:
+    started = time.perf_counter()
+    hashed = pwd_context.hash(password)
+    return hashed, time.perf_counter() - started
+
+
+def _verify_job(password: str, hashed_password: str) -> tuple[bool, float]:
+    started = time.perf_counter()
+    verified = pwd_context.verify(password, hashed_password)
+    return verified, time.perf_counter() - started
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated pool so hashing never holds the event loop.
+    At most workers + max_queue jobs are accepted at once, anything beyond that is rejected with 503.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 32, use_processes: bool = False, retry_after: int = 1):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        if use_processes:
+            self.executor: Executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hashing")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many password operations in progress, try again later",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            self.in_flight += 1
+
+    def _record(self, operation: str, wait_seconds: float, hash_seconds: float):
+        metrics.password_hash_duration.observe(hash_seconds, operation)
+        metrics.password_hash_wait.observe(wait_seconds, operation)
+        with self._lock:
+            self.completed += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+            self.hash_seconds_total += hash_seconds
+            self.hash_seconds_max = max(self.hash_seconds_max, hash_seconds)
+
+    async def _run(self, operation: str, job, *args):
+        self._admit()
+        submitted = time.perf_counter()
+        try:
+            result, hash_seconds = await asyncio.get_running_loop().run_in_executor(self.executor, job, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        self._record(operation, max(0.0, time.perf_counter() - submitted - hash_seconds), hash_seconds)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash_job, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _verify_job, password, hashed_password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self.completed or 1
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_seconds_avg": self.wait_seconds_total / completed,
+                "wait_seconds_max": self.wait_seconds_max,
+                "hash_seconds_avg": self.hash_seconds_total / completed,
+                "hash_seconds_max": self.hash_seconds_max,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_hasher: Optional[PasswordHasher] = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Process-wide hasher sized by the [password_hashing] section of config.ini."""
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None:
+            _hasher = PasswordHasher(
+                workers=config.getint("password_hashing", "workers", fallback=2),
+                max_queue=config.getint("password_hashing", "max_queue", fallback=32),
+                use_processes=config.get("password_hashing", "executor", fallback="thread") == "process",
+                retry_after=config.getint("password_hashing", "retry_after_seconds", fallback=1),
+            )
+        return _hasher
+
+
+def shutdown_password_hasher():
+    global _hasher
+    with _hasher_lock:
+        if _hasher is not None:
+            _hasher.shutdown()
+        _hasher = None
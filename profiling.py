@@ -0,0 +1,290 @@
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import heapq
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import Engine, event
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app_config import config
+
+# [profiling] enabled = true records a timing breakdown (total, SQL statements) for every request and
+# captures a sampled stack profile for sample_rate of them. A request carrying a valid X-Profile-Token
+# header is profiled even when profiling is disabled. Profiles are written as speedscope files
+# (https://www.speedscope.app), at most one per min_interval_seconds, and old ones are deleted once
+# the directory holds more than max_files files or max_megabytes.
+PROFILING_ENABLED = config.getboolean("profiling", "enabled", fallback=False)
+SAMPLE_RATE = config.getfloat("profiling", "sample_rate", fallback=0.01)
+SAMPLE_INTERVAL = config.getfloat("profiling", "sample_interval_ms", fallback=5.0) / 1000
+OUTPUT_DIR = Path(config.get("profiling", "output_dir", fallback="profiles"))
+MIN_INTERVAL = config.getfloat("profiling", "min_interval_seconds", fallback=1.0)
+MAX_FILES = config.getint("profiling", "max_files", fallback=50)
+MAX_BYTES = config.getint("profiling", "max_megabytes", fallback=50) * 1024 * 1024
+RECENT_REQUESTS = config.getint("profiling", "recent_requests", fallback=1000)
+MAX_STATEMENTS = 100
+
+PROFILE_HEADER = "x-profile-token"
+_IDLE_MODULES = ("threading.py", "queue.py", "futures/thread.py")
+_SECRET = config.get("security", "secret_key", fallback="").encode()
+
+
+def sign_profile_token(ttl_seconds: int = 300) -> str:
+    """Value for the X-Profile-Token header: an expiry and its HMAC under the [security] secret_key."""
+    expires = str(int(time.time()) + ttl_seconds)
+    return f"{expires}.{hmac.new(_SECRET, b'profile:' + expires.encode(), hashlib.sha256).hexdigest()}"
+
+
+def verify_profile_token(token: str) -> bool:
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(_SECRET, b"profile:" + expires.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, expected)
+
+
+class RequestRecord:
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status: Optional[int] = None
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.sql: list[tuple[str, float]] = []
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.profile_file: Optional[str] = None
+
+    def add_statement(self, statement: str, seconds: float):
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        if len(self.sql) < MAX_STATEMENTS:
+            self.sql.append((statement, seconds))
+
+    def breakdown(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": self.duration * 1000,
+            "sql_ms": self.sql_seconds * 1000,
+            "other_ms": max(0.0, self.duration - self.sql_seconds) * 1000,
+            "sql_count": self.sql_count,
+            "sql": [{"statement": statement, "ms": seconds * 1000} for statement, seconds in self.sql],
+            "profile_file": self.profile_file,
+        }
+
+
+_current: contextvars.ContextVar[Optional[RequestRecord]] = contextvars.ContextVar("profiled_request", default=None)
+
+
+def instrument_engine(engine: Engine):
+    """Adds every statement executed for a recorded request to its breakdown. For an AsyncEngine pass its sync_engine."""
+    if getattr(engine, "_profiling_instrumented", False):
+        return
+    engine._profiling_instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("profiling_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        record = _current.get()
+        if record is not None and conn.info.get("profiling_started"):
+            record.add_statement(statement, time.perf_counter() - conn.info["profiling_started"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        if context.connection is not None and context.connection.info.get("profiling_started"):
+            context.connection.info["profiling_started"].pop()
+
+
+class StackSampler:
+    """
+    Samples the stacks of every thread every interval seconds while a request runs, on a thread of its own.
+    Requests share the event loop, so whatever else runs at the same time shows up in the samples too.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: dict[int, list[tuple[float, tuple]]] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                # Pool threads parked on their queue add nothing but noise
+                if stack and stack[0][1].endswith(_IDLE_MODULES):
+                    continue
+                stack.reverse()
+                self.samples.setdefault(thread_id, []).append((now, tuple(stack)))
+
+    def speedscope(self, name: str) -> dict:
+        frames: list[dict] = []
+        frame_index: dict[tuple, int] = {}
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        profiles = []
+        for thread_id, samples in self.samples.items():
+            stacks, weights = [], []
+            previous = self.started
+            for at, stack in samples:
+                indices = []
+                for frame in stack:
+                    if frame not in frame_index:
+                        frame_index[frame] = len(frames)
+                        frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                    indices.append(frame_index[frame])
+                stacks.append(indices)
+                weights.append(at - previous)
+                previous = at
+            profiles.append({
+                "type": "sampled",
+                "name": thread_names.get(thread_id, str(thread_id)),
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.stopped - self.started,
+                "samples": stacks,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "LOLItemsApi profiling",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+class Profiler:
+    def __init__(self, output_dir: Path = OUTPUT_DIR, min_interval: float = MIN_INTERVAL,
+                 max_files: int = MAX_FILES, max_bytes: int = MAX_BYTES, recent: int = RECENT_REQUESTS):
+        self.output_dir = output_dir
+        self.min_interval = min_interval
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.recent: deque[RequestRecord] = deque(maxlen=recent)
+        self.profiles_written = 0
+        self.profiles_skipped = 0
+        self._last_profile = float("-inf")
+        self._lock = threading.Lock()
+
+    def allow_profile(self) -> bool:
+        """Rate limit for stack profiles, at most one started per min_interval."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_profile < self.min_interval:
+                self.profiles_skipped += 1
+                return False
+            self._last_profile = now
+            return True
+
+    def finish(self, record: RequestRecord):
+        with self._lock:
+            self.recent.append(record)
+
+    def stop_and_write(self, record: RequestRecord, sampler: StackSampler):
+        sampler.stop()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{record.id}.speedscope.json"
+        profile = sampler.speedscope(f"{record.method} {record.path} ({record.duration * 1000:.1f} ms)")
+        (self.output_dir / name).write_text(json.dumps(profile))
+        record.profile_file = name
+        with self._lock:
+            self.profiles_written += 1
+        self._enforce_limits()
+
+    def _enforce_limits(self):
+        files = sorted(self.output_dir.glob("*.speedscope.json"), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in files)
+        while files and (len(files) > self.max_files or total > self.max_bytes):
+            oldest = files.pop(0)
+            total -= oldest.stat().st_size
+            oldest.unlink(missing_ok=True)
+
+    def slowest(self, limit: int = 20) -> list[dict]:
+        with self._lock:
+            records = list(self.recent)
+        return [record.breakdown() for record in heapq.nlargest(limit, records, key=lambda record: record.duration)]
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """Installed always: without [profiling] enabled it only looks for the X-Profile-Token header."""
+
+    def __init__(self, app: ASGIApp, enabled: bool = PROFILING_ENABLED, sample_rate: float = SAMPLE_RATE):
+        self.app = app
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = Headers(scope=scope).get(PROFILE_HEADER)
+        requested = token is not None and verify_profile_token(token)
+        if not self.enabled and not requested:
+            await self.app(scope, receive, send)
+            return
+
+        record = RequestRecord(scope["method"], scope["path"])
+        sampler = None
+        if (requested or random.random() < self.sample_rate) and profiler.allow_profile():
+            sampler = StackSampler()
+            sampler.start()
+
+        async def send_with_status(message: Message):
+            if message["type"] == "http.response.start":
+                record.status = message["status"]
+                if sampler is not None:
+                    MutableHeaders(scope=message).append("X-Profile-Id", record.id)
+            await send(message)
+
+        reset = _current.set(record)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            record.duration = time.perf_counter() - started
+            _current.reset(reset)
+            record.route = getattr(scope.get("route"), "path", None)
+            if sampler is not None:
+                await asyncio.to_thread(profiler.stop_and_write, record, sampler)
+            profiler.finish(record)
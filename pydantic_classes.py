@@ -1,3 +1,4 @@
+from datetime import datetime
 from enum import Enum
 from typing import Annotated
 
@@ -24,11 +25,69 @@ class Item(BaseModel):
     @field_validator('sell_price')
     def validate_sell_price(cls, value, values):
         """Validates that the sell_price is less than the price."""
-        price = values.get('price')
+        price = values.data.get('price')
         if price is not None and value >= price:
             raise SellPriceValidationError("sell_price must be less than price") # New exception
         return value
 
+class SearchResults(BaseModel):
+    """Best match first. items holds full Item bodies or only names."""
+    query: str
+    items: list[Item] | list[str]
+
+class RankedItem(BaseModel):
+    name: str
+    score: float | None = None
+    item: Item | None = None
+
+class StatQueryResult(BaseModel):
+    """total counts every match, items holds the first limit of them."""
+    total: int
+    items: list[RankedItem]
+
+class BuildRequest(BaseModel):
+    """Maximize the sum of weight * stat over at most slots distinct items costing at most budget."""
+    weights: dict[Stats, float] = Field(..., min_length=1)
+    budget: float = Field(..., gt=0)
+    slots: int = Field(6, ge=1, le=6)
+    time_limit_ms: int | None = Field(None, ge=1)
+
+class Build(BaseModel):
+    """optimal is false when the time limit cut the search short, items is then the best build found."""
+    items: list[Item]
+    cost: float
+    score: float
+    stats: dict[Stats, int]
+    optimal: bool
+    catalog_version: int
+
+class ResourceVersion(BaseModel):
+    """Version counter and last change time of an item or of the whole catalog, used for ETag/Last-Modified."""
+    version: int
+    updated_at: datetime
+
+class ItemPage(BaseModel):
+    """One page of GET /items/. items holds full Item bodies or only names, next_cursor is None on the last page."""
+    items: list[Item] | list[str]
+    next_cursor: str | None = None
+
+class BatchGetRequest(BaseModel):
+    names: list[str] = Field(..., min_length=1, max_length=1000)
+
+class BatchGetResponse(BaseModel):
+    """Found items in request order, plus the requested names that don't exist."""
+    items: list[Item]
+    missing: list[str]
+
+class BulkRowError(BaseModel):
+    row: int
+    name: str | None = None
+    detail: str
+
+class BulkUpsertResult(BaseModel):
+    upserted: int
+    errors: list[BulkRowError]
+
 class UserNoPass(BaseModel):
     user_name: str = Field(..., max_length=30)
     active: bool = Field(default=True)
@@ -0,0 +1,196 @@
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Annotated, Callable, Optional
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # redis is optional, only [rate_limits] store = redis needs it
+    redis_asyncio = None
+
+from fastapi import Depends, HTTPException, Request
+from starlette import status
+
+import metrics
+from app_config import config
+from pydantic_classes import UserNoPass
+
+# Expensive routes declare a RouteLimit as a router dependency. Each request first takes a token from
+# the bucket of its caller (the authenticated user, or the client IP for routes anyone can call) and
+# is answered 429 with Retry-After when the bucket is empty. The route's requests in flight in this
+# process are capped too, anything beyond that is shed with 503 before it costs anything.
+RATE_LIMITS_ENABLED = config.getboolean("rate_limits", "enabled", fallback=True)
+STORE = config.get("rate_limits", "store", fallback="memory")
+STORE_URL = config.get("rate_limits", "url", fallback="redis://localhost:6379/0")
+MAX_KEYS = config.getint("rate_limits", "max_keys", fallback=100_000)
+RETRY_AFTER = config.getint("rate_limits", "retry_after_seconds", fallback=1)
+
+rate_limit_rejections = metrics.registry.register(metrics.Counter(
+    "rate_limit_rejected_total", "Requests rejected by a route limit.", ["limit", "reason"]))
+rate_limit_in_flight = metrics.registry.register(metrics.Gauge(
+    "rate_limit_in_flight", "Requests in flight per route limit.", ["limit"]))
+rate_limit_store_errors = metrics.registry.register(metrics.Counter(
+    "rate_limit_store_errors_total", "Rate limit store calls that failed, the request was let through."))
+
+
+class RateLimitStore(ABC):
+    """Token buckets by key, refilled at rate tokens per second up to burst tokens."""
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Takes cost tokens from the bucket of key. Returns 0, or the seconds until there are enough (nothing is taken then)."""
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    store = memory: buckets of this process only, so with N workers a caller gets up to N times the limit.
+    Beyond max_keys the least recently used buckets are forgotten, which only refills them early.
+    """
+
+    def __init__(self, max_keys: int = MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """store = redis: buckets shared by every worker and host, updated atomically by a Lua script."""
+
+    SCRIPT = """
+    local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local wait = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+    else
+        wait = (cost - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str = STORE_URL):
+        if redis_asyncio is None:
+            raise RuntimeError("[rate_limits] store = redis needs the redis package")
+        self.client = redis_asyncio.Redis.from_url(url)
+        self._script = self.client.register_script(self.SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        # The server's clock, so hosts with skewed clocks still agree on the refill
+        seconds, microseconds = await self.client.time()
+        return float(await self._script(keys=[f"rate_limit:{key}"],
+                                        args=[rate, burst, seconds + microseconds / 1e6, cost]))
+
+
+def create_store() -> RateLimitStore:
+    if STORE == "redis":
+        return RedisRateLimitStore()
+    if STORE != "memory":
+        raise ValueError(f"Unknown [rate_limits] store: {STORE}")
+    return MemoryRateLimitStore()
+
+
+rate_limit_store = create_store()
+
+
+def client_ip(request: Request) -> str:
+    # Behind a proxy, run uvicorn with --proxy-headers so this is the forwarded client address
+    return request.client.host if request.client else "unknown"
+
+
+class RouteLimit:
+    """
+    The limits of one route (or group of routes sharing a name). The values given here are defaults,
+    [rate_limits] <name>_rate, <name>_burst and <name>_concurrency override them, 0 turns either part off.
+    applies, when given, picks which requests of the route count at all.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, concurrency: int = 0,
+                 applies: Optional[Callable[[Request], bool]] = None):
+        self.name = name
+        self.rate = config.getfloat("rate_limits", f"{name}_rate", fallback=rate)
+        self.burst = config.getfloat("rate_limits", f"{name}_burst", fallback=burst)
+        self.concurrency = config.getint("rate_limits", f"{name}_concurrency", fallback=concurrency)
+        self.applies = applies
+        self.in_flight = 0
+
+    @asynccontextmanager
+    async def _admitted(self, request: Request, key: str):
+        if not RATE_LIMITS_ENABLED or (self.applies is not None and not self.applies(request)):
+            yield
+            return
+        if self.concurrency and self.in_flight >= self.concurrency:
+            self._reject("concurrency")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many requests in progress, try again later",
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+        # Counted before the store is asked, so requests waiting on a shared store are capped as well
+        self.in_flight += 1
+        rate_limit_in_flight.inc(self.name)
+        try:
+            if self.rate > 0:
+                await self._take(key)
+            yield
+        finally:
+            self.in_flight -= 1
+            rate_limit_in_flight.dec(self.name)
+
+    async def _take(self, key: str):
+        try:
+            wait = await rate_limit_store.take(f"{self.name}:{key}", self.rate, self.burst)
+        except Exception as e:
+            # A limiter that is down should not take the API with it
+            rate_limit_store_errors.inc()
+            logging.getLogger(__name__).warning("Rate limit store error: %s", e)
+            return
+        if wait > 0:
+            self._reject("rate")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded, try again later",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+    def _reject(self, reason: str):
+        rate_limit_rejections.inc(self.name, reason)
+
+    async def per_client(self, request: Request):
+        """Dependency keying the bucket by client IP, for routes callable without a token."""
+        async with self._admitted(request, f"ip:{client_ip(request)}"):
+            yield
+
+    def per_user(self, user_dependency: Callable) -> Callable:
+        """
+        Dependency keying the bucket by the user user_dependency (security.get_user) resolves to.
+        FastAPI resolves that dependency once per request, so the route can still depend on it itself.
+        """
+        async def dependency(request: Request, user: Annotated[UserNoPass, Depends(user_dependency)]):
+            key = f"user:{user.user_name}" if user else f"ip:{client_ip(request)}"
+            async with self._admitted(request, key):
+                yield
+        return dependency
@@ -1,26 +1,25 @@
 from datetime import timedelta, timezone, datetime
-from typing import Annotated
+from typing import Annotated, Optional
 
 import jwt
 from fastapi import Depends, APIRouter, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jwt.exceptions import InvalidTokenError
 from starlette import status
-from passlib.context import CryptContext
 
-from data_base.database_provider import database_provider
-from data_base.database_service import DatabaseService
-from pydantic_classes import User, TokenData, Token
-import configparser
+from data_base import invalidation_bus
+from data_base.database_provider import async_database_provider
+from data_base.database_service import AsyncDatabaseService
+from data_base.ttl_cache import TTLCache
+from pydantic_classes import TokenData, Token, UserNoPass
+from app_config import config
+from password_hashing import get_password_hasher, pwd_context
+from rate_limiting import RouteLimit
 
-config = configparser.ConfigParser()
-config.read("config.ini")
 SECRET_KEY = config["security"]["secret_key"]
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 router = APIRouter(
     prefix="/token",
     tags=["authentication"],
@@ -28,6 +27,15 @@ router = APIRouter(
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Every login runs bcrypt, whose own queue (password_hashing) already sheds excess load with 503
+login_limit = RouteLimit("login", rate=1, burst=10)
+
+# token -> (decoded claims, UserNoPass). Entries never outlive the token's exp and are dropped by invalidate_user
+user_cache = TTLCache(
+    max_entries=config.getint("auth_cache", "max_entries", fallback=1024),
+    ttl_seconds=config.getfloat("auth_cache", "ttl_seconds", fallback=30.0),
+)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -39,7 +47,11 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 async def get_user(token: Annotated[str, Depends(oauth2_scheme)],
-                   database_service: Annotated[DatabaseService, Depends(database_provider)]) -> User:
+                   database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)]) -> UserNoPass:
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached[1]
+    generation = user_cache.generation
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -53,36 +65,54 @@ async def get_user(token: Annotated[str, Depends(oauth2_scheme)],
         token_data = TokenData(username=username)
     except InvalidTokenError:
         raise credentials_exception
-    user = database_service.get_user(username=token_data.username)
+    user = await database_service.get_user(username=token_data.username)
     if user is None:
         raise credentials_exception
+    user = UserNoPass(user_name=user.user_name, active=user.active)
+    expires_in = payload["exp"] - datetime.now(timezone.utc).timestamp() if "exp" in payload else user_cache.ttl_seconds
+    user_cache.set(token, (payload, user), generation, ttl_seconds=min(user_cache.ttl_seconds, expires_in))
     return user
 
-async def get_user_and_check_active(current_user: Annotated[User, Depends(get_user)]) -> User:
+def invalidate_user(username: str):
+    """Drops every cached token of the user, so deactivation and deletion take effect on the next request."""
+    user_cache.invalidate_where(lambda token, entry: entry[1].user_name == username)
+
+def _invalidate_users(usernames: Optional[list[str]]):
+    # Users written by another worker
+    if usernames is None:
+        user_cache.clear()
+    else:
+        for username in usernames:
+            invalidate_user(username)
+
+invalidation_bus.subscribe(invalidation_bus.USERS, _invalidate_users)
+
+async def get_user_and_check_active(current_user: Annotated[UserNoPass, Depends(get_user)]) -> UserNoPass:
     if not current_user.active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await get_password_hasher().hash(password)
 
 
-def verify_password(input_password: str, bd_hashed_password: str):
-    return pwd_context.verify(input_password, bd_hashed_password)
+async def verify_password(input_password: str, bd_hashed_password: str):
+    return await get_password_hasher().verify(input_password, bd_hashed_password)
 
-def authenticate_user(username: str, password: str,
-                      database_service: Annotated[DatabaseService, Depends(database_provider)]):
-    user = database_service.get_user(username)
+async def authenticate_user(username: str, password: str,
+                      database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)]):
+    user = await database_service.get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    if not await verify_password(password, user.password):
         return False
     return user
 
 
-@router.post("/")
-async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
-    user = authenticate_user(database_service=database_provider(), username=form_data.username, password=form_data.password)
+@router.post("/", dependencies=[Depends(login_limit.per_client)])
+async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+                database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)]):
+    user = await authenticate_user(database_service=database_service, username=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect username or password")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -0,0 +1,40 @@
+import tempfile
+from pathlib import Path
+
+from app_config import config
+
+# Set before any application module reads them: tests never touch data_base/database.db or app.log
+config.set("database", "url", "sqlite:///:memory:")
+config.set("logging", "file", str(Path(tempfile.mkdtemp(prefix="lolitems-tests-")) / "app.log"))
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import exc
+
+import rate_limiting
+import security
+from data_base.database_service_impl import DatabaseServiceImpl
+from main import app
+from pydantic_classes import User
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limits(monkeypatch):
+    """Every test starts with full token buckets, whatever the tests before it spent."""
+    monkeypatch.setattr(rate_limiting, "rate_limit_store", rate_limiting.MemoryRateLimitStore())
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def auth_headers(client) -> dict:
+    """Bearer token of an active user. The password is never checked, so it is stored as it is."""
+    try:
+        DatabaseServiceImpl().create_user(User(user_name="tester", password="tester-password"))
+    except exc.IntegrityError:
+        pass
+    return {"Authorization": f"Bearer {security.create_access_token({'sub': 'tester'})}"}
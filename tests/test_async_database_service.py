@@ -0,0 +1,23 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from data_base import database_engine
+from data_base.async_database_service_impl import AsyncDatabaseServiceImpl
+from data_base.database_service_impl import DatabaseServiceImpl
+from pydantic_classes import Item
+
+
+def test_async_service_reads_what_the_sync_service_wrote():
+    item = Item(name="Async Read Sword", stats={"Armor": 15}, price=900, sell_price=630)
+    DatabaseServiceImpl().create(item)
+
+    async def read():
+        # A separate engine: its connections only see the sync engine's rows if the in-memory database is shared
+        engine = database_engine.build_async_engine()
+        try:
+            return await AsyncDatabaseServiceImpl(async_sessionmaker(engine, expire_on_commit=False)).get(item.name)
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(read()) == item
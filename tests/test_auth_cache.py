@@ -0,0 +1,25 @@
+import security
+from data_base.database_service_impl import DatabaseServiceImpl
+from pydantic_classes import User
+
+
+def _login(username: str) -> dict:
+    DatabaseServiceImpl().create_user(User(user_name=username, password="cached-password"))
+    return {"Authorization": f"Bearer {security.create_access_token({'sub': username})}"}
+
+
+def test_deactivated_user_is_rejected_at_once(client, auth_headers):
+    headers = _login("cached-deactivated")
+    assert client.get("/users/me", headers=headers).status_code == 200
+    assert len(security.user_cache) > 0
+    assert client.put("/users/deactivate/cached-deactivated", headers=auth_headers).status_code == 200
+    response = client.get("/users/me", headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Inactive user"
+
+
+def test_deleted_user_is_rejected_at_once(client, auth_headers):
+    headers = _login("cached-deleted")
+    assert client.get("/users/me", headers=headers).status_code == 200
+    assert client.delete("/users/cached-deleted", headers=auth_headers).status_code == 204
+    assert client.get("/users/me", headers=headers).status_code == 404
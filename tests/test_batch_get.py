@@ -0,0 +1,13 @@
+from data_base.database_service_impl import DatabaseServiceImpl
+from pydantic_classes import Item
+
+
+def test_repeated_names_come_back_once_and_missing_ones_are_listed(client):
+    for name in ("Batch Boots", "Batch Gloves"):
+        DatabaseServiceImpl().create(Item(name=name, stats={"Armor": 4}, price=300, sell_price=210))
+    response = client.post("/items/batch-get",
+                           json={"names": ["Batch Gloves", "Batch Missing", "Batch Boots", "Batch Gloves"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["name"] for item in body["items"]] == ["Batch Gloves", "Batch Boots"]
+    assert body["missing"] == ["Batch Missing"]
@@ -0,0 +1,92 @@
+import asyncio
+import itertools
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from build_optimizer import BuildOptimizer, Catalog
+from pydantic_classes import BuildRequest, Item, ResourceVersion, Stats
+
+
+def _catalog(count: int, seed: int, correlated: bool = False) -> list[Item]:
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        price = rng.randint(300, 3000)
+        if correlated:
+            # Stats in proportion to price make every item about as good per gold, the hardest case to prune
+            stats = {Stats.armor: price // 10 + rng.randint(0, 3)}
+        else:
+            stats = {stat: rng.randint(0, 60) for stat in rng.sample(list(Stats), 2)}
+        items.append(Item(name=f"Item {i}", stats=stats, price=price, sell_price=price * 0.7))
+    return items
+
+
+def _brute_force(items: list[Item], request: BuildRequest) -> float:
+    best = 0.0
+    for size in range(1, request.slots + 1):
+        for build in itertools.combinations(items, size):
+            if sum(item.price for item in build) <= request.budget:
+                best = max(best, sum(request.weights.get(stat, 0) * value
+                                     for item in build for stat, value in item.stats.items()))
+    return best
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_brute_force(seed):
+    items = _catalog(12, seed)
+    request = BuildRequest(weights={Stats.armor: 1.0, Stats.health: 0.5}, budget=4000, slots=3)
+    optimizer = BuildOptimizer(workers=1)
+    try:
+        build = optimizer._solve(Catalog(1, items), request, time_limit_ms=10000)
+    finally:
+        optimizer.shutdown()
+    assert build.optimal
+    assert build.score == pytest.approx(_brute_force(items, request))
+    assert build.cost <= request.budget and len(build.items) <= request.slots
+
+
+class _CatalogService:
+    def __init__(self, items: list[Item]):
+        self.items = items
+        self.version = 1
+
+    async def get_catalog_version(self) -> ResourceVersion:
+        return ResourceVersion(version=self.version, updated_at="2026-01-01T00:00:00")
+
+    async def iter_items(self, batch_size: int = 500):
+        for item in self.items:
+            yield item
+
+
+def test_time_limit_returns_the_best_build_so_far():
+    # Searching this catalog to the end takes many seconds
+    request = BuildRequest(weights={Stats.armor: 1.0}, budget=7000, slots=6, time_limit_ms=1)
+    optimizer = BuildOptimizer(workers=1)
+    try:
+        build = asyncio.run(optimizer.optimize(_CatalogService(_catalog(200, 7, correlated=True)), request))
+    finally:
+        optimizer.shutdown()
+    assert not build.optimal
+    assert build.items and build.cost <= request.budget
+    # Only complete searches are cached
+    assert len(optimizer.cache) == 0
+
+
+def test_optimizer_serves_more_than_one_event_loop():
+    # An app restarted in the same process (or one test client after another) runs on a new loop
+    optimizer = BuildOptimizer(workers=1)
+    service = _CatalogService(_catalog(12, 0))
+
+    async def concurrent_requests(version: int):
+        service.version = version
+        requests = [BuildRequest(weights={Stats.armor: weight}, budget=4000, slots=3) for weight in (1.0, 2.0)]
+        return await asyncio.gather(*(optimizer.optimize(service, request) for request in requests))
+
+    try:
+        for version in (1, 2):
+            assert all(build.catalog_version == version for build in asyncio.run(concurrent_requests(version)))
+    finally:
+        optimizer.shutdown()
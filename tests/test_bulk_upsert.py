@@ -0,0 +1,70 @@
+from sqlalchemy import exc
+
+from data_base import item_changes
+from data_base.async_database_service_impl import AsyncDatabaseServiceImpl
+from data_base.database_provider import async_database_provider
+from data_base.database_service_impl import DatabaseServiceImpl
+from main import app
+from pydantic_classes import Item
+
+
+def _item(name: str, description: str, stats: dict) -> Item:
+    return Item(name=name, description=description, stats=stats, price=1000, sell_price=700)
+
+
+def test_conflicting_rows_replace_the_item_its_stats_and_search_entry():
+    service = DatabaseServiceImpl()
+    service.create(_item("Bulk Cloak", "woven cloak", {"Armor": 10}))
+    published = []
+
+    def listener(changes, catalog_version):
+        published.extend((name, version.version) for name, _, version in changes)
+
+    item_changes.add_listener(listener)
+    try:
+        upserted = service.bulk_upsert([_item("Bulk Cloak", "enchanted mantle", {"Health": 50}),
+                                        _item("Bulk Amulet", "plain amulet", {"Armor": 5})])
+    finally:
+        item_changes.remove_listener(listener)
+
+    assert upserted == 2
+    # Versions as RETURNING reported them: bumped on conflict, 1 for a new row
+    assert sorted(published) == [("Bulk Amulet", 1), ("Bulk Cloak", 2)]
+    item, version = service.get_versioned("Bulk Cloak")
+    assert version.version == 2
+    assert item.stats == {"Health": 50} and item.description == "enchanted mantle"
+    assert "Bulk Cloak" in service.search("mantle", prefix=False)
+    assert "Bulk Cloak" not in service.search("woven", prefix=False)
+
+
+def test_invalid_rows_are_reported_and_the_others_written(client, auth_headers):
+    rows = [{"name": "Bulk Ring", "stats": {"Armor": 3}, "price": 400, "sell_price": 280},
+            {"name": "Bulk Dagger", "stats": {}, "price": 100, "sell_price": 300},
+            "not an item"]
+    response = client.post("/items/bulk", json=rows, headers=auth_headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["upserted"] == 1
+    assert [(error["row"], error["name"]) for error in body["errors"]] == [(1, "Bulk Dagger"), (2, None)]
+    assert client.get("/items/Bulk Ring").status_code == 200
+    assert client.get("/items/Bulk Dagger").status_code == 404
+
+
+class _BrokenDatabase(AsyncDatabaseServiceImpl):
+    async def bulk_upsert(self, items: list[Item]) -> int:
+        raise exc.OperationalError("INSERT INTO items ...", {}, Exception("disk I/O error"))
+
+
+def _broken_database() -> AsyncDatabaseServiceImpl:
+    return _BrokenDatabase()
+
+
+def test_database_errors_are_not_leaked(client, auth_headers):
+    app.dependency_overrides[async_database_provider] = _broken_database
+    try:
+        response = client.post("/items/bulk", json=[{"name": "Bulk Shield", "stats": {}, "price": 1, "sell_price": 0}],
+                               headers=auth_headers)
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 500
+    assert response.json() == {"detail": "A database error occurred. Please try again later."}
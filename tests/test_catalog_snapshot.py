@@ -0,0 +1,55 @@
+import asyncio
+import gzip
+import json
+
+import catalog_snapshot
+import compression
+from catalog_snapshot import SnapshotStore
+from data_base.database_service_impl import DatabaseServiceImpl
+from pydantic_classes import Item, ResourceVersion
+
+
+def _items(count: int) -> list[Item]:
+    return [Item(name=f"Snapshot Item {i}", stats={"Armor": i}, price=100 + i, sell_price=70) for i in range(count)]
+
+
+class _CatalogService:
+    def __init__(self, items: list[Item]):
+        self.items = items
+
+    async def iter_items(self, batch_size: int = 500):
+        for item in self.items:
+            yield item
+
+
+def test_snapshot_is_compressed_chunk_by_chunk(monkeypatch):
+    monkeypatch.setattr(catalog_snapshot, "CHUNK_ITEMS", 2)
+    items = _items(5)
+    snapshot = asyncio.run(SnapshotStore().get(_CatalogService(items), 1))
+    assert "identity" not in snapshot.bodies
+    lines = gzip.decompress(snapshot.body("gzip")).splitlines()
+    assert [json.loads(line)["name"] for line in lines] == [item.name for item in items]
+    if compression.BROTLI_ENABLED:
+        assert compression.brotli.decompress(snapshot.body("br")) == gzip.decompress(snapshot.body("gzip"))
+
+
+def test_snapshot_store_serves_more_than_one_event_loop():
+    store, service = SnapshotStore(), _CatalogService(_items(3))
+
+    async def concurrent_requests(version: int):
+        return await asyncio.gather(*(store.get(service, version) for _ in range(3)))
+
+    for version in (1, 2):
+        assert {snapshot.version for snapshot in asyncio.run(concurrent_requests(version))} == {version}
+    assert store.builds == 2
+
+
+def test_dump_is_precompressed_or_streamed(client):
+    for item in _items(3):
+        DatabaseServiceImpl().create(item)
+    compressed = client.get("/items/", params={"format": "ndjson"}, headers={"Accept-Encoding": "gzip"})
+    streamed = client.get("/items/", params={"format": "ndjson"}, headers={"Accept-Encoding": "identity"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in streamed.headers
+    assert compressed.text == streamed.text
+    assert {"Snapshot Item 0", "Snapshot Item 2"} <= {json.loads(line)["name"] for line in streamed.text.splitlines()}
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import change_feed
+from change_feed import ChangeFeed
+from data_base.database_service_impl import DatabaseServiceImpl
+from pydantic_classes import Item, ResourceVersion
+
+
+def _change(name: str, price: float, version: int = 1):
+    return name, Item(name=name, stats={"Armor": 1}, price=price, sell_price=0), \
+        ResourceVersion(version=version, updated_at=datetime(2026, 1, 1))
+
+
+async def _collect(feed: ChangeFeed, subscription, count: int) -> list:
+    events = feed.events(subscription, heartbeat=0.05)
+    try:
+        return [event async for event in events if event is not None][:count]
+    finally:
+        await events.aclose()
+
+
+def test_write_right_after_subscribing_is_delivered():
+    async def run():
+        feed = ChangeFeed()
+        subscription = feed.subscribe()
+        # Committed before the stream is first read, e.g. while the response headers are on their way
+        feed.apply([_change("Feed Sword", 100)], None)
+        feed.close()
+        return await _collect(feed, subscription, 1)
+
+    events = asyncio.run(run())
+    assert [(event.seq, event.type) for event in events] == [(1, "created")]
+
+
+def test_slow_subscriber_is_dropped_and_can_resume():
+    async def run():
+        feed = ChangeFeed(replay_size=50, subscriber_buffer=2)
+        subscription = feed.subscribe()
+        for price in range(1, 6):
+            feed.apply([_change("Feed Bow", price, price)], None)
+        await asyncio.sleep(0)
+        dropped = await _collect(feed, subscription, 5)
+        assert feed.stats()["subscribers"] == 0
+        resumed = feed.subscribe(after=dropped[-1].seq)
+        feed.close()
+        return dropped, await _collect(feed, resumed, 5)
+
+    before = change_feed.change_feed_dropped._values.get((), 0)
+    dropped, resumed = asyncio.run(run())
+    # Nothing buffered is handed out once dropped, the client resumes from the last seq it got
+    assert [(event.seq, event.type) for event in dropped] == [(0, "dropped")]
+    assert [event.seq for event in resumed] == [1, 2, 3, 4, 5]
+    assert change_feed.change_feed_dropped._values.get((), 0) == before + 1
+
+
+def test_unread_subscription_is_let_go_once_full():
+    async def run():
+        feed = ChangeFeed(subscriber_buffer=1, max_subscribers=1)
+        feed.subscribe()
+        with pytest.raises(HTTPException) as raised:
+            feed.subscribe()
+        assert raised.value.status_code == 503
+        feed.apply([_change("Feed Axe", 1)], None)
+        feed.apply([_change("Feed Axe", 2, 2)], None)
+        await asyncio.sleep(0)
+        feed.apply([_change("Feed Axe", 3, 3)], None)
+        return feed.stats()["subscribers"]
+
+    assert asyncio.run(run()) == 0
+
+
+def test_last_event_id_resumes_the_stream(client):
+    for i in range(3):
+        DatabaseServiceImpl().create(Item(name=f"Feed Item {i}", stats={}, price=100, sell_price=70))
+    feed = change_feed.get_change_feed()
+    responses = []
+    reader = threading.Thread(target=lambda: responses.append(
+        client.get("/items/changes", headers={"Last-Event-ID": str(feed.seq - 2)})))
+    reader.start()
+    deadline = time.monotonic() + 5
+    while feed.stats()["subscribers"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # The test client only returns once the stream ends
+    feed.close()
+    reader.join(5)
+    response = responses[0]
+    assert response.status_code == 200
+    data = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert [event["name"] for event in data] == ["Feed Item 1", "Feed Item 2"]
+    assert [event["seq"] for event in data] == [feed.seq - 1, feed.seq]
@@ -0,0 +1,25 @@
+from data_base.database_service_impl import DatabaseServiceImpl
+from pydantic_classes import Item
+
+
+def _item(price: float) -> Item:
+    return Item(name="Conditional Staff", stats={"Health": 300}, price=price, sell_price=price * 0.7)
+
+
+def test_matching_etag_gets_304_until_the_item_changes(client):
+    service = DatabaseServiceImpl()
+    service.create(_item(1500))
+    first = client.get("/items/Conditional Staff")
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and "last-modified" in first.headers
+
+    cached = client.get("/items/Conditional Staff", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    service.update("Conditional Staff", _item(1600))
+    changed = client.get("/items/Conditional Staff", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["price"] == 1600
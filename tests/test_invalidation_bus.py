@@ -0,0 +1,60 @@
+import queue
+
+from data_base import invalidation_bus
+from data_base.invalidation_bus import CHANNEL, BrokerBus, InMemoryBroker
+
+TOPIC = "test"
+
+
+class LossyBroker(InMemoryBroker):
+    """Loses the publishes whose (1-based) numbers are in lost, as a full buffer or a broker outage would."""
+
+    def __init__(self, lost: set[int]):
+        super().__init__()
+        self.lost = lost
+        self.published = 0
+
+    def publish(self, channel: str, payload: bytes):
+        self.published += 1
+        if self.published not in self.lost:
+            super().publish(channel, payload)
+
+
+def _round_trip(broker: InMemoryBroker, messages: list[list[str]], expected: int,
+                garbage: tuple[bytes, ...] = ()) -> list:
+    received = queue.Queue()
+    handler = received.put
+    invalidation_bus.subscribe(TOPIC, handler)
+    sender, receiver = BrokerBus(broker), BrokerBus(broker)
+    sender.start()
+    receiver.start()
+    try:
+        for payload in garbage:
+            broker.publish(CHANNEL, payload)
+        for keys in messages:
+            sender.publish(TOPIC, keys)
+        return [received.get(timeout=5) for _ in range(expected)]
+    finally:
+        sender.stop()
+        receiver.stop()
+        invalidation_bus.unsubscribe(TOPIC, handler)
+
+
+def test_keys_reach_the_other_bus():
+    assert _round_trip(InMemoryBroker(), [["Sword"], ["Bow", "Shield"]], 2) == [["Sword"], ["Bow", "Shield"]]
+
+
+def test_missed_message_flushes_the_topic():
+    gaps = invalidation_bus.invalidation_gaps._values.get((), 0)
+    # The second message is lost, the third one shows the gap: flush everything, then its own keys
+    deliveries = _round_trip(LossyBroker(lost={2}), [["Sword"], ["Shield"], ["Bow"]], 3)
+    assert deliveries == [["Sword"], None, ["Bow"]]
+    assert invalidation_bus.invalidation_gaps._values.get((), 0) == gaps + 1
+
+
+def test_malformed_message_does_not_stop_the_receiver():
+    failures = invalidation_bus.invalidation_failures._values.get(("decode",), 0)
+    deliveries = _round_trip(InMemoryBroker(), [["Sword"]], 1, garbage=(b"not json", b'{"origin": "elsewhere"}'))
+    assert deliveries == [["Sword"]]
+    # Sender and receiver both read the channel, each fails on both bad payloads
+    assert invalidation_bus.invalidation_failures._values.get(("decode",), 0) == failures + 4
@@ -0,0 +1,65 @@
+import pytest
+from fastapi import HTTPException
+
+from data_base.cached_database_service import CachedDatabaseService
+from data_base.database_service_impl import DatabaseServiceImpl
+from data_base.sqlalchemy_db_classes import BDItem
+from data_base.ttl_cache import TTLCache
+from pydantic_classes import Item
+
+
+def _item(name: str, price: float) -> Item:
+    return Item(name=name, stats={"Magic Resist": 25}, price=price, sell_price=price * 0.7)
+
+
+class _CountingService(DatabaseServiceImpl):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+        self.during_read = None
+
+    def get_versioned(self, name: str):
+        self.reads += 1
+        entry = super().get_versioned(name)
+        if self.during_read is not None:
+            self.during_read()
+        return entry
+
+
+def test_reads_go_through_the_cache_until_a_write():
+    database = _CountingService()
+    service = CachedDatabaseService(database, TTLCache())
+    service.create(_item("Cached Veil", 1000))
+    assert service.get("Cached Veil").price == 1000
+    assert service.get("Cached Veil").price == 1000
+    assert database.reads == 1
+
+    service.update("Cached Veil", _item("Cached Veil", 1100))
+    assert service.get("Cached Veil").price == 1100
+    assert database.reads == 2
+
+    service.delete("Cached Veil", BDItem)
+    with pytest.raises(HTTPException) as raised:
+        service.get("Cached Veil")
+    assert raised.value.status_code == 404
+
+
+def test_read_overtaken_by_a_write_is_not_cached():
+    database = _CountingService()
+    service = CachedDatabaseService(database, TTLCache())
+    service.create(_item("Cached Mask", 900))
+    # The write lands while the read is on its way back with the old row
+    database.during_read = lambda: service.update("Cached Mask", _item("Cached Mask", 950))
+    assert service.get("Cached Mask").price == 900
+    database.during_read = None
+    assert service.get("Cached Mask").price == 950
+    assert database.reads == 2
+
+
+def test_entries_expire():
+    cache = TTLCache(ttl_seconds=60)
+    cache.set("fresh", 1)
+    cache.set("stale", 2, ttl_seconds=0)
+    assert cache.get("fresh") == 1
+    assert cache.get("stale") is None
+    assert cache.expirations == 1
@@ -0,0 +1,10 @@
+from data_base.database_service_impl_as_dict import MemoryCatalog
+from pydantic_classes import User
+
+
+def test_changing_a_returned_user_leaves_the_catalog_alone():
+    catalog = MemoryCatalog()
+    catalog.set_user(User(user_name="summoner", password="secret-password", active=True))
+    user = catalog.get_user("summoner")
+    user.active = False
+    assert catalog.get_user("summoner").active
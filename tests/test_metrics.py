@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+
+from main import app
+
+
+def _sample(body: str, series: str) -> float:
+    for line in body.splitlines():
+        if line.startswith(series + " "):
+            return float(line.split()[1])
+    return 0.0
+
+
+def test_requests_are_counted_by_route_template():
+    series = 'http_requests_total{method="GET",route="/items/{item_name}",status="404"}'
+    with TestClient(app) as client:
+        before = _sample(client.get("/metrics").text, series)
+        assert client.get("/items/No Such Item").status_code == 404
+        assert client.get("/items/Another Missing Item").status_code == 404
+        body = client.get("/metrics").text
+    assert _sample(body, series) == before + 2
+    # Labelled by template, never by the raw path
+    assert "No Such Item" not in body
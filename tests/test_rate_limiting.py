@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+from fastapi import Depends, FastAPI
+
+from rate_limiting import RouteLimit
+
+bucket = RouteLimit("test_bucket", rate=0.5, burst=2)
+cap = RouteLimit("test_cap", rate=0, burst=0, concurrency=1)
+
+app = FastAPI()
+
+
+@app.get("/bucket", dependencies=[Depends(bucket.per_client)])
+async def bucket_route():
+    return {}
+
+
+@app.get("/cap", dependencies=[Depends(cap.per_client)])
+async def cap_route():
+    await app.state.release.wait()
+    return {}
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def test_empty_bucket_answers_429_with_retry_after():
+    async def run():
+        async with _client() as client:
+            return [await client.get("/bucket") for _ in range(3)]
+
+    responses = asyncio.run(run())
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    # One token comes back every 2 seconds
+    assert responses[2].headers["retry-after"] == "2"
+
+
+def test_requests_beyond_the_concurrency_cap_get_503():
+    async def run():
+        app.state.release = asyncio.Event()
+        async with _client() as client:
+            first = asyncio.create_task(client.get("/cap"))
+            while cap.in_flight == 0:
+                await asyncio.sleep(0.001)
+            second = await client.get("/cap")
+            app.state.release.set()
+            return await first, second
+
+    first, second = asyncio.run(run())
+    assert first.status_code == 200
+    assert second.status_code == 503 and second.headers["retry-after"] == "1"
+    assert cap.in_flight == 0
+
+
+def test_catalog_scans_are_limited_per_client(client):
+    # item_scan allows a burst of 20 unpaged reads of the whole catalog
+    statuses = [client.get("/items/").status_code for _ in range(21)]
+    assert 429 not in statuses[:20]
+    assert statuses[20] == 429
+    # Paged reads don't count
+    assert client.get("/items/", params={"limit": 10}).status_code != 429
@@ -0,0 +1,32 @@
+from data_base.database_service_impl import DatabaseServiceImpl
+from data_base.sqlalchemy_db_classes import BDItem
+from pydantic_classes import Item
+
+
+def _item(name: str) -> Item:
+    return Item(name=name, description="forged in Piltover", stats={"Armor": 8}, price=600, sell_price=420)
+
+
+def test_renamed_item_is_found_by_its_new_name_only():
+    service = DatabaseServiceImpl()
+    service.create(_item("Searchable Bracer"))
+    assert service.search("Bracer", prefix=False) == ["Searchable Bracer"]
+    service.update("Searchable Bracer", _item("Searchable Gauntlet"))
+    assert service.search("Bracer", prefix=False) == []
+    assert service.search("Gauntlet", prefix=False) == ["Searchable Gauntlet"]
+    assert "Searchable Gauntlet" in service.search("Piltover", prefix=False)
+
+
+def test_deleted_item_leaves_the_index():
+    service = DatabaseServiceImpl()
+    service.create(_item("Searchable Quiver"))
+    assert service.search("Quiv") == ["Searchable Quiver"]
+    service.delete("Searchable Quiver", BDItem)
+    assert service.search("Quiv") == []
+
+
+def test_search_endpoint(client):
+    DatabaseServiceImpl().create(_item("Searchable Lantern"))
+    response = client.get("/items/search", params={"q": "searchable lant", "full": True})
+    assert response.status_code == 200
+    assert [item["name"] for item in response.json()["items"]] == ["Searchable Lantern"]
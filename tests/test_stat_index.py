@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from data_base import database_engine, item_changes
+from data_base.database_service_impl import DatabaseServiceImpl
+from data_base.stat_index import StatIndex, parse_condition, parse_sort_key
+from pydantic_classes import Item
+
+
+def _item(name: str, price: float, **stats: int) -> Item:
+    return Item(name=name, stats={stat.replace("_", " "): value for stat, value in stats.items()},
+                price=price, sell_price=price * 0.7)
+
+
+def _index(*items: Item) -> StatIndex:
+    index = StatIndex(capacity=2)
+    index.apply([(item.name, item, None) for item in items], None)
+    return index
+
+
+def test_conditions_and_required_stats_filter():
+    index = _index(_item("Plate", 900, Armor=40), _item("Robe", 700, Magic_Resist=30),
+                   _item("Mail", 1200, Armor=25, Health=100))
+    assert index.query([parse_condition("Armor>=25")]) == (2, [("Mail", None), ("Plate", None)])
+    assert index.query([parse_condition("Armor>=25"), parse_condition("price < 1000")]) == (1, [("Plate", None)])
+    # A missing stat counts as 0 in conditions, stats= asks for the stat itself
+    assert index.query([parse_condition("Health<1")])[0] == 2
+    assert index.query(stats={"Health"}) == (1, [("Mail", None)])
+
+
+def test_sort_key_ranks_and_skips_undefined_ratios():
+    index = _index(_item("Plate", 1000, Armor=40, Health=200), _item("Mail", 500, Armor=30, Health=100),
+                   _item("Ward", 300, Armor=5), _item("Robe", 800, Magic_Resist=30))
+    total, ranked = index.query(sort=parse_sort_key("Armor/Health"), limit=1)
+    # Ward and Robe have no Health to divide by and are left out
+    assert total == 2
+    assert ranked == [("Mail", 0.3)]
+    _, ranked = index.query(sort=parse_sort_key("Armor+Magic Resist"), descending=False)
+    # Mail and Robe tie at 30, names break the tie
+    assert [name for name, _ in ranked] == ["Ward", "Mail", "Robe", "Plate"]
+
+
+def test_index_follows_committed_writes():
+    service = DatabaseServiceImpl()
+    service.create(_item("Indexed Helm", 500, Armor=10))
+    index = StatIndex()
+    with database_engine.get_session_factory()() as session:
+        index.load(session)
+    item_changes.add_listener(index.apply)
+    try:
+        assert index.query([parse_condition("Armor>=50")])[1] == []
+        service.update("Indexed Helm", _item("Indexed Helm", 500, Armor=60))
+        assert index.query([parse_condition("Armor>=50")])[1] == [("Indexed Helm", None)]
+        service.update("Indexed Helm", _item("Indexed Crown", 500, Armor=60))
+        assert index.query([parse_condition("Armor>=50")])[1] == [("Indexed Crown", None)]
+    finally:
+        item_changes.remove_listener(index.apply)
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from data_base import database_engine, item_changes, session_operations
+from data_base.write_queue import WriteQueue
+from pydantic_classes import Item
+
+
+def _item(name: str) -> Item:
+    return Item(name=name, stats={"Health": 200}, price=800, sell_price=560)
+
+
+def _create_then_fail(session, item: Item):
+    # Fails after its rows were flushed and its change recorded, only its savepoint may be rolled back
+    session_operations.create_item(session, item)
+    raise RuntimeError("write failed")
+
+
+def test_group_commit_keeps_the_writes_around_a_failing_one(tmp_path):
+    url = f"sqlite:///{tmp_path / 'group_commit.db'}"
+    engine = database_engine.build_engine(url)
+    database_engine.create_schema(engine)
+    sessions = sessionmaker(engine)
+    with sessions() as session:
+        before = session_operations.get_catalog_version(session).version
+    published = []
+
+    def listener(changes, catalog_version):
+        published.append(([name for name, _, _ in changes], catalog_version))
+
+    async def write():
+        async_engine = database_engine.build_async_engine(database_engine._to_async_url(url), explicit_begin=True)
+        queue = WriteQueue(async_sessionmaker(async_engine, expire_on_commit=False), max_delay=0.1)
+        queue.start()
+        try:
+            return await asyncio.gather(
+                queue.submit(session_operations.create_item, _item("Group Ruby")),
+                queue.submit(_create_then_fail, _item("Group Failed")),
+                queue.submit(session_operations.create_item, _item("Group Sapphire")),
+                return_exceptions=True), queue.commits
+        finally:
+            await queue.stop()
+            await async_engine.dispose()
+
+    item_changes.add_listener(listener)
+    try:
+        results, commits = asyncio.run(write())
+    finally:
+        item_changes.remove_listener(listener)
+
+    assert results[0] == "Group Ruby" and results[2] == "Group Sapphire"
+    assert isinstance(results[1], RuntimeError)
+    assert commits == 1
+    with sessions() as session:
+        assert set(session_operations.get_items(session, ["Group Ruby", "Group Failed", "Group Sapphire"])) == \
+               {"Group Ruby", "Group Sapphire"}
+        catalog_version = session_operations.get_catalog_version(session)
+    engine.dispose()
+    # One publish for the group, without the rolled back write, and one catalog version bump
+    assert catalog_version.version == before + 1
+    assert published == [(["Group Ruby", "Group Sapphire"], catalog_version)]
+
+
+def test_full_queue_answers_503():
+    queue = WriteQueue(max_queue=0)
+    queue._queue = asyncio.Queue()
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(queue.submit(session_operations.create_item, _item("Group Rejected")))
+    assert raised.value.status_code == 503
+    assert queue.rejected == 1
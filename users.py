@@ -4,9 +4,9 @@ from typing import Annotated
 from sqlalchemy import exc
 from starlette import status
 
-from security import get_user_and_check_active, hash_password, get_user
-from data_base.database_provider import database_provider
-from data_base.database_service import DatabaseService
+from security import get_user_and_check_active, hash_password, invalidate_user, get_user as get_current_user
+from data_base.database_provider import async_database_provider
+from data_base.database_service import AsyncDatabaseService
 from data_base.sqlalchemy_db_classes import BDUser
 from pydantic_classes import User, UserNoPass
 
@@ -22,11 +22,11 @@ async def read_users_me(current_user: Annotated[UserNoPass, Depends(get_user_and
 
 @router.get("/{user_name}", response_model=User, response_model_exclude={'password'})
 async def get_user(user_name: str,
-                    database_service: Annotated[DatabaseService, Depends(database_provider)],
-                    current_user: Annotated[UserNoPass, Depends(get_user)]):
+                    database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                    current_user: Annotated[UserNoPass, Depends(get_current_user)]):
     try:
         if current_user:
-            return database_service.get_user(user_name)
+            return await database_service.get_user(user_name)
     except exc.SQLAlchemyError as e:
         print(f"Database error: {e}")
         raise HTTPException(
@@ -38,12 +38,12 @@ async def get_user(user_name: str,
 
 @router.post("/")
 async def create_user(user: User,
-                      database_service: Annotated[DatabaseService, Depends(database_provider)],
-                      current_user: Annotated[UserNoPass, Depends(get_user)]):
+                      database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                      current_user: Annotated[UserNoPass, Depends(get_current_user)]):
     try:
         if current_user:
-            user.password = hash_password(user.password)
-            return database_service.create_user(user)
+            user.password = await hash_password(user.password)
+            return await database_service.create_user(user)
     except exc.SQLAlchemyError as e:
         print(f"Database error: {e}")
         raise HTTPException(
@@ -55,13 +55,15 @@ async def create_user(user: User,
 
 @router.put("/{user_name}", response_model=User, response_model_exclude={'password'})
 async def update_user(user_name: str, user: User,
-                      database_service: Annotated[DatabaseService, Depends(database_provider)],
-                      current_user: Annotated[UserNoPass, Depends(get_user)]):
+                      database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                      current_user: Annotated[UserNoPass, Depends(get_current_user)]):
     try:
         if current_user:
             if user.password:
-                user.password = hash_password(user.password)
-            return database_service.update_user(user_name, user)
+                user.password = await hash_password(user.password)
+            updated_user = await database_service.update_user(user_name, user)
+            invalidate_user(user_name)
+            return updated_user
     except exc.SQLAlchemyError as e:
         print(f"Database error: {e}")
         raise HTTPException(
@@ -73,13 +75,15 @@ async def update_user(user_name: str, user: User,
 
 @router.put("/deactivate/{user_name}", response_model=User, response_model_exclude={'password'})
 async def deactivate_user(user_name: str,
-                          database_service: Annotated[DatabaseService, Depends(database_provider)],
-                          current_user: Annotated[UserNoPass, Depends(get_user)]):
+                          database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                          current_user: Annotated[UserNoPass, Depends(get_current_user)]):
     try:
         if current_user:
-            user = database_service.get_user(user_name)
+            user = await database_service.get_user(user_name)
             user.active = False
-            return database_service.update_user(user_name, user)
+            updated_user = await database_service.update_user(user_name, user)
+            invalidate_user(user_name)
+            return updated_user
     except exc.SQLAlchemyError as e:
         print(f"Database error: {e}")
         raise HTTPException(
@@ -92,11 +96,13 @@ async def deactivate_user(user_name: str,
 
 @router.delete("/{user_name}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(user_name: str,
-                      database_service: Annotated[DatabaseService, Depends(database_provider)],
-                      current_user: Annotated[UserNoPass, Depends(get_user)]):
+                      database_service: Annotated[AsyncDatabaseService, Depends(async_database_provider)],
+                      current_user: Annotated[UserNoPass, Depends(get_current_user)]):
     try:
         if current_user:
-            return database_service.delete(user_name, BDUser)
+            deleted = await database_service.delete(user_name, BDUser)
+            invalidate_user(user_name)
+            return deleted
     except exc.SQLAlchemyError as e:
         print(f"Database error: {e}")
         raise HTTPException(